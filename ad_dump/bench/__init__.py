@@ -0,0 +1 @@
+# ad_dump/bench/__init__.py
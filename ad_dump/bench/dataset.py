@@ -0,0 +1,151 @@
+# ad_dump/bench/dataset.py
+"""Deterministic synthetic directory for the benchmark harness."""
+import random
+
+BASE_DN = 'DC=bench,DC=example,DC=com'
+USERS_OU = f'OU=Users,{BASE_DN}'
+GROUPS_OU = f'OU=Groups,{BASE_DN}'
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Charles', 'Karen', 'Daniel', 'Lisa', 'Matthew', 'Nancy', 'Anthony', 'Betty', 'Mark', 'Sandra',
+               'Wei', 'Priya', 'Ahmed', 'Fatima', 'Hiroshi', 'Yuki', 'Olga', 'Ivan', 'Carlos', 'Lucia']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore',
+              'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Nguyen',
+              'Patel', 'Kim', 'Chen', 'Singh', 'Kowalski', 'Novak', 'Rossi', 'Muller', 'Dubois', 'Silva']
+DEPARTMENTS = ['Engineering', 'Sales', 'Marketing', 'Finance', 'Human Resources', 'Legal', 'Operations',
+               'Support', 'Research', 'IT']
+TITLES = ['Engineer', 'Senior Engineer', 'Manager', 'Director', 'Analyst', 'Specialist', 'Coordinator',
+          'Consultant', 'Administrator', 'Associate']
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+# Every user has a manager this many levels up the tree
+MANAGER_FAN_OUT = 8
+GROUPS_PER_USER = 3
+NESTED_GROUP_SHARE = 0.05
+
+
+def parse_size(value):
+    value = str(value).lower()
+    return SIZES[value] if value in SIZES else int(value)
+
+
+def _user_dn(i):
+    return f'CN=User {i:07d},{USERS_OU}'
+
+
+def _group_dn(name):
+    return f'CN={name},{GROUPS_OU}'
+
+
+class Dataset:
+    """What the generator produced, so scenarios can pick realistic keys."""
+
+    def __init__(self):
+        self.users = 0
+        self.sam_names = []
+        self.name_fragments = []
+        self.groups = []        # ordinary group DNs
+        self.large_groups = []  # group DNs past MaxValRange
+        self.nested_groups = []  # groups with nested subgroups
+
+
+def generate(directory, users, seed=1):
+    """Fill ``directory`` (the fake's Directory) with users and groups.
+
+    Besides ordinary groups it creates "Everyone" with every user and
+    "Large Team" with a tenth of them, plus a hierarchy of nested groups
+    for transitive membership.
+    """
+    rng = random.Random(seed)
+    dataset = Dataset()
+    dataset.users = users
+    group_count = max(10, users // 50)
+    group_names = [f'Group {j:05d}' for j in range(group_count)]
+    members = {name: [] for name in group_names}
+    members['Everyone'] = []
+    members['Large Team'] = []
+
+    user_groups = []
+    for i in range(users):
+        chosen = {group_names[rng.randrange(group_count)] for _ in range(GROUPS_PER_USER)}
+        chosen.add('Everyone')
+        if i % 10 == 0:
+            chosen.add('Large Team')
+        for name in chosen:
+            members[name].append(_user_dn(i).encode())
+        user_groups.append(sorted(chosen))
+
+    # Nest the first few percent of groups under each other, four per parent
+    nested = max(4, int(group_count * NESTED_GROUP_SHARE))
+    parents = {}
+    for j in range(1, nested):
+        parent = group_names[(j - 1) // 4]
+        parents[group_names[j]] = parent
+        members[parent].append(_group_dn(group_names[j]).encode())
+
+    usn = 1000
+    for i in range(users):
+        first = FIRST_NAMES[rng.randrange(len(FIRST_NAMES))]
+        last = LAST_NAMES[rng.randrange(len(LAST_NAMES))]
+        sam = f'{first[0]}{last}{i}'.lower()
+        usn += 1
+        attrs = {
+            'objectClass': [b'top', b'person', b'organizationalPerson', b'user'],
+            'name': [f'{first} {last} {i}'.encode()],
+            'givenName': [first.encode()],
+            'sn': [last.encode()],
+            'displayName': [f'{first} {last}'.encode()],
+            'sAMAccountName': [sam.encode()],
+            'userPrincipalName': [f'{sam}@bench.example.com'.encode()],
+            'mail': [f'{first}.{last}{i}@bench.example.com'.lower().encode()],
+            'employeeID': [str(100000 + i).encode()],
+            'department': [DEPARTMENTS[rng.randrange(len(DEPARTMENTS))].encode()],
+            'title': [TITLES[rng.randrange(len(TITLES))].encode()],
+            'telephoneNumber': [f'+1 555 {i:07d}'.encode()],
+            'company': [b'Bench Corp'],
+            'userAccountControl': [b'514' if rng.random() < 0.05 else b'512'],
+            'whenCreated': [b'20200101000000.0Z'],
+            'whenChanged': [b'20240101000000.0Z'],
+            'uSNChanged': [str(usn).encode()],
+            'objectGUID': [rng.getrandbits(128).to_bytes(16, 'little')],
+            'memberOf': [_group_dn(name).encode() for name in user_groups[i]],
+        }
+        if i:
+            attrs['manager'] = [_user_dn((i - 1) // MANAGER_FAN_OUT).encode()]
+        directory.add(_user_dn(i), attrs)
+        if i % max(1, users // 1000) == 0:
+            dataset.sam_names.append(sam)
+            dataset.name_fragments.append(last[:4].lower())
+
+    for name, values in members.items():
+        usn += 1
+        attrs = {
+            'objectClass': [b'top', b'group'],
+            'name': [name.encode()],
+            'sAMAccountName': [name.replace(' ', '_').encode()],
+            'description': [f'{name} synthetic group'.encode()],
+            'groupType': [b'-2147483646'],
+            'member': values,
+            'managedBy': [_user_dn(0).encode()],
+            'whenCreated': [b'20200101000000.0Z'],
+            'whenChanged': [b'20240101000000.0Z'],
+            'uSNChanged': [str(usn).encode()],
+            'objectGUID': [rng.getrandbits(128).to_bytes(16, 'little')],
+        }
+        if name in parents:
+            attrs['memberOf'] = [_group_dn(parents[name]).encode()]
+        directory.add(_group_dn(name), attrs)
+        if len(values) > 1500:
+            dataset.large_groups.append(_group_dn(name))
+        elif name.startswith('Group '):
+            dataset.groups.append(_group_dn(name))
+
+    dataset.nested_groups = [_group_dn(group_names[0])]
+    directory.add('', {
+        'objectClass': [b'top'],
+        'highestCommittedUSN': [str(usn).encode()],
+        'dsServiceName': [b'CN=NTDS Settings,CN=BENCH-DC1'],
+    })
+    return dataset
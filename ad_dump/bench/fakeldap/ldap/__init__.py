@@ -0,0 +1,501 @@
+# ad_dump/bench/fakeldap/ldap/__init__.py
+"""In-process stand-in for the parts of python-ldap the backend uses.
+
+Only for the benchmark harness: it answers searches from an indexed,
+in-memory directory so runs are reproducible without a domain
+controller. Equality, prefix (``q*``) and ANR terms on common
+attributes use an index; medial and final substring terms scan, as they
+do on a real DC without a tuple index.
+AD behaviour the backend relies on is modelled: paged results,
+``member;range=`` retrieval past MaxValRange, LDAP_MATCHING_RULE_IN_CHAIN
+and ANR.
+"""
+import bisect
+import itertools
+import os
+import threading
+import time
+
+SCOPE_BASE = 0
+SCOPE_ONELEVEL = 1
+SCOPE_SUBTREE = 2
+OPT_REFERRALS = 8
+OPT_NETWORK_TIMEOUT = 20485
+OPT_TIMEOUT = 20482
+OPT_DESC = 1
+RES_ANY = -1
+RES_SEARCH_RESULT = 101
+
+IN_CHAIN_RULE = '1.2.840.113556.1.4.1941'
+BIT_AND_RULE = '1.2.840.113556.1.4.803'
+MAX_VAL_RANGE = 1500
+INDEXED = {'objectclass', 'samaccountname', 'userprincipalname', 'employeeid', 'mail', 'member',
+           'memberof', 'manager', 'objectguid', 'name', 'displayname', 'givenname', 'sn', 'proxyaddresses'}
+ANR_ATTRIBUTES = ('name', 'displayname', 'givenname', 'sn', 'samaccountname', 'mail', 'proxyaddresses')
+
+# Simulated round trip per result call, in seconds
+LATENCY = 0.0
+
+
+class LDAPError(Exception):
+    pass
+
+
+class SERVER_DOWN(LDAPError):
+    pass
+
+
+class INVALID_CREDENTIALS(LDAPError):
+    pass
+
+
+class TIMEOUT(LDAPError):
+    pass
+
+
+class CONNECT_ERROR(LDAPError):
+    pass
+
+
+class BUSY(LDAPError):
+    pass
+
+
+class UNAVAILABLE(LDAPError):
+    pass
+
+
+class SIZELIMIT_EXCEEDED(LDAPError):
+    pass
+
+
+class NO_SUCH_OBJECT(LDAPError):
+    pass
+
+
+class FILTER_ERROR(LDAPError):
+    pass
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace').lower() if isinstance(value, bytes) else str(value).lower()
+
+
+def _substring(value, parts):
+    if not value.startswith(parts[0]):
+        return False
+    pos = len(parts[0])
+    for part in parts[1:-1]:
+        pos = value.find(part, pos)
+        if pos < 0:
+            return False
+        pos += len(part)
+    return value.endswith(parts[-1]) and len(value) - len(parts[-1]) >= pos
+
+
+def _unescape(value):
+    out = []
+    i = 0
+    while i < len(value):
+        if value[i] == '\\':
+            out.append(chr(int(value[i + 1:i + 3], 16)))
+            i += 3
+        else:
+            out.append(value[i])
+            i += 1
+    return ''.join(out)
+
+
+def _parse(f, i=0):
+    if f[i] != '(':
+        raise FILTER_ERROR({'desc': 'Bad search filter'})
+    i += 1
+    if f[i] in '&|':
+        op = f[i]
+        i += 1
+        subs = []
+        while f[i] == '(':
+            sub, i = _parse(f, i)
+            subs.append(sub)
+        return (op, subs), i + 1
+    if f[i] == '!':
+        sub, i = _parse(f, i + 1)
+        return ('!', sub), i + 1
+    j = f.index(')', i)
+    attr, value = f[i:j].split('=', 1)
+    if attr.endswith(('>', '<')):
+        return (attr[-1] + '=', attr[:-1].lower(), _unescape(value)), j + 1
+    if ':' in attr:
+        attr, rule = attr.rstrip(':').split(':', 1)
+        if rule == IN_CHAIN_RULE:
+            return ('chain', attr.lower(), _unescape(value).lower()), j + 1
+        return ('bit_and' if rule == BIT_AND_RULE else 'ext', attr.lower(), _unescape(value)), j + 1
+    if value == '*':
+        return ('present', attr.lower()), j + 1
+    if '*' in value:
+        return ('sub', attr.lower(), [_unescape(part).lower() for part in value.split('*')]), j + 1
+    return ('eq', attr.lower(), _unescape(value).lower()), j + 1
+
+
+def parse_filter(filterstr):
+    node, _ = _parse(filterstr)
+    return node
+
+
+class Directory:
+    def __init__(self):
+        self.entries = {}   # dn -> {attr: [bytes]}
+        self.by_lower = {}  # lowercased dn -> dn
+        self.index = {}     # (attr, lowercased value) -> set of dns
+        self.names = {}     # lowercased attribute name -> name as stored
+        self._sorted = {}   # attr -> sorted indexed values, for prefix terms
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, dn, attrs):
+        with self._lock:
+            self.entries[dn] = attrs
+            self.by_lower[dn.lower()] = dn
+            self._sorted = {}
+            for attr, values in attrs.items():
+                key = attr.lower()
+                self.names.setdefault(key, attr)
+                if key in INDEXED:
+                    for value in values:
+                        self.index.setdefault((key, _text(value)), set()).add(dn)
+
+    def lower_values(self, attrs, attr):
+        return [_text(value) for value in attrs.get(self.names.get(attr), ())]
+
+    def _chain(self, attr, target, upward):
+        # Follow member (downward) or memberOf (upward) links from target
+        seen = set()
+        stack = [target]
+        result = set()
+        link = 'memberof' if upward else 'member'
+        while stack:
+            dn = self.by_lower.get(stack.pop())
+            if dn is None or dn in seen:
+                continue
+            seen.add(dn)
+            for value in self.lower_values(self.entries[dn], link):
+                result.add(self.by_lower.get(value, value))
+                stack.append(value)
+        return result
+
+    def _prefix(self, attr, prefix):
+        values = self._sorted.get(attr)
+        if values is None:
+            with self._lock:
+                values = sorted(value for key, value in self.index if key == attr)
+                self._sorted[attr] = values
+        result = set()
+        for i in range(bisect.bisect_left(values, prefix), len(values)):
+            if not values[i].startswith(prefix):
+                break
+            result |= self.index[(attr, values[i])]
+        return result
+
+    def _anr_candidates(self, term):
+        result = set()
+        for attr in ANR_ATTRIBUTES:
+            result |= self._prefix(attr, term)
+        if ' ' in term:
+            first = term.split(' ', 1)[0]
+            result |= self._prefix('givenname', first) | self._prefix('sn', first)
+        return result
+
+    def candidates(self, node):
+        """A superset of the matching DNs, or None when the whole tree must be scanned"""
+        op = node[0]
+        if op == 'sub' and len(node[2]) == 2 and node[2][0] and not node[2][1] and node[1] in INDEXED:
+            return self._prefix(node[1], node[2][0])
+        if op == 'eq':
+            if node[1] == 'anr':
+                return self._anr_candidates(node[2].rstrip('*'))
+            if node[1] == 'distinguishedname':
+                dn = self.by_lower.get(node[2])
+                return {dn} if dn else set()
+            if node[1] in INDEXED:
+                return self.index.get((node[1], node[2]), set())
+            return None
+        if op == 'chain':
+            if node[1] == 'memberof':
+                return self._chain(node[1], node[2], upward=False)
+            if node[1] == 'member':
+                return self._chain(node[1], node[2], upward=True)
+            return None
+        if op == '&':
+            sets = [s for s in (self.candidates(sub) for sub in node[1]) if s is not None]
+            if not sets:
+                return None
+            sets.sort(key=len)
+            return set.intersection(*sets) if len(sets) > 1 else sets[0]
+        if op == '|':
+            result = set()
+            for sub in node[1]:
+                s = self.candidates(sub)
+                if s is None:
+                    return None
+                result |= s
+            return result
+        return None
+
+    def match(self, node, dn, attrs, chains):
+        op = node[0]
+        if op == '&':
+            return all(self.match(sub, dn, attrs, chains) for sub in node[1])
+        if op == '|':
+            return any(self.match(sub, dn, attrs, chains) for sub in node[1])
+        if op == '!':
+            return not self.match(node[1], dn, attrs, chains)
+        if op == 'chain':
+            key = id(node)
+            if key not in chains:
+                chains[key] = self.candidates(node) or set()
+            return dn in chains[key]
+        if op == 'bit_and':
+            return any(int(v) & int(node[2]) == int(node[2]) for v in self.lower_values(attrs, node[1]))
+        if op == 'ext':
+            return False
+        attr = node[1]
+        if attr == 'anr':
+            return self._anr(attrs, node[2].rstrip('*') if op == 'eq' else node[2][0])
+        values = [dn.lower()] if attr == 'distinguishedname' else self.lower_values(attrs, attr)
+        if op == 'present':
+            return bool(values)
+        if op == 'eq':
+            return node[2] in values
+        if op in ('>=', '<='):
+            try:
+                bound = int(node[2])
+                return any(int(v) >= bound if op == '>=' else int(v) <= bound for v in values)
+            except ValueError:
+                return False
+        return any(_substring(value, node[2]) for value in values)
+
+    def _anr(self, attrs, term):
+        term = term.lower()
+        if any(v.startswith(term) for a in ANR_ATTRIBUTES for v in self.lower_values(attrs, a)):
+            return True
+        # "first last" and "last first" match givenName/sn pairs
+        if ' ' in term:
+            first, last = term.split(' ', 1)
+            given = self.lower_values(attrs, 'givenname')
+            surname = self.lower_values(attrs, 'sn')
+            return (any(g.startswith(first) for g in given) and any(s.startswith(last) for s in surname)) or \
+                   (any(s.startswith(first) for s in surname) and any(g.startswith(last) for g in given))
+        return False
+
+    def search(self, base, scope, filterstr):
+        node = parse_filter(filterstr)
+        base_lower = (base or '').lower()
+        if scope == SCOPE_BASE:
+            dn = self.by_lower.get(base_lower)
+            if dn is None:
+                raise NO_SUCH_OBJECT({'desc': 'No such object', 'matched': ''})
+            pool = [dn]
+        else:
+            found = self.candidates(node)
+            pool = self.entries if found is None else [dn for dn in found if dn in self.entries]
+        chains = {}
+        hits = []
+        for dn in pool:
+            if scope != SCOPE_BASE and not dn.lower().endswith(base_lower):
+                continue
+            attrs = self.entries[dn]
+            if self.match(node, dn, attrs, chains):
+                hits.append((dn, attrs))
+        return hits
+
+
+def _select(attrs, wanted):
+    if not wanted:
+        wanted = list(attrs)
+    out = {}
+    lookup = {key.lower(): key for key in attrs}
+    for name in wanted:
+        base, _, ranged = name.partition(';range=')
+        key = lookup.get(base.lower())
+        if key is None:
+            continue
+        values = attrs[key]
+        if ranged:
+            low, high = ranged.split('-')
+            low = int(low)
+            high = len(values) - 1 if high == '*' else int(high)
+            high = min(high, low + MAX_VAL_RANGE - 1)
+            chunk = values[low:high + 1]
+            end = '*' if low + len(chunk) >= len(values) else str(low + len(chunk) - 1)
+            out[f"{key};range={low}-{end}"] = chunk
+        elif len(values) > MAX_VAL_RANGE:
+            out[f"{key};range=0-{MAX_VAL_RANGE - 1}"] = values[:MAX_VAL_RANGE]
+        else:
+            out[key] = values
+    return out
+
+
+directory = Directory()
+STATS = {'binds': 0, 'searches': 0, 'pages': 0}
+
+
+class SimpleLDAPObject:
+    """A connection whose results arrive LATENCY after each request.
+
+    Like a socket, ``get_option(OPT_DESC)`` is a descriptor that is
+    readable while a result is waiting, so callers can poll many
+    connections with select() and collect results with ``timeout=0``.
+    """
+    _msgids = itertools.count(1)
+
+    def __init__(self, uri, *args, **kwargs):
+        self._uri = uri
+        self._pending = {}  # msgid -> (hits, response controls, ready at)
+        self._paged = {}
+        self._lock = threading.Lock()
+        self._pipe = None
+        self._signalled = set()
+
+    def set_option(self, option, value):
+        pass
+
+    def get_option(self, option):
+        if option != OPT_DESC:
+            return None
+        with self._lock:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                os.set_blocking(self._pipe[0], False)
+                for msgid, (_, _, ready_at) in self._pending.items():
+                    self._schedule(msgid, ready_at)
+            return self._pipe[0]
+
+    def _schedule(self, msgid, ready_at):
+        delay = ready_at - time.monotonic()
+        if delay > 0:
+            timer = threading.Timer(delay, self._signal, (msgid,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._signal(msgid, locked=True)
+
+    def _signal(self, msgid, locked=False):
+        # One byte in the pipe per result that is ready and not yet read
+        if not locked:
+            with self._lock:
+                return self._signal(msgid, True)
+        if self._pipe is not None and msgid in self._pending and msgid not in self._signalled:
+            self._signalled.add(msgid)
+            os.write(self._pipe[1], b'x')
+
+    def _take(self, msgid):
+        hits, response_ctrls, _ = self._pending.pop(msgid)
+        if msgid in self._signalled:
+            self._signalled.discard(msgid)
+            try:
+                os.read(self._pipe[0], 1)
+            except BlockingIOError:
+                pass
+        return hits, response_ctrls
+
+    def simple_bind_s(self, who='', cred=''):
+        STATS['binds'] += 1
+        if LATENCY:
+            time.sleep(LATENCY)
+        if cred == 'bad':
+            raise INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+        return (97, [], 1, [])
+
+    def whoami_s(self):
+        return 'u:bench'
+
+    def unbind_s(self):
+        with self._lock:
+            self._pending.clear()
+            self._signalled.clear()
+            self._paged.clear()
+            if self._pipe is not None:
+                os.close(self._pipe[0])
+                os.close(self._pipe[1])
+                self._pipe = None
+
+    unbind = unbind_s
+
+    def abandon(self, msgid):
+        with self._lock:
+            if msgid in self._pending:
+                self._take(msgid)
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                   serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        from . import controls
+        page = next((c for c in serverctrls or []
+                     if c.controlType == controls.SimplePagedResultsControl.controlType), None)
+        response_ctrls = []
+        if page is not None and page.cookie:
+            # Continue the result set this cookie belongs to
+            with self._lock:
+                hits, start, attrlist = self._paged.pop(page.cookie, ([], 0, attrlist))
+        else:
+            STATS['searches'] += 1
+            hits, start = directory.search(base, scope, filterstr), 0
+        if page is not None:
+            end = start + page.size
+            cookie = b''
+            if end < len(hits) and page.size:
+                cookie = str(next(self._msgids)).encode()
+                with self._lock:
+                    self._paged[cookie] = (hits, end, attrlist)
+            response_ctrls.append(controls.SimplePagedResultsControl(True, page.size, cookie))
+            hits = hits[start:end]
+        if sizelimit and len(hits) > sizelimit:
+            hits = hits[:sizelimit]
+        # Attributes are selected per page, like a server building each response
+        hits = [(dn, _select(attrs, attrlist)) for dn, attrs in hits]
+        msgid = next(self._msgids)
+        ready_at = time.monotonic() + LATENCY
+        with self._lock:
+            self._pending[msgid] = (hits, response_ctrls, ready_at)
+            if self._pipe is not None:
+                self._schedule(msgid, ready_at)
+        return msgid
+
+    def result3(self, msgid=RES_ANY, all=1, timeout=None):
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if msgid == RES_ANY:
+                    waiting = sorted((ready_at, m) for m, (_, _, ready_at) in self._pending.items())
+                else:
+                    waiting = [(self._pending[msgid][2], msgid)]
+                if waiting and waiting[0][0] <= now:
+                    found = waiting[0][1]
+                    hits, response_ctrls = self._take(found)
+                    STATS['pages'] += 1
+                    return RES_SEARCH_RESULT, hits, found, response_ctrls
+            if timeout == 0:
+                return None, None, None, None
+            wait = waiting[0][0] - now if waiting else 0.05
+            if timeout is not None and timeout > 0 and now - started + wait > timeout:
+                time.sleep(max(0, timeout - (now - started)))
+                raise TIMEOUT({'desc': 'Timed out'})
+            time.sleep(wait)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                     serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        msgid = self.search_ext(base, scope, filterstr, attrlist, attrsonly, serverctrls, clientctrls,
+                                timeout, sizelimit)
+        return self.result3(msgid)[1]
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.search_ext_s(base, scope, filterstr, attrlist, attrsonly)
+
+
+def initialize(uri, *args, **kwargs):
+    return SimpleLDAPObject(uri)
+
+
+from . import controls, ldapobject  # noqa: E402,F401
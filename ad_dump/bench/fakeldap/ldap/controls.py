@@ -0,0 +1,17 @@
+# ad_dump/bench/fakeldap/ldap/controls.py
+
+
+class RequestControl:
+    def __init__(self, controlType=None, criticality=False, encodedControlValue=None):
+        self.controlType = controlType
+        self.criticality = criticality
+        self.encodedControlValue = encodedControlValue
+
+
+class SimplePagedResultsControl(RequestControl):
+    controlType = '1.2.840.113556.1.4.319'
+
+    def __init__(self, criticality=False, size=10, cookie=''):
+        self.criticality = criticality
+        self.size = size
+        self.cookie = cookie or b''
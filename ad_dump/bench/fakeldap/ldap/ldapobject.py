@@ -0,0 +1,11 @@
+# ad_dump/bench/fakeldap/ldap/ldapobject.py
+from . import SimpleLDAPObject
+
+
+class ReconnectLDAPObject(SimpleLDAPObject):
+    def __init__(self, uri, trace_level=0, trace_file=None, trace_stack_limit=5, bytes_mode=None,
+                 bytes_strictness=None, retry_max=1, retry_delay=60.0, fileno=None):
+        SimpleLDAPObject.__init__(self, uri)
+
+    def reconnect(self, uri, retry_max=1, retry_delay=60.0, force=True):
+        return None
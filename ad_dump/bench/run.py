@@ -0,0 +1,216 @@
+# ad_dump/bench/run.py
+"""Benchmark the API against a synthetic in-process directory.
+
+    python -m bench.run --size 100k --concurrency 16 --requests 2000
+
+Run from ad_dump/. The ``ldap`` package is replaced by bench/fakeldap,
+so no domain controller is needed and results are reproducible for a
+given --seed. Results are printed (or written with --output) as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fakeldap'))
+sys.path.insert(1, os.path.dirname(BENCH_DIR))
+
+API_KEY = 'bench'
+SCENARIOS = ('search_precise', 'search_fuzzy', 'search_contains', 'search_sam', 'group_details',
+             'group_members', 'group_members_large', 'suggest')
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_requests(scenario, dataset, count, rng):
+    """Request paths for one scenario, picked from the generated keys"""
+    paths = []
+    for _ in range(count):
+        if scenario == 'search_precise':
+            params = {'query': rng.choice(dataset.sam_names), 'type': 'users', 'precise': 'true'}
+        elif scenario == 'search_fuzzy':
+            params = {'query': rng.choice(dataset.name_fragments), 'type': 'users', 'precise': 'false'}
+        elif scenario == 'search_contains':
+            params = {'query': rng.choice(dataset.name_fragments), 'type': 'users', 'precise': 'false',
+                      'match': 'contains'}
+        elif scenario == 'search_sam':
+            params = {'query': rng.choice(dataset.sam_names), 'type': 'users', 'precise': 'true',
+                      'searchBy': 'sAMAccountName'}
+        elif scenario == 'suggest':
+            fragment = rng.choice(dataset.sam_names)
+            paths.append(f"/suggest?{urlencode({'q': fragment[:rng.randint(1, 6)]})}")
+            continue
+        elif scenario == 'group_details':
+            paths.append(f"/groups/{quote(rng.choice(dataset.groups + dataset.large_groups), safe='')}")
+            continue
+        elif scenario == 'group_members':
+            paths.append(f"/groups/{quote(rng.choice(dataset.groups), safe='')}/members")
+            continue
+        else:
+            paths.append(f"/groups/{quote(rng.choice(dataset.large_groups), safe='')}/members?limit=1000")
+            continue
+        paths.append(f"/search?{urlencode(params)}")
+    return paths
+
+
+def run_scenario(client_for, paths, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def call(path):
+        nonlocal errors
+        start = time.perf_counter()
+        response = client_for().get(path, headers={'X-API-Key': API_KEY})
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, paths))
+    wall = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(paths),
+        'errors': errors,
+        'throughput_rps': round(len(paths) / wall, 1) if wall else None,
+        'p50_ms': ms(_percentile(ordered, 50)),
+        'p90_ms': ms(_percentile(ordered, 90)),
+        'p99_ms': ms(_percentile(ordered, 99)),
+        'max_ms': ms(ordered[-1] if ordered else None),
+        'mean_ms': ms(sum(ordered) / len(ordered) if ordered else None),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='10k', help='Users to generate: 10k, 100k, 1m or a number')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='Simulated directory round trip per bind and result page')
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache on')
+    parser.add_argument('--admission', action='store_true', help='Keep admission control on')
+    parser.add_argument('--mux', action='store_true', help='Share a few connections per domain across searches')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('ENCRYPTION_KEY', 'S2ycmE5DJQEHhVJ8IMHzN9VQnhlf3KBwc4EMkeVvOTg=')
+    os.environ['API_KEY'] = API_KEY
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ['MIRROR_ENABLED'] = 'false'
+    if not args.cache:
+        os.environ['RESPONSE_CACHE_TYPE'] = 'NullCache'
+    if not args.admission:
+        os.environ['ADMISSION_ENABLED'] = 'false'
+    if args.mux:
+        os.environ['LDAP_MUX_ENABLED'] = 'true'
+
+    import ldap
+    from .dataset import BASE_DN, generate, parse_size
+
+    ldap.LATENCY = args.latency_ms / 1000
+    users = parse_size(args.size)
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    dataset = generate(ldap.directory, users, seed=args.seed)
+    seed_seconds = time.perf_counter() - started
+    rss_after_seed = _rss_mb()
+
+    # The config database lives in the working directory
+    workdir = tempfile.mkdtemp(prefix='friendly-ad-bench-')
+    os.chdir(workdir)
+    from src.database import init_db, get_db, encrypt_password
+    init_db()
+    with get_db() as db:
+        db.execute('INSERT INTO domains (name, server, base_dn, username, password) VALUES (?, ?, ?, ?, ?)',
+                   ('bench', 'ldap://bench.invalid', BASE_DN, 'bench', encrypt_password('bench')))
+        db.commit()
+    from src.app import app
+    from src.suggest import suggest_index
+
+    local = threading.local()
+
+    def client_for():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client
+
+    suggest_seconds = None
+    if 'suggest' in args.scenarios.split(','):
+        started = time.perf_counter()
+        suggest_index.refresh_all()
+        suggest_seconds = round(time.perf_counter() - started, 2)
+
+    rng = random.Random(args.seed)
+    results = {}
+    for scenario in args.scenarios.split(','):
+        if scenario not in SCENARIOS:
+            parser.error(f"Unknown scenario: {scenario}")
+        if args.warmup:
+            run_scenario(client_for, build_requests(scenario, dataset, args.warmup, rng), args.concurrency)
+        paths = build_requests(scenario, dataset, args.requests, rng)
+        results[scenario] = run_scenario(client_for, paths, args.concurrency)
+        print(f"{scenario}: p50={results[scenario]['p50_ms']}ms p99={results[scenario]['p99_ms']}ms "
+              f"{results[scenario]['throughput_rps']} req/s", file=sys.stderr)
+
+    report = {
+        'size': users,
+        'entries': len(ldap.directory),
+        'concurrency': args.concurrency,
+        'latency_ms': args.latency_ms,
+        'cache': args.cache,
+        'seed': args.seed,
+        'seed_seconds': round(seed_seconds, 2),
+        'suggest_build_seconds': suggest_seconds,
+        'rss_before_seed_mb': round(rss_before, 1) if rss_before is not None else None,
+        'rss_after_seed_mb': round(rss_after_seed, 1) if rss_after_seed is not None else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'ldap': dict(ldap.STATS),
+        'scenarios': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
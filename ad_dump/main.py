@@ -16,8 +16,14 @@ def run_flask_app():
         init_db()
         print("Database initialized successfully")
         
-        # Run the Flask app
-        subprocess.run(["python", "-m", "src.app"], check=True)
+        # The Flask dev server is only for development; anything else runs
+        # under the prefork server unless SERVER_MODE says otherwise.
+        default_mode = 'dev' if os.getenv('FLASK_ENV') == 'development' else 'production'
+        if os.getenv('SERVER_MODE', default_mode) == 'production':
+            from src.server import run_server
+            run_server()
+        else:
+            subprocess.run(["python", "-m", "src.app"], check=True)
     except subprocess.CalledProcessError as e:
         print(f"Error running Flask app: {e}")
     except Exception as e:
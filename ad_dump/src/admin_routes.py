@@ -2,7 +2,15 @@
 from flask import Blueprint, request, jsonify
 from functools import wraps
 import os
-from .database import get_db, encrypt_password, decrypt_password
+from .database import get_db, encrypt_password
+from .config_cache import config_cache
+from .ldap_pool import ldap_pool
+from .dc_health import resolve_servers
+from .response_cache import purge_domain, purge_dn
+from .mirror import directory_mirror, MIRROR_ENABLED
+from .suggest import suggest_index, SUGGEST_ENABLED
+from .group_index import group_index, GROUP_INDEX_ENABLED
+from .org_chart import org_chart, ORG_CHART_ENABLED
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -13,21 +21,24 @@ def require_admin_key(f):
         if not auth_header:
             return jsonify({"error": "Missing admin key"}), 401
             
-        with get_db() as db:
-            cursor = db.cursor()
-            cursor.execute('SELECT value FROM settings WHERE key = "admin_key"')
-            result = cursor.fetchone()
+        if not config_cache.is_setup():
+            return jsonify({"error": "Admin key not set"}), 401
             
-            if not result:
-                return jsonify({"error": "Admin key not set"}), 401
-                
-            stored_key = decrypt_password(result[0])
-            if auth_header != stored_key:
-                return jsonify({"error": "Unauthorized"}), 401
+        if not config_cache.check_admin_key(auth_header):
+            return jsonify({"error": "Unauthorized"}), 401
                 
         return f(*args, **kwargs)
     return decorated_function
 
+def refresh_indexes():
+    """Ask the enabled in-memory indexes to rebuild after a domain change"""
+    if SUGGEST_ENABLED:
+        suggest_index.request_refresh()
+    if GROUP_INDEX_ENABLED:
+        group_index.request_refresh()
+    if ORG_CHART_ENABLED:
+        org_chart.request_refresh()
+
 @admin_bp.route('/domains', methods=['GET'])
 @require_admin_key
 def list_domains():
@@ -63,14 +74,16 @@ def add_domain():
         ''', (data['name'], data['server'], data['base_dn'], 
               data['username'], encrypted_password))
         db.commit()
+        config_cache.bump(db)
         
+    refresh_indexes()
     return jsonify({"message": "Domain added successfully"}), 201
 
 @admin_bp.route('/setup-status', methods=['GET'])
 def check_setup():
     with get_db() as db:
         cursor = db.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = "admin_key"')
+        cursor.execute('SELECT value FROM settings WHERE key = ?', ('admin_key',))
         result = cursor.fetchone()
         return jsonify({"isSetup": result is not None})
 
@@ -83,7 +96,7 @@ def initial_setup():
     with get_db() as db:
         cursor = db.cursor()
         # Check if key already exists
-        cursor.execute('SELECT value FROM settings WHERE key = "admin_key"')
+        cursor.execute('SELECT value FROM settings WHERE key = ?', ('admin_key',))
         if cursor.fetchone():
             return jsonify({"error": "Admin key already set"}), 400
             
@@ -92,6 +105,7 @@ def initial_setup():
         cursor.execute('INSERT INTO settings (key, value) VALUES (?, ?)', 
                       ('admin_key', encrypted_key))
         db.commit()
+        config_cache.bump(db)
         
     return jsonify({"message": "Admin key set successfully"}), 201
 
@@ -103,9 +117,66 @@ def delete_domain(domain_id):
         # Instead of actually deleting, we'll set is_active to 0
         cursor.execute('UPDATE domains SET is_active = 0 WHERE id = ?', (domain_id,))
         db.commit()
+        config_cache.bump(db)
         
+    ldap_pool.invalidate(domain_id)
+    purge_domain(domain_id)
+    refresh_indexes()
     return '', 204
 
+@admin_bp.route('/domains/<int:domain_id>', methods=['PUT'])
+@require_admin_key
+def update_domain(domain_id):
+    data = request.json
+    required_fields = ['name', 'server', 'base_dn', 'username']
+    
+    if not data or not all(field in data for field in required_fields):
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    with get_db() as db:
+        cursor = db.cursor()
+        # An empty password means "keep the stored one"; the UI never
+        # receives the current password so it cannot send it back.
+        if data.get('password'):
+            cursor.execute('''
+                UPDATE domains
+                SET name = ?, server = ?, base_dn = ?, username = ?, password = ?
+                WHERE id = ?
+            ''', (data['name'], data['server'], data['base_dn'],
+                  data['username'], encrypt_password(data['password']), domain_id))
+        else:
+            cursor.execute('''
+                UPDATE domains
+                SET name = ?, server = ?, base_dn = ?, username = ?
+                WHERE id = ?
+            ''', (data['name'], data['server'], data['base_dn'],
+                  data['username'], domain_id))
+        db.commit()
+        
+        if cursor.rowcount == 0:
+            return jsonify({"error": "Domain not found"}), 404
+        config_cache.bump(db)
+        
+        cursor.execute('''
+            SELECT id, name, server, base_dn, username, is_active 
+            FROM domains 
+            WHERE id = ?
+        ''', (domain_id,))
+        domain = cursor.fetchone()
+    
+    # Drop connections bound with the old settings right away
+    ldap_pool.invalidate(domain_id)
+    purge_domain(domain_id)
+    refresh_indexes()
+    return jsonify({
+        'id': domain[0],
+        'name': domain[1],
+        'server': domain[2],
+        'base_dn': domain[3],
+        'username': domain[4],
+        'is_active': bool(domain[5])
+    })
+
 @admin_bp.route('/domains/<int:domain_id>', methods=['GET'])
 @require_admin_key
 def get_domain(domain_id):
@@ -128,4 +199,50 @@ def get_domain(domain_id):
                 'is_active': bool(domain[5])
             })
         
-        return jsonify({"error": "Domain not found"}), 404
\ No newline at end of file
+        return jsonify({"error": "Domain not found"}), 404
+
+@admin_bp.route('/domains/<int:domain_id>/servers', methods=['GET'])
+@require_admin_key
+def domain_servers(domain_id):
+    domain = config_cache.get_domain(domain_id)
+    if not domain:
+        return jsonify({"error": "Domain not found"}), 404
+    # Only this worker's view; each process tracks its own connections
+    servers = ldap_pool.server_status(domain_id) or [
+        {"server": uri, "state": "unknown", "latency_ms": None, "failures": 0, "last_error": None}
+        for uri, _ in resolve_servers(domain['server'])
+    ]
+    return jsonify({"domain_id": domain_id, "servers": servers})
+
+@admin_bp.route('/cache/purge', methods=['POST'])
+@require_admin_key
+def purge_cache():
+    data = request.json or {}
+    domain_id = data.get('domain_id')
+    if domain_id is None:
+        return jsonify({"error": "Missing domain_id"}), 400
+    
+    if data.get('dn'):
+        purged = purge_dn(domain_id, data['dn'])
+        return jsonify({"message": "Cache entries purged", "purged": purged})
+    
+    purge_domain(domain_id)
+    return jsonify({"message": "Domain cache purged"})
+
+@admin_bp.route('/mirror', methods=['GET'])
+@require_admin_key
+def mirror_status():
+    return jsonify({
+        "enabled": MIRROR_ENABLED,
+        "domains": directory_mirror.status() if MIRROR_ENABLED else []
+    })
+
+@admin_bp.route('/mirror/sync', methods=['POST'])
+@require_admin_key
+def mirror_sync():
+    if not MIRROR_ENABLED:
+        return jsonify({"error": "Directory mirror is disabled"}), 400
+    
+    data = request.json or {}
+    directory_mirror.request_sync(data.get('domain_id'), bool(data.get('full')))
+    return jsonify({"message": "Sync requested"}), 202
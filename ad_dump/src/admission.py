@@ -0,0 +1,273 @@
+# ad_dump/src/admission.py
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+from .config_cache import config_cache
+from .ldap_pool import POOL_SIZE
+from .metrics import ADMISSION_REJECTED, timed
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Limits are for the whole server and split evenly over its worker processes; 0 turns a limit off
+ADMISSION_KEY_CONCURRENCY = int(os.getenv('ADMISSION_KEY_CONCURRENCY', '6'))
+# Unset, each worker may use its whole LDAP pool for one domain
+ADMISSION_DOMAIN_CONCURRENCY = int(os.getenv('ADMISSION_DOMAIN_CONCURRENCY') or -1)
+ADMISSION_KEY_RATE = float(os.getenv('ADMISSION_KEY_RATE', '50'))
+ADMISSION_KEY_BURST = float(os.getenv('ADMISSION_KEY_BURST', '100'))
+ADMISSION_DOMAIN_RATE = float(os.getenv('ADMISSION_DOMAIN_RATE', '100'))
+ADMISSION_DOMAIN_BURST = float(os.getenv('ADMISSION_DOMAIN_BURST', '200'))
+# Requests that may wait for a slot; beyond this they are turned away at once
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '16'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '2'))
+# Slots of each concurrency limit that only cheap requests may use
+ADMISSION_CHEAP_RESERVED = int(os.getenv('ADMISSION_CHEAP_RESERVED', '2'))
+
+CHEAP, EXPENSIVE = 0, 1
+
+
+class Rejected(Exception):
+    def __init__(self, scope, reason, retry_after):
+        super().__init__(f"{scope} {reason}")
+        self.scope = scope
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait, count=1):
+        """Take ``count`` tokens, possibly ahead of time; returns (seconds to wait, taken).
+
+        Tokens that would not be available within ``max_wait`` are not
+        taken, and the wait is returned for the Retry-After.
+        """
+        count = min(count, self.burst)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (count - self.tokens) / self.rate)
+            if wait > max_wait:
+                return wait, False
+            self.tokens -= count
+            return wait, True
+
+    def refund(self, count=1):
+        """Give back tokens reserved for a request that was then turned away"""
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + min(count, self.burst))
+
+
+class ConcurrencyLimit:
+    """At most ``capacity`` requests at once, with a short queue served cheap-first.
+
+    Expensive requests can't take the last ``reserved`` slots, so a burst
+    of fuzzy searches or member scans always leaves room for lookups.
+    """
+
+    def __init__(self, capacity, queue_size=ADMISSION_QUEUE_SIZE, reserved=ADMISSION_CHEAP_RESERVED):
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.reserved = min(reserved, capacity - 1)
+        self.in_use = 0
+        self._waiting = []  # heap of (priority, arrival)
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _limit(self, priority):
+        return self.capacity if priority == CHEAP else self.capacity - self.reserved
+
+    def acquire(self, priority, timeout):
+        with self._cond:
+            if (not self._waiting or priority < self._waiting[0][0]) and self.in_use < self._limit(priority):
+                self.in_use += 1
+                return True
+            if len(self._waiting) >= self.queue_size or timeout <= 0:
+                return False
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(self._waiting, ticket)
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    if self._waiting[0] == ticket and self.in_use < self._limit(priority):
+                        heapq.heappop(self._waiting)
+                        self.in_use += 1
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    # The next in line may be able to go now
+                    self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify_all()
+
+
+class AdmissionController:
+    """Per-API-key and per-domain concurrency caps and token-bucket rate limits.
+
+    A request takes tokens from its key's bucket and from the bucket of
+    each domain it reaches, waiting up to ADMISSION_MAX_WAIT when a bucket
+    is briefly empty, then a slot in each concurrency limit. Anything that
+    can't be admitted within that wait, or finds the wait queue full, is
+    rejected with a Retry-After and its tokens are given back. Each of the ``workers`` processes
+    enforces its share of the configured limits.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._limits = {}
+
+    def set_workers(self, workers):
+        """Split the limits over ``workers`` processes; call before the first request"""
+        self.__init__(max(1, workers))
+
+    def _capacity(self, total):
+        return math.ceil(total / self.workers) if total > 0 else 0
+
+    def _bucket(self, scope, key, rate, burst):
+        with self._lock:
+            bucket = self._buckets.get((scope, key))
+            if bucket is None:
+                bucket = self._buckets[(scope, key)] = TokenBucket(rate, burst)
+            return bucket
+
+    def _limit(self, scope, key, capacity):
+        with self._lock:
+            limit = self._limits.get((scope, key))
+            if limit is None:
+                limit = self._limits[(scope, key)] = ConcurrencyLimit(capacity)
+            return limit
+
+    def admit(self, api_key, domains, priority, weight=1):
+        """Wait for admission and return a release function, or raise Rejected.
+
+        ``domains`` are all the domains the request searches; ``weight`` is
+        how many tokens it takes from each bucket, e.g. one per LDAP search.
+        """
+        deadline = time.monotonic() + ADMISSION_MAX_WAIT
+        scopes = [('key', api_key)] + [('domain', domain) for domain in sorted(domains)]
+        wait = 0.0
+        charged = []
+
+        def refund():
+            for bucket in charged:
+                bucket.refund(weight)
+
+        for scope, key in scopes:
+            rate, burst = ((ADMISSION_KEY_RATE, ADMISSION_KEY_BURST) if scope == 'key' else
+                           (ADMISSION_DOMAIN_RATE, ADMISSION_DOMAIN_BURST))
+            if rate > 0:
+                bucket = self._bucket(scope, key, rate / self.workers, burst / self.workers)
+                needed, taken = bucket.reserve(ADMISSION_MAX_WAIT, weight)
+                if not taken:
+                    refund()
+                    raise Rejected(scope, 'rate', math.ceil(needed))
+                charged.append(bucket)
+                wait = max(wait, needed)
+        if wait:
+            time.sleep(wait)
+
+        held = []
+        for scope, key in scopes:
+            if scope == 'key':
+                capacity = self._capacity(ADMISSION_KEY_CONCURRENCY)
+            elif ADMISSION_DOMAIN_CONCURRENCY < 0:
+                capacity = POOL_SIZE
+            else:
+                capacity = self._capacity(ADMISSION_DOMAIN_CONCURRENCY)
+            if capacity <= 0:
+                continue
+            limit = self._limit(scope, key, capacity)
+            if not limit.acquire(priority, deadline - time.monotonic()):
+                for other in held:
+                    other.release()
+                refund()
+                raise Rejected(scope, 'concurrency', 1)
+            held.append(limit)
+
+        once = threading.Lock()
+
+        def release():
+            # Safe to call twice: an error path and the response close may both do it
+            if once.acquire(blocking=False):
+                for limit in held:
+                    limit.release()
+        return release
+
+    def _after_fork(self):
+        self.__init__(self.workers)
+
+
+admission = AdmissionController()
+os.register_at_fork(after_in_child=admission._after_fork)
+
+
+def _key_id():
+    # Limits are kept per key without holding on to the key itself
+    return hashlib.sha256(request.headers.get('X-API-Key', '').encode()).hexdigest()[:16]
+
+
+def _domain_keys():
+    body = request.get_json(silent=True) if request.is_json else None
+    spec = request.args.get('domain') or request.args.get('domain_id') or (body or {}).get('domain_id')
+    # Counted under their ids however they were asked for, and domain=all against every domain
+    domains = config_cache.select(spec)
+    if not domains:
+        # The handler turns the request away; it still counts against what was asked for
+        return [str(spec)]
+    return [str(domain['id']) for domain in domains]
+
+
+def admission_control(cost, weight=1):
+    """Admit a request against its API key's and domains' limits.
+
+    ``cost`` is CHEAP, EXPENSIVE or a function returning one for the
+    current request; ``weight``, a number or such a function, is how many
+    rate-limit tokens it takes. The slots are held until the response is
+    closed, so a streamed body counts for as long as it is being sent.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return f(*args, **kwargs)
+            priority = cost() if callable(cost) else cost
+            tokens = weight() if callable(weight) else weight
+            try:
+                with timed('admission'):
+                    release = admission.admit(_key_id(), _domain_keys(), priority, tokens)
+            except Rejected as e:
+                ADMISSION_REJECTED.labels(e.scope, e.reason).inc()
+                return jsonify({"error": "Too many requests, retry later"}), 429, {"Retry-After": str(e.retry_after)}
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            response.call_on_close(release)
+            return response
+        return decorated_function
+    return decorator
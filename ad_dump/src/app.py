@@ -1,10 +1,37 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 import ldap
+import json
 import os
 from dotenv import load_dotenv
 from .admin_routes import admin_bp
-from .database import get_db, decrypt_password, init_db
+from .database import init_db
+from .config_cache import config_cache
+from .ldap_pool import ldap_pool, ServersUnavailable
+from .dc_health import DC_OPEN_SECONDS
+from .response_cache import init_response_cache, cached_response
+from .metrics import init_metrics, metrics_view, timed, METRICS_ENABLED
+from .admission import admission_control, CHEAP, EXPENSIVE
+from .response_encoding import init_response_encoding
+from .cursors import cursor_store, SearchCursor, seal, unseal, drop_paging
+from .ldap_search import (
+    escape_ldap_filter, search_ldap_page, iter_search_ldap, search_domain,
+    build_search, select_fields, format_entries, project_entries, membership_filter,
+    ranged_values, fetch_range, iter_ranged, replay_search,
+    SEARCH_MAX_RESULTS
+)
+from .fanout import fan_out_search
+from .lookup import lookup_entries, search_count, LOOKUP_BY, LOOKUP_MAX_KEYS, OBJECT_CLASSES
+from .mirror import directory_mirror, MIRROR_ENABLED
+from .suggest import suggest_index, SUGGEST_ENABLED, SUGGEST_MAX_LIMIT, KINDS as SUGGEST_KINDS
+from .org_chart import org_chart, ORG_CHART_ENABLED, ORG_MAX_DEPTH
+from .group_index import (
+    group_index, QueryError, GROUP_INDEX_ENABLED, GROUP_QUERY_MAX_LIMIT, KINDS as GROUP_INDEX_KINDS
+)
+from .jobs import job_store, JobQueueFull, JOB_KINDS, JOB_MAX_RESULTS_PAGE, JOB_PAGE_SIZE, FINISHED as JOB_FINISHED
+from .export import (
+    Export, EXPORT_FORMATS, EXPORT_RESUME_TTL, RESUMABLE_FORMATS, iter_export, make_encoder, skip_past
+)
 from functools import wraps
 
 load_dotenv()
@@ -32,12 +59,30 @@ else:
     })
 
 app.register_blueprint(admin_bp, url_prefix='/admin')
+init_response_cache(app)
+init_metrics(app)
+init_response_encoding(app)
+
+def start_background_tasks():
+    """Start per-process background work; run after any fork, never before."""
+    if MIRROR_ENABLED:
+        directory_mirror.start()
+    if SUGGEST_ENABLED:
+        suggest_index.start()
+    if GROUP_INDEX_ENABLED:
+        group_index.start()
+    if ORG_CHART_ENABLED:
+        org_chart.start()
+    job_store.start()
+    cursor_store.start()
 
 LDAP_SERVER = os.getenv("LDAP_SERVER")
 LDAP_USER = os.getenv("LDAP_USER")
 LDAP_PASSWORD = os.getenv("LDAP_PASSWORD")
 LDAP_BASE_DN = os.getenv("LDAP_BASE_DN")
 API_KEY = os.getenv("API_KEY")
+# Largest page a client may ask for; AD's default MaxPageSize is 1000
+MAX_PAGE_SIZE = 1000
 
 def require_api_key(f):
     @wraps(f)
@@ -53,371 +98,877 @@ def require_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
+if METRICS_ENABLED:
+    # The proxy forwards /api/ here, /metrics included, so it takes the same key as the API
+    app.add_url_rule('/metrics', 'metrics', require_api_key(metrics_view))
+
+def search_cost():
+    # Exact and attribute lookups hit an index; fuzzy matches, streams and page resumes scan
+    if request.args.get('format') or request.args.get('cursor'):
+        return EXPENSIVE
+    if request.args.get('precise', 'true').lower() == 'true' or request.args.get('searchBy'):
+        return CHEAP
+    return EXPENSIVE
+
 @app.route('/search', methods=['GET'])
 @require_api_key
+@cached_response
+@admission_control(search_cost)
 def search():
     search_query = request.args.get('query', '')
     search_type = request.args.get('type', '')
     is_precise = request.args.get('precise', 'true').lower() == 'true'
+    stream_format = request.args.get('format')
+    if stream_format and stream_format not in STREAM_FORMATS:
+        return jsonify({"error": "Invalid format"}), 400
     
-    results = perform_search(search_query, search_type, is_precise)
+    results = perform_search(search_query, search_type, is_precise, stream_format)
+    if isinstance(results, Response):
+        return results
+    if isinstance(results, tuple):
+        return jsonify(results[0]), results[1]
+    if request.args.get('explain', 'false').lower() == 'true' and 'query_plan' in g:
+        results["plan"] = g.query_plan.explain()
     return jsonify(results)
 
+def selected_domains():
+    """Domains picked by ?domain=all|1,2 or the frontend's ?domain_id=N"""
+    return config_cache.select(request.args.get('domain') or request.args.get('domain_id'))
+
 def get_ldap_connection(domain_id=None):
+    domain = config_cache.get_domain(domain_id)
+    if not domain:
+        return None, None
+    
     try:
-        with get_db() as db:
-            cursor = db.cursor()
-            if domain_id:
-                cursor.execute('''
-                    SELECT server, username, password, base_dn 
-                    FROM domains 
-                    WHERE id = ? AND is_active = 1
-                ''', (domain_id,))
-            else:
-                cursor.execute('''
-                    SELECT server, username, password, base_dn 
-                    FROM domains 
-                    WHERE is_active = 1 
-                    LIMIT 1
-                ''')
-            
-            domain = cursor.fetchone()
-            if not domain:
-                return None, None
-                
-            server, username, encrypted_password, base_dn = domain
-            password = decrypt_password(encrypted_password)
-            
-            try:
-                ldap_conn = ldap.initialize(server)
-                ldap_conn.set_option(ldap.OPT_REFERRALS, 0)
-                ldap_conn.simple_bind_s(username, password)
-                return ldap_conn, base_dn
-                
-            except ldap.INVALID_CREDENTIALS:
-                return None, None
-            
+        ldap_conn = ldap_pool.acquire(domain)
+        g.setdefault('ldap_conns', []).append(ldap_conn)
+        return ldap_conn, domain['base_dn']
+        
+    except ldap.INVALID_CREDENTIALS:
+        return None, None
+    except ServersUnavailable:
+        raise
     except Exception as e:
+        print(f"Could not get LDAP connection: {e}")
         return None, None
 
-def close_ldap(ldap_conn):
-    if ldap_conn:
-        ldap_conn.unbind_s()
-        print("LDAP connection closed")
-
-def format_user(entry):
+def shared_search(domain_id, search_filter, attributes):
+    """search_domain for a domain id; None if no connection could be made"""
+    domain = config_cache.get_domain(domain_id)
+    if not domain:
+        return None
     try:
-        # Convert entry[1] to dict if it's a list of tuples
-        attrs = {}
-        if isinstance(entry[1], list):
-            for attr in entry[1]:
-                if len(attr) >= 2:
-                    attrs[attr[0]] = attr[1]
-        else:
-            attrs = entry[1]
-
-        def safe_decode(value):
-            if isinstance(value, bytes):
-                return value.decode('utf-8')
-            return str(value)
-
-        def get_attr(attr_name, default=None):
-            values = attrs.get(attr_name, [default])
-            if not values:
-                return None
-            value = values[0] if isinstance(values, list) else values
-            return safe_decode(value) if value else None
-
-        def get_list_attr(attr_name):
-            values = attrs.get(attr_name, [])
-            return [safe_decode(v) for v in values] if values else []
-
-        formatted_entry = {
-            "id": entry[0],
-            "name": get_attr('name'),
-            "email": get_attr('mail'),
-            "department": get_attr('department'),
-            "title": get_attr('title'),
-            "phone": get_attr('telephoneNumber'),
-            "manager": get_attr('manager'),
-            "street": get_attr('streetAddress'),
-            "city": get_attr('l'),
-            "state": get_attr('st'),
-            "postalCode": get_attr('postalCode'),
-            "country": get_attr('co'),
-            "memberOf": get_list_attr('memberOf'),
-            "created": get_attr('whenCreated'),
-            "lastModified": get_attr('whenChanged'),
-            "samAccountName": get_attr('sAMAccountName'),
-            "userPrincipalName": get_attr('userPrincipalName'),
-            "enabled": not bool(int(get_attr('userAccountControl', '0'))) & 2 if attrs.get('userAccountControl') else None,
-            "lastLogon": get_attr('lastLogon'),
-            "pwdLastSet": get_attr('pwdLastSet'),
-            "company": get_attr('company'),
-            "employeeID": get_attr('employeeID'),
-            "employeeType": get_attr('employeeType'),
-        }
-        # Only return entries that have at least a name
-        return formatted_entry if formatted_entry["name"] else None
+        return search_domain(domain, search_filter, attributes)
+    except ldap.INVALID_CREDENTIALS:
+        return None
+    except ServersUnavailable:
+        raise
     except Exception as e:
-        print(f"Error formatting user: {e}")
+        print(f"Could not get LDAP connection: {e}")
         return None
 
-def format_group(entry):
-    try:
-        # Convert entry[1] to dict if it's a list of tuples
-        attrs = {}
-        if isinstance(entry[1], list):
-            for attr in entry[1]:
-                if len(attr) >= 2:
-                    attrs[attr[0]] = attr[1]
-        else:
-            attrs = entry[1]
-
-        # Skip entries that don't have a name
-        if not attrs.get('name'):
-            return None
-
-        group_type = attrs.get('groupType', [b'0'])[0]
-        if group_type:
-            group_type = int(group_type.decode('utf-8'))
-            type_str = 'security' if group_type == -2147483643 else 'distribution'
-        else:
-            type_str = 'unknown'
-
-        formatted_entry = {
-            "id": entry[0],
-            "name": attrs.get('name', [None])[0].decode('utf-8') if attrs.get('name', [None])[0] else None,
-            "description": attrs.get('description', [None])[0].decode('utf-8') if attrs.get('description', [None])[0] else None,
-            "type": type_str,
-            "members": [member.decode('utf-8') for member in attrs.get('member', [])],
-            "owner": attrs.get('managedBy', [None])[0].decode('utf-8') if attrs.get('managedBy', [None])[0] else None,
-            "created": attrs.get('whenCreated', [None])[0].decode('utf-8') if attrs.get('whenCreated', [None])[0] else None,
-            "lastModified": attrs.get('whenChanged', [None])[0].decode('utf-8') if attrs.get('whenChanged', [None])[0] else None,
-        }
+@app.errorhandler(ServersUnavailable)
+def servers_unavailable(e):
+    """Every DC of the domain is down or cooling off; say so instead of a generic 500"""
+    response = jsonify({"error": "No domain controller is reachable", "detail": str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(DC_OPEN_SECONDS))
+    return response
+
+def detach_ldap(ldap_conn):
+    """Stop tracking a connection that outlives the request (e.g. a cursor)."""
+    conns = g.get('ldap_conns', [])
+    if ldap_conn in conns:
+        conns.remove(ldap_conn)
+
+def close_ldap(ldap_conn, broken=False):
+    """Hand a connection back to the pool instead of unbinding it."""
+    if ldap_conn:
+        detach_ldap(ldap_conn)
+        if not ldap_pool.release(ldap_conn, broken):
+            ldap_conn.unbind_s()
 
-        # Only return groups that have at least a name
-        if formatted_entry["name"]:
-            return formatted_entry
-        return None
+def parse_transitive():
+    return request.args.get('transitive', 'false').lower() == 'true'
 
-    except Exception as e:
-        print(f"Error formatting group: {e}")
+def parse_limit():
+    limit = request.args.get('limit', type=int)
+    if limit is None:
         return None
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def search_page_response(ldap_conn, search_type, search_filter, fields, base_dn, limit, cookie=b'', carry=(),
+                         start=0):
+    """Return one client page, with a cursor for the next if more remain.
+
+    ``carry`` are entries already read that lead the page and ``start`` is
+    the position of its first entry in the result set. A ``cookie`` of
+    None means the paged search on ``ldap_conn`` has nothing left. The
+    cursor token records where the page ended, and the connection is also
+    parked behind it in this process for a quick resume.
+    """
+    attributes, formatter = select_fields(search_type, fields)
+    entries = list(carry[:limit])
+    next_cookie = cookie
+    if len(carry) < limit and cookie is not None:
+        try:
+            page, next_cookie = search_ldap_page(ldap_conn, search_filter, attributes, base_dn,
+                                                 limit - len(carry), cookie)
+        except ldap.LDAPError as e:
+            print(f"LDAP Search Error: {e}")
+            close_ldap(ldap_conn, broken=True)
+            return {"error": "Search failed", "truncated": False}, 500
+        entries += page
+    
+    results = format_entries(entries, formatter)
+    
+    next_cursor = None
+    if next_cookie or len(carry) > limit:
+        dns = [dn for dn, _ in entries if dn is not None]
+        spec = {"domain": ldap_pool.domain_of(ldap_conn), "filter": search_filter, "fields": fields,
+                "base": base_dn, "limit": limit, "offset": start + len(dns), "dn": dns[-1] if dns else None}
+        detach_ldap(ldap_conn)
+        if next_cookie and len(carry) <= limit:
+            spec["parked"] = cursor_store.open(SearchCursor(
+                ldap_conn, spec["domain"], search_type,
+                search_filter, attributes, formatter, base_dn, limit, next_cookie
+            ))
+        else:
+            # Carried entries are left over, so the server's position is past the page
+            drop_paging(ldap_conn, search_filter, base_dn, next_cookie)
+        next_cursor = seal(search_type, spec)
+    else:
+        close_ldap(ldap_conn)
+    
+    return {
+        "data": results,
+        "truncated": next_cursor is not None,
+        "next_cursor": next_cursor
+    }
 
-def search_ldap(ldap_conn, search_filter, attributes, base_dn=None, page_size=1000):
-    """Modified to handle pagination"""
+def resume_search(token, search_type):
+    """The page after a cursor, on its parked connection or by replaying the search here"""
+    spec = unseal(token, search_type)
+    if spec is None:
+        return {"error": "Cursor expired or invalid", "truncated": False}, 410
+    
+    cursor = cursor_store.take(spec["parked"], search_type) if spec.get("parked") else None
+    if cursor is not None:
+        g.setdefault('ldap_conns', []).append(cursor.ldap_conn)
+        return search_page_response(cursor.ldap_conn, search_type, spec["filter"], spec["fields"], spec["base"],
+                                    spec["limit"], cursor.cookie, start=spec["offset"])
+    
+    ldap_conn, _ = get_ldap_connection(spec["domain"])
+    if not ldap_conn:
+        return {"error": "Could not connect to LDAP server", "truncated": False}, 500
+    attributes, _ = select_fields(search_type, spec["fields"])
     try:
-        if not ldap_conn:
-            return {
-                "status": "error",
-                "results": None,
-                "error": "No LDAP connection",
-                "truncated": False
-            }
-            
-        ldap_conn.set_option(ldap.OPT_REFERRALS, 0)
-        
-        # Initialize variables for paging
-        all_results = []
-        page_cookie = ''
-        has_more = True
-        
-        # Set up paging control
-        lc = ldap.controls.SimplePagedResultsControl(True, size=page_size, cookie='')
-        
-        while has_more:
-            msgid = ldap_conn.search_ext(
-                base_dn,
-                ldap.SCOPE_SUBTREE,
-                search_filter,
-                attributes,
-                serverctrls=[lc]
-            )
-            
-            rtype, rdata, rmsgid, serverctrls = ldap_conn.result3(msgid)
-            all_results.extend(rdata)
-            
-            # Get cookie from page control
-            pctrls = [c for c in serverctrls if c.controlType == ldap.controls.SimplePagedResultsControl.controlType]
-            if pctrls:
-                has_more = bool(pctrls[0].cookie)
-                lc.cookie = pctrls[0].cookie
-            else:
-                has_more = False
-        
-        return {
-            "status": "success",
-            "results": all_results,
-            "total_count": len(all_results),
-            "truncated": False
-        }
-        
+        with timed('cursor_replay', spec["domain"]):
+            carry, cookie, read = replay_search(ldap_conn, spec["filter"], attributes, spec["base"],
+                                                spec["offset"], spec["dn"], MAX_PAGE_SIZE)
+    except LookupError:
+        close_ldap(ldap_conn)
+        return {"error": "The results changed since this cursor was issued; search again", "truncated": False}, 410
     except ldap.LDAPError as e:
         print(f"LDAP Search Error: {e}")
-        return {
-            "status": "error",
-            "results": None,
-            "error": str(e),
-            "truncated": False
-        }
+        close_ldap(ldap_conn, broken=True)
+        return {"error": "Search failed", "truncated": False}, 500
+    return search_page_response(ldap_conn, search_type, spec["filter"], spec["fields"], spec["base"],
+                                spec["limit"], cookie, carry, read - len(carry))
 
-def escape_ldap_filter(search_query):
-    """Escape special characters for LDAP filter"""
-    special_chars = {
-        '\\': r'\5c',
-        '*': r'\2a',
-        '(': r'\28',
-        ')': r'\29',
-        '\0': r'\00',
-        '/': r'\2f',
-        '.': r'\2e'  # Escape periods
+def search_mirror(domain, search_query, search_type, fields=None):
+    if not directory_mirror.is_fresh(domain['id']):
+        return None
+    
+    results, truncated = directory_mirror.search_capped(domain['id'], search_type, search_query, SEARCH_MAX_RESULTS)
+    return {
+        "data": project_entries(results, search_type, fields),
+        "truncated": truncated,
+        "source": "mirror"
     }
-    return ''.join(special_chars.get(char, char) for char in search_query)
 
-def perform_search(search_query, search_type, is_precise):
-    # Get connection and base_dn
-    connection_info = get_ldap_connection()
-    if not connection_info or not connection_info[0]:
-        return {"error": "Could not connect to LDAP server", "truncated": False}, 500
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json-stream': 'application/json',
+}
+
+def stream_search(ldap_conn, search_filter, attributes, base_dn, formatter, stream_format):
+    """Format and send entries as each LDAP page arrives.
+
+    ``ndjson`` writes one entry per line; ``json-stream`` writes the usual
+    ``{"data": [...]}`` envelope in chunks, so memory stays flat for
+    large result sets either way.
+    """
+    def generate():
+        count = 0
+        error = None
+        if stream_format == 'json-stream':
+            yield '{"data":['
+        try:
+            for entry in iter_search_ldap(ldap_conn, search_filter, attributes, base_dn):
+                if entry[0] is None:
+                    continue
+                formatted = formatter(entry)
+                if not formatted:
+                    continue
+                if stream_format == 'ndjson':
+                    yield json.dumps(formatted) + '\n'
+                else:
+                    yield (',' if count else '') + json.dumps(formatted)
+                count += 1
+        except ldap.LDAPError as e:
+            print(f"LDAP Search Error: {e}")
+            error = "Search failed"
+        finally:
+            close_ldap(ldap_conn)
         
-    ldap_conn, base_dn = connection_info  # Unpack the tuple
-
-    escaped_query = escape_ldap_filter(search_query)
+        if stream_format == 'ndjson':
+            if error:
+                yield json.dumps({"error": error}) + '\n'
+        else:
+            trailer = {"total_count": count, "truncated": False}
+            if error:
+                trailer["error"] = error
+            yield '],' + json.dumps(trailer)[1:]
+    
+    # The generator owns the connection from here; teardown runs before the body is sent
+    detach_ldap(ldap_conn)
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+
+def perform_search(search_query, search_type, is_precise, stream_format=None):
+    cursor = request.args.get('cursor')
+    if cursor:
+        return resume_search(cursor, search_type)
+    limit = parse_limit()
     search_by = request.args.get('searchBy', '')
+    fields = request.args.get('fields')
     
-    if search_type == 'users' and search_by == 'sAMAccountName':
-        # Optimized path for sAMAccountName
-        search_filter = f"(&(objectClass=user)(sAMAccountName={escaped_query}))"
-        attributes = ['name', 'mail', 'department', 'title', 'telephoneNumber', 
-                     'manager', 'streetAddress', 'l', 'st', 'postalCode', 'co', 
-                     'memberOf', 'whenCreated', 'whenChanged', 'sAMAccountName', 
-                     'userPrincipalName', 'userAccountControl', 'lastLogon', 
-                     'pwdLastSet', 'company', 'employeeID', 'employeeType']
-        
-        search_results = search_ldap(ldap_conn, search_filter, attributes, base_dn)
-        close_ldap(ldap_conn)
-
-        if search_results["status"] == "error":
-            return {"error": "Search failed", "truncated": False}, 500
-
-        results = []
-        if search_results["results"]:
-            valid_results = [entry for entry in search_results["results"] if entry[0] is not None]
-            results = [format_user(entry) for entry in valid_results if format_user(entry)]
-
-        return {
-            "data": results,
-            "truncated": search_results["truncated"]
-        }
-
-    results = []
-    if search_type == 'users':
-        if is_precise:
-            search_filter = f"(&(objectClass=user)(|(sAMAccountName={escaped_query})(userPrincipalName={escaped_query})(employeeID={escaped_query})))"
-        else:
-            search_filter = f"(&(objectClass=user)(|(name=*{escaped_query}*)(mail=*{escaped_query}*)(sAMAccountName=*{escaped_query}*)(userPrincipalName=*{escaped_query}*)(employeeID=*{escaped_query}*)))"  # Added closing parenthesis
-
-        attributes = ['name', 'mail', 'department', 'title', 'telephoneNumber', 
-                     'manager', 'streetAddress', 'l', 'st', 'postalCode', 'co', 
-                     'memberOf', 'whenCreated', 'whenChanged',
-                     'sAMAccountName', 'userPrincipalName', 'userAccountControl',
-                     'lastLogon', 'pwdLastSet', 'company', 'employeeID', 'employeeType']
-    elif search_type == 'groups':
-        if is_precise:
-            search_filter = f"(&(objectClass=group)(sAMAccountName={escaped_query}))"
-        else:
-            search_filter = f"(&(objectClass=group)(|(name=*{escaped_query}*)(description=*{escaped_query}*)))"
-        
-        attributes = ['name', 'description', 'groupType', 'member', 'managedBy', 'whenCreated', 'whenChanged']
-    elif search_type == 'group_members':
-        search_filter = f"(&(objectClass=user)(memberOf={escaped_query}))"
-        attributes = ['name', 'mail', 'department', 'title', 'telephoneNumber', 
-                     'manager', 'streetAddress', 'l', 'st', 'postalCode', 'co', 
-                     'memberOf', 'whenCreated', 'whenChanged',
-                     'sAMAccountName', 'userPrincipalName', 'userAccountControl',
-                     'lastLogon', 'pwdLastSet', 'company', 'employeeID', 'employeeType']
-
-    search_results = search_ldap(ldap_conn, search_filter, attributes, base_dn)
-    close_ldap(ldap_conn)
+    try:
+        query = build_search(search_query, search_type, is_precise, search_by, fields,
+                             request.args.get('match', 'auto'))
+    except ValueError as e:
+        return {"error": str(e), "truncated": False}, 400
+    if query is None:
+        return {"error": "Invalid search type", "truncated": False}, 400
+    plan, attributes, formatter = query
+    search_filter = plan.filter
+    g.query_plan = plan
+    if os.getenv('FLASK_ENV') == 'development':
+        print(f"Search plan for {search_query!r}: {plan}")
+    
+    domains = selected_domains()
+    if not domains:
+        return {"error": "Unknown or inactive domain", "truncated": False}, 404
+    
+    # Fuzzy searches are served from the local mirror when it is current;
+    # source=ldap forces a live query.
+    use_mirror = (MIRROR_ENABLED and not is_precise and not limit and not stream_format
+                  and search_type in ('users', 'groups') and not search_by
+                  and request.args.get('source') != 'ldap')
+    
+    if len(domains) > 1 or request.args.get('domain') == 'all':
+        if limit or stream_format:
+            return {"error": "Paging and streaming need a single domain", "truncated": False}, 400
+        return fan_out_search(domains, search_filter, attributes, formatter,
+                              mirror_query=(search_type, search_query, fields) if use_mirror else None)
+    
+    if use_mirror:
+        results = search_mirror(domains[0], search_query, search_type, fields)
+        if results is not None:
+            return results
+    
+    if stream_format or limit:
+        # Get connection and base_dn
+        connection_info = get_ldap_connection(domains[0]['id'])
+        if not connection_info or not connection_info[0]:
+            return {"error": "Could not connect to LDAP server", "truncated": False}, 500
+        ldap_conn, base_dn = connection_info  # Unpack the tuple
+
+        if stream_format:
+            return stream_search(ldap_conn, search_filter, attributes, base_dn, formatter, stream_format)
+        return search_page_response(ldap_conn, search_type, search_filter, fields, base_dn, limit)
+
+    search_results = shared_search(domains[0]['id'], search_filter, attributes)
+    if search_results is None:
+        return {"error": "Could not connect to LDAP server", "truncated": False}, 500
 
     if search_results["status"] == "error":
         return {"error": "Search failed", "truncated": False}, 500
 
-    results = []
-    if search_results["results"]:
-        if search_type in ['users', 'group_members']:
-            valid_results = [entry for entry in search_results["results"] if entry[0] is not None]
-            results = [format_user(entry) for entry in valid_results if format_user(entry)]
-        elif search_type == 'groups':
-            results = [format_group(entry) for entry in search_results["results"] if format_group(entry)]
-
     return {
-        "data": results,
+        "data": format_entries(search_results["results"], formatter),
         "truncated": search_results["truncated"]
     }
 
 @app.teardown_appcontext
 def teardown_ldap(exception):
-    pass
+    # Return any connection a handler did not release (e.g. after an error)
+    for ldap_conn in list(g.get('ldap_conns', [])):
+        close_ldap(ldap_conn, broken=exception is not None)
 
 @app.route('/groups/<group_id>', methods=['GET'])
 @require_api_key
+@cached_response
+@admission_control(CHEAP)
 def get_group_details(group_id):
-    connection_info = get_ldap_connection()
-    if not connection_info or not connection_info[0]:
-        return {"error": "Could not connect to LDAP server"}, 500
+    try:
+        attributes, formatter = select_fields('groups', request.args.get('fields'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
 
-    ldap_conn, base_dn = connection_info
+    domain_id = request.args.get('domain_id', type=int)
     search_filter = f"(distinguishedName={escape_ldap_filter(group_id)})"
-    attributes = ['name', 'description', 'groupType', 'member', 'managedBy', 'whenCreated', 'whenChanged']
     
-    ldap_results = search_ldap(ldap_conn, search_filter, attributes, base_dn)
-    close_ldap(ldap_conn)
-
+    ldap_results = shared_search(domain_id, search_filter, attributes)
+    if ldap_results is None:
+        return {"error": "Could not connect to LDAP server"}, 500
+    group = None
     if ldap_results["status"] == "success" and ldap_results["results"]:
-        group = format_group(ldap_results["results"][0])
-        if group:
-            return jsonify(group)
+        entry = ldap_results["results"][0]
+        group = formatter(entry)
+        if group and 'members' in group:
+            add_member_count(domain_id, group, entry)
+
+    if group:
+        return jsonify(group)
     
     return {"error": "Group not found"}, 404
 
+def add_member_count(domain_id, group, entry):
+    """Set memberCount, walking the remaining ``member`` ranges of a large group.
+
+    Only the first range is returned in ``members``; membersNextStart is
+    where /groups/<id>/member-dns continues (null when the list is complete).
+    """
+    values, next_start = ranged_values(entry[1], 'member')
+    group["membersNextStart"] = next_start
+    if next_start is None:
+        group["memberCount"] = len(values)
+        return
+    ldap_conn, _ = get_ldap_connection(domain_id)
+    if not ldap_conn:
+        group["memberCount"] = None
+        return
+    try:
+        group["memberCount"] = len(values) + sum(1 for _ in iter_ranged(ldap_conn, entry[0], 'member',
+                                                                         next_start=next_start))
+    except ldap.LDAPError as e:
+        print(f"LDAP member count error: {e}")
+        group["memberCount"] = None
+    close_ldap(ldap_conn)
+
+@app.route('/groups/<group_id>/member-dns', methods=['GET'])
+@require_api_key
+@cached_response
+@admission_control(EXPENSIVE)
+def get_group_member_dns(group_id):
+    """Member DNs of a group straight from its ``member`` attribute, range by range.
+
+    ``start``/``limit`` read one slice (``next_start`` continues it);
+    ``format=ndjson`` streams every DN.
+    """
+    start = max(0, request.args.get('start', 0, type=int))
+    stream_format = request.args.get('format')
+    if stream_format and stream_format not in STREAM_FORMATS:
+        return {"error": "Invalid format"}, 400
+
+    connection_info = get_ldap_connection(request.args.get('domain_id', type=int))
+    if not connection_info or not connection_info[0]:
+        return {"error": "Could not connect to LDAP server"}, 500
+    ldap_conn = connection_info[0]
+
+    if stream_format:
+        return stream_member_dns(ldap_conn, group_id, start, stream_format)
+
+    try:
+        values, next_start = fetch_range(ldap_conn, group_id, 'member', start, parse_limit())
+    except ldap.NO_SUCH_OBJECT:
+        close_ldap(ldap_conn)
+        return {"error": "Group not found"}, 404
+    except ldap.LDAPError as e:
+        print(f"LDAP Search Error: {e}")
+        close_ldap(ldap_conn, broken=True)
+        return {"error": "Failed to fetch group members"}, 500
+    close_ldap(ldap_conn)
+
+    return jsonify({
+        "data": [value.decode('utf-8') for value in values],
+        "next_start": next_start,
+        "truncated": next_start is not None
+    })
+
+def stream_member_dns(ldap_conn, group_id, start, stream_format):
+    def generate():
+        count = 0
+        error = None
+        if stream_format == 'json-stream':
+            yield '{"data":['
+        try:
+            for value in iter_ranged(ldap_conn, group_id, 'member', next_start=start):
+                dn = json.dumps(value.decode('utf-8'))
+                if stream_format == 'ndjson':
+                    yield dn + '\n'
+                else:
+                    yield (',' if count else '') + dn
+                count += 1
+        except ldap.LDAPError as e:
+            print(f"LDAP Search Error: {e}")
+            error = "Failed to fetch group members"
+        finally:
+            close_ldap(ldap_conn)
+        
+        if stream_format == 'ndjson':
+            if error:
+                yield json.dumps({"error": error}) + '\n'
+        else:
+            trailer = {"total_count": count, "truncated": False}
+            if error:
+                trailer["error"] = error
+            yield '],' + json.dumps(trailer)[1:]
+    
+    # The generator owns the connection from here; teardown runs before the body is sent
+    detach_ldap(ldap_conn)
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+
 @app.route('/domains', methods=['GET'])
 @require_api_key
 def get_domains():
-    with get_db() as db:
-        cursor = db.cursor()
-        cursor.execute('SELECT id, name FROM domains WHERE is_active = 1')
-        domains = cursor.fetchall()
-        return jsonify([{'id': d[0], 'name': d[1]} for d in domains])
+    return jsonify([{'id': d['id'], 'name': d['name']} for d in config_cache.list_domains()])
 
 @app.route('/groups/<group_id>/members', methods=['GET'])
 @require_api_key
+@cached_response
+@admission_control(EXPENSIVE)
 def get_group_members(group_id):
     """New endpoint specifically for fetching group members"""
-    connection_info = get_ldap_connection()
-    if not connection_info or not connection_info[0]:
-        return {"error": "Could not connect to LDAP server"}, 500
+    cursor = request.args.get('cursor')
+    if cursor:
+        return resume_search(cursor, 'group_members')
+    
+    try:
+        attributes, formatter = select_fields('group_members', request.args.get('fields'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
 
-    ldap_conn, base_dn = connection_info
-    search_filter = f"(&(objectClass=user)(memberOf={escape_ldap_filter(group_id)}))"
-    attributes = ['name', 'mail', 'department', 'title', 'telephoneNumber', 
-                 'manager', 'streetAddress', 'l', 'st', 'postalCode', 'co', 
-                 'memberOf', 'whenCreated', 'whenChanged', 'sAMAccountName', 
-                 'userPrincipalName', 'userAccountControl', 'lastLogon', 
-                 'pwdLastSet', 'company', 'employeeID', 'employeeType']
+    domain_id = request.args.get('domain_id', type=int)
+    search_filter = membership_filter('user', 'memberOf', group_id, parse_transitive())
     
-    ldap_results = search_ldap(ldap_conn, search_filter, attributes, base_dn)
-    close_ldap(ldap_conn)
+    stream_format = request.args.get('format')
+    limit = parse_limit()
+    if stream_format in STREAM_FORMATS or limit:
+        connection_info = get_ldap_connection(domain_id)
+        if not connection_info or not connection_info[0]:
+            return {"error": "Could not connect to LDAP server"}, 500
+        ldap_conn, base_dn = connection_info
+        
+        if stream_format in STREAM_FORMATS:
+            return stream_search(ldap_conn, search_filter, attributes, base_dn, formatter, stream_format)
+        return search_page_response(ldap_conn, 'group_members', search_filter, request.args.get('fields'),
+                                    base_dn, limit)
+    
+    ldap_results = shared_search(domain_id, search_filter, attributes)
+    if ldap_results is None:
+        return {"error": "Could not connect to LDAP server"}, 500
 
     if ldap_results["status"] == "success":
-        users = [format_user(entry) for entry in ldap_results["results"] if format_user(entry)]
+        users = format_entries(ldap_results["results"], formatter)
         return jsonify({
             "data": users,
-            "total_count": ldap_results.get("total_count", len(users))
+            "total_count": ldap_results.get("total_count", len(users)),
+            "truncated": ldap_results["truncated"]
         })
     
     return {"error": "Failed to fetch group members"}, 500
 
+# Group cards only need these; every group's full member list would make
+# a user with many memberships very expensive.
+USER_GROUP_FIELDS = 'name,description,type,owner'
+
+@app.route('/users/<user_id>/groups', methods=['GET'])
+@require_api_key
+@cached_response
+@admission_control(CHEAP)
+def get_user_groups(user_id):
+    """Groups a user belongs to; transitive=true includes groups reached through nesting"""
+    try:
+        attributes, formatter = select_fields('groups', request.args.get('fields', USER_GROUP_FIELDS))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    search_filter = membership_filter('group', 'member', user_id, parse_transitive())
+    
+    ldap_results = shared_search(request.args.get('domain_id', type=int), search_filter, attributes)
+    if ldap_results is None:
+        return {"error": "Could not connect to LDAP server"}, 500
+
+    if ldap_results["status"] == "success":
+        groups = format_entries(ldap_results["results"], formatter)
+        return jsonify({
+            "data": sorted(groups, key=lambda group: group["name"].lower()),
+            "total_count": len(groups),
+            "truncated": ldap_results["truncated"]
+        })
+    
+    return {"error": "Failed to fetch user groups"}, 500
+
+def org_tree():
+    """(tree, None) for the request's domain, or (None, error response)"""
+    if not ORG_CHART_ENABLED:
+        return None, (jsonify({"error": "The org chart is disabled"}), 404)
+    domain = config_cache.get_domain(request.args.get('domain_id', type=int))
+    if not domain:
+        return None, (jsonify({"error": "Unknown or inactive domain"}), 404)
+    tree = org_chart.get(domain['id'])
+    if tree is None:
+        return None, (jsonify({"error": "The org chart is still loading"}), 503, {"Retry-After": "5"})
+    return tree, None
+
+@app.route('/users/<user_id>/chain', methods=['GET'])
+@require_api_key
+def get_reporting_chain(user_id):
+    """A user's managers, from the direct one up to the top of the tree"""
+    tree, error = org_tree()
+    if error:
+        return error
+    with timed('org_chart'):
+        user = tree.person(user_id)
+        chain = tree.chain(user_id)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify({"user": user, "chain": chain, "indexed_at": tree.built_at})
+
+@app.route('/users/<user_id>/reports', methods=['GET'])
+@require_api_key
+def get_reports(user_id):
+    """A user's reports as a tree, ``depth`` levels down (1 = direct reports)"""
+    tree, error = org_tree()
+    if error:
+        return error
+    depth = min(max(request.args.get('depth', 1, type=int), 1), ORG_MAX_DEPTH)
+    with timed('org_chart'):
+        user, count, truncated = tree.subtree(user_id, depth)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify({"user": user, "total_count": count, "truncated": truncated, "indexed_at": tree.built_at})
+
+@app.route('/suggest', methods=['GET'])
+@require_api_key
+def suggest():
+    """Type-ahead matches by name, sAMAccountName or mail prefix, served from memory"""
+    if not SUGGEST_ENABLED:
+        return jsonify({"error": "Suggestions are disabled"}), 404
+    suggest_type = request.args.get('type')
+    if suggest_type and suggest_type not in SUGGEST_KINDS:
+        return jsonify({"error": "Invalid type"}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), SUGGEST_MAX_LIMIT)
+    
+    domain = config_cache.get_domain(request.args.get('domain_id', type=int))
+    if not domain:
+        return jsonify({"error": "Unknown or inactive domain"}), 404
+    index = suggest_index.get(domain['id'])
+    if index is None:
+        return jsonify({"error": "Suggestions are still loading"}), 503, {"Retry-After": "5"}
+    
+    with timed('suggest', domain['id']):
+        data = index.suggest(request.args.get('q', ''), limit, SUGGEST_KINDS.get(suggest_type))
+    return jsonify({"data": data})
+
+def lookup_searches():
+    # A lookup makes one search per chunk of OR terms, and is charged one token for each
+    data = request.get_json(silent=True) or {}
+    keys = data.get('keys') if isinstance(data, dict) else None
+    if not isinstance(keys, list):
+        return 1
+    return search_count([key for key in keys[:LOOKUP_MAX_KEYS] if isinstance(key, str)], data.get('by', 'auto'))
+
+def lookup_cost():
+    return CHEAP if lookup_searches() == 1 else EXPENSIVE
+
+def body_domain(data):
+    """(domain, None) for a JSON body's domain_id, the default if absent, or (None, error response)"""
+    domain_id = data.get('domain_id')
+    if domain_id is not None:
+        try:
+            domain_id = int(domain_id)
+        except (TypeError, ValueError):
+            return None, (jsonify({"error": "domain_id must be an integer"}), 400)
+    domain = config_cache.get_domain(domain_id)
+    if not domain:
+        return None, (jsonify({"error": "Unknown or inactive domain"}), 400)
+    return domain, None
+
+@app.route('/lookup', methods=['POST'])
+@require_api_key
+@admission_control(lookup_cost, weight=lookup_searches)
+def lookup():
+    """Resolve many sAMAccountNames, UPNs, employeeIDs or DNs in one request"""
+    data = request.json or {}
+    keys = data.get('keys')
+    if not isinstance(keys, list) or not keys or not all(isinstance(key, str) and key for key in keys):
+        return jsonify({"error": "keys must be a non-empty list of strings"}), 400
+    keys = list(dict.fromkeys(keys))
+    if len(keys) > LOOKUP_MAX_KEYS:
+        return jsonify({"error": f"At most {LOOKUP_MAX_KEYS} keys per request"}), 400
+    
+    lookup_type = data.get('type', 'users')
+    by = data.get('by', 'auto')
+    if lookup_type not in OBJECT_CLASSES or (by != 'auto' and by not in LOOKUP_BY):
+        return jsonify({"error": "Invalid type or by"}), 400
+    fields = data.get('fields')
+    if isinstance(fields, list):
+        fields = ','.join(fields)
+
+    domain, error = body_domain(data)
+    if error:
+        return error
+    connection_info = get_ldap_connection(domain['id'])
+    if not connection_info or not connection_info[0]:
+        return jsonify({"error": "Could not connect to LDAP server"}), 500
+
+    ldap_conn, base_dn = connection_info
+    try:
+        results = lookup_entries(ldap_conn, base_dn, keys, lookup_type, by, fields)
+    except ValueError as e:
+        close_ldap(ldap_conn)
+        return jsonify({"error": str(e)}), 400
+    except ldap.LDAPError as e:
+        print(f"LDAP lookup error: {e}")
+        close_ldap(ldap_conn, broken=True)
+        return jsonify({"error": "Lookup failed"}), 500
+    close_ldap(ldap_conn)
+    
+    return jsonify({
+        "data": results,
+        "missing": [key for key, entry in results.items() if entry is None]
+    })
+
+def membership_index(data):
+    """(index, None) for the request's domain, or (None, error response)"""
+    if not GROUP_INDEX_ENABLED:
+        return None, (jsonify({"error": "The group index is disabled"}), 404)
+    domain, error = body_domain(data)
+    if error:
+        return None, error
+    index = group_index.get(domain['id'])
+    if index is None:
+        return None, (jsonify({"error": "The group index is still loading"}), 503, {"Retry-After": "5"})
+    return index, None
+
+@app.route('/groups/query', methods=['POST'])
+@require_api_key
+def query_groups():
+    """Count (and optionally list) the entries matched by AND/OR/NOT over group memberships"""
+    data = request.json or {}
+    index, error = membership_index(data)
+    if error:
+        return error
+    kind = data.get('type', 'users')
+    where = data.get('where') or {}
+    if kind not in GROUP_INDEX_KINDS and kind != 'all':
+        return jsonify({"error": "Invalid type"}), 400
+    if not isinstance(where, dict):
+        return jsonify({"error": "where must be an object"}), 400
+    try:
+        offset = max(int(data.get('offset', 0)), 0)
+        limit = min(max(int(data.get('limit', 100)), 1), GROUP_QUERY_MAX_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({"error": "offset and limit must be integers"}), 400
+
+    try:
+        with timed('group_query'):
+            matched = index.evaluate(data.get('query'), data.get('transitive') is True, where,
+                                     GROUP_INDEX_KINDS.get(kind))
+            count = index.count(matched)
+            members = index.page(matched, offset, limit) if data.get('members') is True else None
+    except QueryError as e:
+        return jsonify({"error": str(e), "unknown": e.unknown}), 400
+
+    results = {"count": count, "indexed_at": index.built_at}
+    if members is not None:
+        results["data"] = members
+        results["next_offset"] = offset + limit if offset + limit < count else None
+    return jsonify(results)
+
+@app.route('/groups/overlap', methods=['POST'])
+@require_api_key
+def group_overlap():
+    """Sizes of the given groups and how many members each pair shares"""
+    data = request.json or {}
+    index, error = membership_index(data)
+    if error:
+        return error
+    groups = data.get('groups')
+    if not isinstance(groups, list) or len(groups) < 2 or not all(isinstance(dn, str) for dn in groups):
+        return jsonify({"error": "groups must be a list of at least two group DNs"}), 400
+    if len(groups) > GROUP_QUERY_MAX_LIMIT:
+        return jsonify({"error": f"At most {GROUP_QUERY_MAX_LIMIT} groups per request"}), 400
+    kind = data.get('type', 'users')
+    if kind not in GROUP_INDEX_KINDS and kind != 'all':
+        return jsonify({"error": "Invalid type"}), 400
+
+    try:
+        with timed('group_query'):
+            results = index.overlap(list(dict.fromkeys(groups)), data.get('transitive') is True,
+                                    GROUP_INDEX_KINDS.get(kind))
+    except QueryError as e:
+        return jsonify({"error": str(e), "unknown": e.unknown}), 400
+    results["indexed_at"] = index.built_at
+    return jsonify(results)
+
+def stream_export(ldap_conn, export, export_format, base_dn, encoder, pages=None, pending=(), offset=0):
+    """Write an export as each LDAP page arrives.
+
+    A csv or jsonl download that breaks off can be resumed on any worker
+    with the ``X-Export-Cursor`` token, which seals the export itself
+    rather than a position (see export_entries). A resumed response sends
+    ``pending`` rows and then the rest of ``pages``; its
+    ``X-Export-Offset`` says how many rows come before it.
+    """
+    pages = iter_export(ldap_conn, export, base_dn) if pages is None else pages
+
+    def generate():
+        broken = False
+        try:
+            yield encoder.begin()
+            if pending:
+                yield encoder.encode(pending)
+            for rows, _ in pages:
+                yield encoder.encode(rows)
+            yield encoder.end()
+        except ldap.LDAPError as e:
+            print(f"LDAP Export Error: {e}")
+            broken = True
+            if export_format != 'jsonl':
+                # Abort the transfer so the client can't mistake a partial file for a whole one
+                raise
+            yield (json.dumps({"error": "Export failed"}) + '\n').encode('utf-8')
+        finally:
+            close_ldap(ldap_conn, broken)
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="{export.kind}.{export_format}"',
+        'X-Export-Offset': str(offset),
+    }
+    if export_format in RESUMABLE_FORMATS:
+        headers['X-Export-Cursor'] = seal('export', {"export": export.spec(), "format": export_format,
+                                                     "domain": ldap_pool.domain_of(ldap_conn), "base": base_dn})
+    detach_ldap(ldap_conn)
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
+def resume_export(kind, token):
+    """Continue an export after the last row the client kept (``after``, plus ``after_group`` for membership).
+
+    The export is read again from the start up to that row, so this works
+    on whichever worker the request lands on.
+    """
+    spec = unseal(token, 'export', EXPORT_RESUME_TTL)
+    if spec is None or spec["export"]["kind"] != kind:
+        return jsonify({"error": "Export cursor expired or invalid"}), 410
+    export = Export(**spec["export"])
+    after = request.args.get('after')
+    if after and kind == 'membership' and not request.args.get('after_group'):
+        return jsonify({"error": "after_group is required to resume a membership export"}), 400
+    encoder = make_encoder(spec["format"], export, header=False)
+
+    ldap_conn, _ = get_ldap_connection(spec["domain"])
+    if not ldap_conn:
+        return jsonify({"error": "Could not connect to LDAP server"}), 500
+    pages = iter_export(ldap_conn, export, spec["base"])
+    pending, offset = (), 0
+    if after:
+        try:
+            with timed('cursor_replay', spec["domain"]):
+                pending, offset = skip_past(pages, export, {"id": after, "member": after,
+                                                            "group": request.args.get('after_group')})
+        except LookupError as e:
+            close_ldap(ldap_conn)
+            return jsonify({"error": f"{e}; start the export again"}), 410
+        except ldap.LDAPError as e:
+            print(f"LDAP Export Error: {e}")
+            close_ldap(ldap_conn, broken=True)
+            return jsonify({"error": "Export failed"}), 500
+    return stream_export(ldap_conn, export, spec["format"], spec["base"], encoder, pages, pending, offset)
+
+@app.route('/export/<kind>', methods=['GET'])
+@require_api_key
+@admission_control(EXPENSIVE)
+def export_entries(kind):
+    """Full dumps of users, groups or group membership as CSV, JSON lines or Parquet"""
+    token = request.args.get('cursor')
+    if token:
+        return resume_export(kind, token)
+
+    export_format = request.args.get('format', 'csv')
+    enabled = request.args.get('enabled')
+    try:
+        export = Export(kind, request.args.get('fields'), None if enabled is None else enabled.lower() == 'true',
+                        request.args.getlist('group'), parse_transitive())
+        encoder = make_encoder(export_format, export)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    connection_info = get_ldap_connection(request.args.get('domain_id', type=int))
+    if not connection_info or not connection_info[0]:
+        return jsonify({"error": "Could not connect to LDAP server"}), 500
+    ldap_conn, base_dn = connection_info
+    return stream_export(ldap_conn, export, export_format, base_dn, encoder)
+
+@app.route('/jobs', methods=['POST'])
+@require_api_key
+@admission_control(EXPENSIVE)
+def submit_job():
+    """Run a large search or member listing in the background; poll /jobs/<id> for progress"""
+    data = request.json or {}
+    kind = data.get('kind')
+    if kind not in JOB_KINDS:
+        return jsonify({"error": f"kind must be one of: {', '.join(JOB_KINDS)}"}), 400
+    domain, error = body_domain(data)
+    if error:
+        return error
+    params = {key: value for key, value in data.items() if key not in ('kind', 'domain_id')}
+    try:
+        job_id = job_store.submit(kind, params, domain)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+    return jsonify({"id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_api_key
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+@require_api_key
+def get_job_results(job_id):
+    """Stored entries from ``offset``; partial while the job is still running"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', JOB_PAGE_SIZE, type=int), 1), JOB_MAX_RESULTS_PAGE)
+    data = job_store.results(job_id, offset, limit)
+    next_offset = offset + len(data)
+    return jsonify({
+        "data": data,
+        "status": job['status'],
+        "entries": job['entries'],
+        # null once a finished job has nothing left past this page
+        "next_offset": None if job['status'] in JOB_FINISHED and next_offset >= job['entries'] else next_offset
+    })
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@require_api_key
+def cancel_job(job_id):
+    if not job_store.cancel(job_id):
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify({"message": "Job cancelled"})
+
 if __name__ == '__main__':
+    start_background_tasks()
     app.run(debug=True, port=4501, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,131 @@
+# ad_dump/src/config_cache.py
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from .database import get_db, decrypt_password
+from .metrics import timed
+
+# How often a worker re-reads the persisted version to notice changes made
+# through another process. Changes made in this process apply immediately.
+CONFIG_CACHE_TTL = float(os.getenv('CONFIG_CACHE_TTL', '30'))
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode()).digest()
+
+
+class ConfigCache:
+    """Process-level copy of the active domains and the admin key.
+
+    Domain passwords are kept in their encrypted form and only decrypted
+    when a new LDAP connection has to be bound. The admin key is held as
+    a SHA-256 digest, never as plaintext.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._domains = {}
+        self._default_domain_id = None
+        self._admin_key_digest = None
+
+    def _read_version(self, cursor):
+        cursor.execute('SELECT value FROM settings WHERE key = ?', ('config_version',))
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < CONFIG_CACHE_TTL:
+            return
+
+        with self._lock:
+            if self._version is not None and now - self._checked_at < CONFIG_CACHE_TTL:
+                return
+
+            with timed('config_db'), get_db() as db:
+                cursor = db.cursor()
+                version = self._read_version(cursor)
+                if version != self._version:
+                    self._load(cursor)
+                    self._version = version
+            self._checked_at = now
+
+    def _load(self, cursor):
+        cursor.execute('''
+            SELECT id, name, server, username, password, base_dn
+            FROM domains
+            WHERE is_active = 1
+            ORDER BY id
+        ''')
+        domains = {}
+        for row in cursor.fetchall():
+            domains[row[0]] = {
+                'id': row[0],
+                'name': row[1],
+                'server': row[2],
+                'username': row[3],
+                'password': row[4],
+                'base_dn': row[5],
+            }
+        self._domains = domains
+        self._default_domain_id = next(iter(domains), None)
+
+        cursor.execute('SELECT value FROM settings WHERE key = ?', ('admin_key',))
+        result = cursor.fetchone()
+        self._admin_key_digest = _digest(decrypt_password(result[0])) if result else None
+
+    def get_domain(self, domain_id=None):
+        """Return an active domain by id, or the first active one."""
+        self._refresh()
+        if domain_id is None:
+            domain_id = self._default_domain_id
+        return self._domains.get(domain_id)
+
+    def select(self, spec=None):
+        """Resolve a domain selector: empty for the default domain, ``all``,
+        or comma-separated ids. Returns [] if any requested id is unknown."""
+        self._refresh()
+        if not spec:
+            domain = self.get_domain()
+            return [domain] if domain else []
+        if spec == 'all':
+            return list(self._domains.values())
+        try:
+            ids = list(dict.fromkeys(int(part) for part in str(spec).split(',')))
+        except ValueError:
+            return []
+        if not all(domain_id in self._domains for domain_id in ids):
+            return []
+        return [self._domains[domain_id] for domain_id in ids]
+
+    def list_domains(self):
+        self._refresh()
+        return list(self._domains.values())
+
+    def is_setup(self):
+        self._refresh()
+        return self._admin_key_digest is not None
+
+    def check_admin_key(self, candidate):
+        self._refresh()
+        if self._admin_key_digest is None:
+            return False
+        return hmac.compare_digest(_digest(candidate), self._admin_key_digest)
+
+    def bump(self, db):
+        """Record a config change; call inside the same connection that made it."""
+        cursor = db.cursor()
+        version = self._read_version(cursor) + 1
+        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                       ('config_version', str(version)))
+        db.commit()
+        with self._lock:
+            self._checked_at = 0.0
+
+
+config_cache = ConfigCache()
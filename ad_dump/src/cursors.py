@@ -0,0 +1,150 @@
+# ad_dump/src/cursors.py
+import json
+import os
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import ldap
+from cryptography.fernet import InvalidToken
+
+from .database import cipher_suite
+from .ldap_pool import ldap_pool, POOL_SIZE
+
+CURSOR_TTL = float(os.getenv('SEARCH_CURSOR_TTL', '60'))
+# Open cursors pin a pooled connection (AD keeps paged-search state per
+# connection), so only part of each domain's pool may be held this way.
+CURSOR_MAX_PER_DOMAIN = int(os.getenv('SEARCH_CURSOR_MAX_PER_DOMAIN', str(max(1, POOL_SIZE // 2))))
+# How often expired cursors are closed when no new cursor or resume comes by to do it
+CURSOR_SWEEP_INTERVAL = max(1.0, CURSOR_TTL / 4)
+
+
+class SearchCursor:
+    def __init__(self, ldap_conn, domain_id, search_type, search_filter, attributes, formatter, base_dn, limit,
+                 cookie):
+        self.ldap_conn = ldap_conn
+        self.domain_id = domain_id
+        self.search_type = search_type
+        self.search_filter = search_filter
+        self.attributes = attributes
+        self.formatter = formatter
+        self.base_dn = base_dn
+        self.limit = limit
+        self.cookie = cookie
+        self.expires = time.monotonic() + CURSOR_TTL
+
+
+def new_token():
+    return secrets.token_urlsafe(24)
+
+
+def seal(kind, spec):
+    """An opaque token carrying ``spec``, so any worker process can continue from it.
+
+    Tokens are encrypted with ENCRYPTION_KEY: clients can't read the
+    filter inside or hand in one of their own.
+    """
+    data = zlib.compress(json.dumps(dict(spec, kind=kind), separators=(',', ':')).encode())
+    return cipher_suite.encrypt(data).decode()
+
+
+def unseal(token, kind, ttl=CURSOR_TTL):
+    """The spec of a sealed token; None if it is invalid, older than ``ttl`` or for another ``kind``"""
+    try:
+        spec = json.loads(zlib.decompress(cipher_suite.decrypt(token.encode(), ttl=max(1, int(ttl)))))
+    except (InvalidToken, ValueError, zlib.error):
+        return None
+    return spec if isinstance(spec, dict) and spec.get('kind') == kind else None
+
+
+def drop_paging(ldap_conn, search_filter, base_dn, cookie):
+    """Hand a connection back to the pool, ending the paged search open on it"""
+    if cookie:
+        try:
+            # A zero-size page request tells the server to drop the result set
+            lc = ldap.controls.SimplePagedResultsControl(True, size=0, cookie=cookie)
+            msgid = ldap_conn.search_ext(base_dn, ldap.SCOPE_SUBTREE, search_filter, ['1.1'], serverctrls=[lc])
+            ldap_conn.result3(msgid)
+        except ldap.LDAPError:
+            pass
+    ldap_pool.release(ldap_conn)
+
+
+class CursorStore:
+    """Connections parked behind the ``cursor`` tokens this process handed out.
+
+    A cursor token is sealed (see ``seal``) and holds enough to run its
+    search again up to where the last page ended, so any worker can
+    continue it. The worker that served the last page also keeps the
+    connection and paging cookie here for CURSOR_TTL seconds, and if the
+    next request lands on it the search just goes on. Parked cursors are
+    single use: resuming takes the cursor out of the store. A sweeper
+    thread hands expired ones back to the pool, so abandoned cursors
+    don't hold connections on a worker that gets no more searches.
+    """
+
+    def __init__(self):
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def _after_fork(self):
+        # Cursors hold the parent's connections and the sweeper stays behind
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def _close(self, cursor):
+        drop_paging(cursor.ldap_conn, cursor.search_filter, cursor.base_dn, cursor.cookie)
+
+    def _sweep(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for token, cursor in list(self._cursors.items()):
+                if cursor.expires < now:
+                    expired.append(self._cursors.pop(token))
+        for cursor in expired:
+            self._close(cursor)
+
+    def _run_sweeper(self):
+        while True:
+            try:
+                self._sweep()
+            except Exception as e:
+                print(f"Cursor cleanup failed: {e}")
+            time.sleep(CURSOR_SWEEP_INTERVAL)
+
+    def start(self):
+        with self._lock:
+            if self._sweeper:
+                return
+            self._sweeper = threading.Thread(target=self._run_sweeper, name='cursor-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def open(self, cursor, token=None):
+        self._sweep()
+        evicted = []
+        token = token or new_token()
+        with self._lock:
+            same_domain = [t for t, c in self._cursors.items() if c.domain_id == cursor.domain_id]
+            while len(same_domain) >= CURSOR_MAX_PER_DOMAIN:
+                evicted.append(self._cursors.pop(same_domain.pop(0)))
+            self._cursors[token] = cursor
+        for old in evicted:
+            self._close(old)
+        return token
+
+    def take(self, token, search_type):
+        self._sweep()
+        with self._lock:
+            cursor = self._cursors.get(token)
+            if cursor is None or cursor.search_type != search_type:
+                return None
+            return self._cursors.pop(token)
+
+
+cursor_store = CursorStore()
+os.register_at_fork(after_in_child=cursor_store._after_fork)
@@ -0,0 +1,194 @@
+# ad_dump/src/dc_health.py
+import os
+import re
+import threading
+import time
+
+try:
+    import dns.resolver
+except ImportError:
+    dns = None
+
+# Consecutive failures that open a server's circuit
+DC_FAILURE_THRESHOLD = int(os.getenv('DC_FAILURE_THRESHOLD', '3'))
+# First cool-down of an open circuit; it doubles on each failed probe up to DC_MAX_OPEN_SECONDS
+DC_OPEN_SECONDS = float(os.getenv('DC_OPEN_SECONDS', '30'))
+DC_MAX_OPEN_SECONDS = float(os.getenv('DC_MAX_OPEN_SECONDS', '300'))
+# Healthy servers are re-measured this often, so a faster DC that comes back is noticed
+DC_PROBE_INTERVAL = float(os.getenv('DC_PROBE_INTERVAL', '60'))
+DC_DISCOVERY_INTERVAL = float(os.getenv('DC_DISCOVERY_INTERVAL', '300'))
+# Weight of the newest round trip in each server's moving average
+LATENCY_ALPHA = 0.3
+
+
+def _with_scheme(server, port=None):
+    if '://' in server:
+        return server
+    if port:
+        return f"{'ldaps' if port == 636 else 'ldap'}://{server}:{port}"
+    return f"ldap://{server}"
+
+
+def resolve_servers(spec):
+    """URIs and priorities for a domain's ``server`` value.
+
+    ``server`` is one URI or several separated by commas or whitespace,
+    listed in order of preference. ``srv:<name>`` entries are looked up
+    as DNS SRV records (e.g. ``srv:_ldap._tcp.dc._msdcs.example.com``),
+    which needs the dnspython package.
+    """
+    servers = []
+    for position, item in enumerate(part for part in re.split(r'[\s,]+', spec or '') if part):
+        if not item.lower().startswith('srv:'):
+            servers.append((_with_scheme(item), (position, 0)))
+            continue
+        if dns is None:
+            print(f"Cannot resolve {item}: install dnspython for SRV discovery")
+            continue
+        try:
+            answers = dns.resolver.resolve(item[4:], 'SRV')
+        except Exception as e:
+            print(f"SRV lookup of {item[4:]} failed: {e}")
+            continue
+        for record in answers:
+            host = record.target.to_text().rstrip('.')
+            servers.append((_with_scheme(host, record.port), (position, record.priority, -record.weight)))
+    return servers
+
+
+class ServerHealth:
+    def __init__(self, uri, preference):
+        self.uri = uri
+        self.preference = preference
+        self.latency = None
+        self.sampled_at = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.open_seconds = DC_OPEN_SECONDS
+        self.probing = False
+        self.last_error = None
+
+    def is_open(self, now):
+        return self.failures >= DC_FAILURE_THRESHOLD
+
+    def status(self, now):
+        return {
+            "server": self.uri,
+            "state": ("open" if now < self.open_until else "half_open") if self.is_open(now) else "closed",
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ServerSelector:
+    """Latency and error tracking for one domain's controllers.
+
+    Requests go to the healthy server with the lowest moving-average round
+    trip. After DC_FAILURE_THRESHOLD consecutive failures a server's
+    circuit opens and it gets no traffic. Once the cool-down has passed a
+    background probe (not a user request) tries it again: success closes
+    the circuit, failure doubles the cool-down. Healthy servers are
+    re-probed every DC_PROBE_INTERVAL, so traffic fails back to a faster
+    server when it recovers.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._lock = threading.Lock()
+        self._servers = {}
+        self._resolved_at = 0.0
+        self._resolve()
+
+    def _resolve(self):
+        resolved = resolve_servers(self.spec)
+        self._resolved_at = time.monotonic()
+        if not resolved:
+            # Keep the last known servers rather than going dark on a failed lookup
+            return
+        with self._lock:
+            previous = self._servers
+            self._servers = {}
+            for uri, preference in resolved:
+                health = previous.get(uri) or ServerHealth(uri, preference)
+                health.preference = preference
+                self._servers[uri] = health
+
+    def _maybe_resolve(self):
+        if 'srv:' in self.spec.lower() and time.monotonic() - self._resolved_at > DC_DISCOVERY_INTERVAL:
+            self._resolve()
+
+    def ranked(self):
+        """Servers with a closed circuit, best first; unmeasured ones keep their listed order"""
+        self._maybe_resolve()
+        now = time.monotonic()
+        with self._lock:
+            healthy = [s for s in self._servers.values() if not s.is_open(now)]
+        return [s.uri for s in sorted(healthy, key=lambda s: (s.latency is None, s.latency or 0, s.preference))]
+
+    def best(self):
+        ranked = self.ranked()
+        return ranked[0] if ranked else None
+
+    def due_probes(self):
+        """Servers a background probe should try now"""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for s in self._servers.values():
+                if s.probing:
+                    continue
+                if s.is_open(now) and now >= s.open_until or \
+                        not s.is_open(now) and now - s.sampled_at > DC_PROBE_INTERVAL:
+                    s.probing = True
+                    due.append(s.uri)
+        return due
+
+    def end_probe(self, uri):
+        with self._lock:
+            s = self._servers.get(uri)
+            if s is not None:
+                s.probing = False
+
+    def record_success(self, uri, seconds=None):
+        with self._lock:
+            s = self._servers.get(uri)
+            if s is None:
+                return
+            s.probing = False
+            if s.failures >= DC_FAILURE_THRESHOLD:
+                print(f"Domain controller {uri} is reachable again")
+            s.failures = 0
+            s.open_seconds = DC_OPEN_SECONDS
+            s.last_error = None
+            if seconds is not None:
+                s.latency = seconds if s.latency is None else LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * s.latency
+                s.sampled_at = time.monotonic()
+
+    def record_failure(self, uri, error=None):
+        now = time.monotonic()
+        with self._lock:
+            s = self._servers.get(uri)
+            if s is None:
+                return
+            was_open = s.is_open(now)
+            s.probing = False
+            s.failures += 1
+            s.last_error = str(error) if error else s.last_error
+            if was_open:
+                s.open_seconds = min(s.open_seconds * 2, DC_MAX_OPEN_SECONDS)
+            if s.is_open(now):
+                s.open_until = now + s.open_seconds
+                if not was_open:
+                    print(f"Domain controller {uri} marked down after {s.failures} failures: {error}")
+
+    def is_healthy(self, uri):
+        now = time.monotonic()
+        with self._lock:
+            s = self._servers.get(uri)
+            return s is not None and not s.is_open(now)
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return [s.status(now) for s in self._servers.values()]
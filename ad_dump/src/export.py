@@ -0,0 +1,295 @@
+# ad_dump/src/export.py
+import csv
+import io
+import json
+import os
+import time
+
+import ldap
+
+from .ldap_search import (
+    SCHEMAS, IN_CHAIN_RULE, search_ldap_page, fetch_range, membership_filter, escape_ldap_filter, _multi, _enabled
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', '1000'))
+# A page that times out or finds the DC busy is asked for again with the same cookie
+EXPORT_PAGE_RETRIES = int(os.getenv('EXPORT_PAGE_RETRIES', '3'))
+EXPORT_RETRY_DELAY = 1.0
+# How long after an HTTP export starts its X-Export-Cursor can resume it
+EXPORT_RESUME_TTL = float(os.getenv('EXPORT_RESUME_TTL', '86400'))
+# Rows per Parquet row group; pages are buffered up to this, so memory stays bounded
+EXPORT_PARQUET_ROW_GROUP = int(os.getenv('EXPORT_PARQUET_ROW_GROUP', '10000'))
+
+EXPORT_KINDS = ('users', 'groups', 'membership')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Parquet output cannot be resumed: a file cut short has no footer
+RESUMABLE_FORMATS = ('csv', 'jsonl')
+RETRYABLE_ERRORS = (ldap.TIMEOUT, ldap.BUSY, ldap.UNAVAILABLE)
+# Multi-valued fields in a CSV cell; DNs contain commas, so those can't be used
+CSV_LIST_SEPARATOR = ';'
+# LDAP_MATCHING_RULE_BIT_AND; bit 0x2 of userAccountControl is ACCOUNTDISABLE
+BIT_AND_RULE = '1.2.840.113556.1.4.803'
+
+
+class Export:
+    """The filter, attributes and output columns of one dump.
+
+    ``users`` and ``groups`` write one row per entry with the selected
+    ``fields``; ``groups`` (DNs) limits them to members of those groups.
+    ``membership`` writes one (group, member) row per member of each of
+    ``groups``, with nested members too when ``transitive`` is set.
+    Raises ValueError for anything that can't be exported.
+    """
+
+    def __init__(self, kind, fields=None, enabled=None, groups=(), transitive=False):
+        if kind not in EXPORT_KINDS:
+            raise ValueError(f"Unknown export kind: {kind}")
+        self.kind = kind
+        self.fields = fields
+        self.enabled = enabled
+        self.groups = [dn for dn in groups if dn]
+        self.transitive = transitive
+
+        if kind == 'membership':
+            if not self.groups:
+                raise ValueError("A membership export needs at least one group")
+            if enabled is not None or fields:
+                raise ValueError("A membership export has fixed columns: group, member")
+            self.columns = {'group': 'string', 'member': 'string'}
+            return
+
+        if enabled is not None and kind != 'users':
+            raise ValueError("enabled only applies to users")
+        schema = SCHEMAS[kind]
+        selected = schema.select(fields)
+        self.attributes = [attribute for _, attribute, _ in selected]
+        self.formatter = schema.formatter(selected)
+        self.columns = {'id': 'string'}
+        for key, _, decode in selected:
+            self.columns[key] = 'list' if decode is _multi else 'bool' if decode is _enabled else 'string'
+
+        clauses = [f"(objectClass={'user' if kind == 'users' else 'group'})"]
+        if enabled is not None:
+            disabled = f"(userAccountControl:{BIT_AND_RULE}:=2)"
+            clauses.append(f"(!{disabled})" if enabled else disabled)
+        if self.groups:
+            rule = f":{IN_CHAIN_RULE}:" if transitive else ""
+            clauses.append('(|' + ''.join(f"(memberOf{rule}={escape_ldap_filter(dn)})" for dn in self.groups) + ')')
+        self.search_filter = '(&' + ''.join(clauses) + ')'
+
+    def spec(self):
+        """Arguments that make this export again, e.g. in another worker"""
+        return {'kind': self.kind, 'fields': self.fields, 'enabled': self.enabled, 'groups': self.groups,
+                'transitive': self.transitive}
+
+    def row_key(self, row):
+        """What tells a row apart: its DN, or (group, member) for membership"""
+        if self.kind == 'membership':
+            return ((row.get('group') or '').lower(), (row.get('member') or '').lower())
+        return (row.get('id') or '').lower()
+
+    def page_filter(self, state):
+        """Filter of the paged search ``state`` is part of"""
+        if self.kind != 'membership':
+            return self.search_filter
+        return membership_filter('user', 'memberOf', self.groups[min(state['group'], len(self.groups) - 1)], True)
+
+
+def start_state():
+    # Where the export goes next: paging cookie, membership group and range
+    # start, rows produced before this point and whether anything is left
+    return {'cookie': b'', 'group': 0, 'start': 0, 'rows': 0, 'done': False}
+
+
+def _retrying(fetch, *args):
+    for attempt in range(EXPORT_PAGE_RETRIES + 1):
+        try:
+            return fetch(*args)
+        except RETRYABLE_ERRORS as e:
+            if attempt == EXPORT_PAGE_RETRIES:
+                raise
+            print(f"Export page failed ({e}); asking again with the same cookie")
+            time.sleep(EXPORT_RETRY_DELAY * (attempt + 1))
+
+
+def _entry_pages(ldap_conn, export, base_dn, state):
+    while True:
+        entries, cookie = _retrying(search_ldap_page, ldap_conn, export.search_filter, export.attributes, base_dn,
+                                    EXPORT_PAGE_SIZE, state['cookie'])
+        rows = [row for row in (export.formatter(entry) for entry in entries if entry[0] is not None) if row]
+        state = dict(state, cookie=cookie, rows=state['rows'] + len(rows), done=not cookie)
+        yield rows, state
+        if state['done']:
+            return
+
+
+def _member_pages(ldap_conn, export, base_dn, state):
+    while state['group'] < len(export.groups):
+        group = export.groups[state['group']]
+        if export.transitive:
+            # Nested members only show up through the in-chain rule, one paged search per group
+            entries, cookie = _retrying(search_ldap_page, ldap_conn, export.page_filter(state), ['1.1'], base_dn,
+                                        EXPORT_PAGE_SIZE, state['cookie'])
+            members = [dn for dn, _ in entries if dn is not None]
+            done = not cookie
+            state = dict(state, cookie=cookie)
+        else:
+            try:
+                values, next_start = _retrying(fetch_range, ldap_conn, group, 'member', state['start'])
+            except ldap.NO_SUCH_OBJECT:
+                print(f"Export skipped missing group {group}")
+                values, next_start = [], None
+            members = [value.decode('utf-8') for value in values]
+            done = next_start is None
+            state = dict(state, start=next_start or 0)
+        if done:
+            state = dict(state, group=state['group'] + 1, cookie=b'', start=0)
+        state['rows'] += len(members)
+        state['done'] = state['group'] >= len(export.groups)
+        yield [{'group': group, 'member': member} for member in members], state
+
+
+def iter_export(ldap_conn, export, base_dn, state=None):
+    """Yield (rows, state) per LDAP page; ``state`` is where the next page starts"""
+    state = state or start_state()
+    if state['done']:
+        return iter(())
+    if export.kind == 'membership':
+        return _member_pages(ldap_conn, export, base_dn, state)
+    return _entry_pages(ldap_conn, export, base_dn, state)
+
+
+def skip_past(pages, export, row):
+    """Read ``iter_export`` pages up to the row with ``row``'s key.
+
+    Returns the rows after it on its page and how many rows come before
+    those. Raises LookupError if the directory no longer has it.
+    """
+    key = export.row_key(row)
+    for rows, state in pages:
+        for i, candidate in enumerate(rows):
+            if export.row_key(candidate) == key:
+                return rows[i + 1:], state['rows'] - len(rows) + i + 1
+    raise LookupError("The row to resume after is no longer in the export")
+
+
+class CSVEncoder:
+    def __init__(self, columns, header=True):
+        self.columns = list(columns)
+        self.header = header
+
+    def _cell(self, value):
+        if isinstance(value, list):
+            return CSV_LIST_SEPARATOR.join(value)
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return '' if value is None else value
+
+    def begin(self):
+        if not self.header:
+            return b''
+        return self.encode([dict(zip(self.columns, self.columns))])
+
+    def encode(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerows([self._cell(row.get(column)) for column in self.columns] for row in rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def end(self):
+        return b''
+
+
+class JSONLEncoder:
+    def __init__(self, columns, header=True):
+        pass
+
+    def begin(self):
+        return b''
+
+    def encode(self, rows):
+        return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+
+    def end(self):
+        return b''
+
+
+class _Sink:
+    """Write-only file for pyarrow that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+class ParquetEncoder:
+    def __init__(self, columns, header=True):
+        if pyarrow is None:
+            raise ValueError("Parquet export needs the pyarrow package")
+        self.schema = pyarrow.schema([
+            (name, pyarrow.list_(pyarrow.string()) if kind == 'list' else
+             pyarrow.bool_() if kind == 'bool' else pyarrow.string())
+            for name, kind in columns.items()
+        ])
+        self._sink = _Sink()
+        self._writer = None
+        self._pending = []
+
+    def begin(self):
+        self._writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(self._sink, mode='w'), self.schema,
+                                                     compression='zstd')
+        return self._sink.drain()
+
+    def _write(self):
+        if self._pending:
+            self._writer.write_table(pyarrow.Table.from_pylist(self._pending, schema=self.schema))
+            self._pending = []
+
+    def encode(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= EXPORT_PARQUET_ROW_GROUP:
+            self._write()
+        return self._sink.drain()
+
+    def end(self):
+        self._write()
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {'csv': CSVEncoder, 'jsonl': JSONLEncoder, 'parquet': ParquetEncoder}
+
+
+def make_encoder(export_format, export, header=True):
+    if export_format not in ENCODERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return ENCODERS[export_format](export.columns, header)
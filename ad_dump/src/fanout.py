@@ -0,0 +1,86 @@
+# ad_dump/src/fanout.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import ldap
+
+from .ldap_search import search_domain, format_entries, project_entries, SEARCH_MAX_RESULTS
+from .mirror import directory_mirror
+
+FANOUT_MAX_WORKERS = int(os.getenv('FANOUT_MAX_WORKERS', '8'))
+FANOUT_TIMEOUT = float(os.getenv('FANOUT_TIMEOUT', '10'))
+
+def _new_executor():
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix='fanout')
+
+
+_new_executor()
+# Worker threads do not survive a fork; give each child its own pool
+os.register_at_fork(after_in_child=_new_executor)
+
+
+def _search_domain(domain, search_filter, attributes, formatter, mirror_query, deadline):
+    if mirror_query and directory_mirror.is_fresh(domain['id']):
+        search_type, search_query, fields = mirror_query
+        results, truncated = directory_mirror.search_capped(domain['id'], search_type, search_query,
+                                                            SEARCH_MAX_RESULTS)
+        return project_entries(results, search_type, fields), truncated
+
+    search_results = search_domain(domain, search_filter, attributes, deadline=deadline)
+    if search_results["status"] == "error":
+        raise ldap.LDAPError(search_results["error"])
+    return format_entries(search_results["results"], formatter), search_results["truncated"]
+
+
+def fan_out_search(domains, search_filter, attributes, formatter, mirror_query=None, timeout=FANOUT_TIMEOUT):
+    """Run one search against several domains at once and merge the results.
+
+    Every domain shares the same deadline; whatever has not answered by
+    then is reported as timed out instead of holding up the response.
+    Entries are tagged with their domain and de-duplicated by DN.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    finished_at = {}
+
+    futures = {}
+    for domain in domains:
+        future = _executor.submit(_search_domain, domain, search_filter, attributes, formatter,
+                                  mirror_query, deadline)
+        future.add_done_callback(lambda f: finished_at.setdefault(f, time.monotonic()))
+        futures[future] = domain
+    wait(futures, timeout=timeout)
+
+    merged = {}
+    statuses = []
+    truncated = False
+    for future, domain in futures.items():
+        status = {"id": domain['id'], "name": domain['name']}
+        if not future.done():
+            # Still queued or waiting on the DC; it will finish on its own
+            future.cancel()
+            status.update(status="timeout", latency_ms=round(timeout * 1000, 1))
+            statuses.append(status)
+            continue
+
+        status["latency_ms"] = round((finished_at.get(future, time.monotonic()) - started) * 1000, 1)
+        error = future.exception()
+        if error is not None:
+            status.update(status="timeout" if isinstance(error, ldap.TIMEOUT) else "error", error=str(error))
+        else:
+            results, domain_truncated = future.result()
+            truncated = truncated or domain_truncated
+            for entry in results:
+                key = entry['id'].lower()
+                if key not in merged:
+                    merged[key] = dict(entry, domain_id=domain['id'], domain=domain['name'])
+            status.update(status="ok", count=len(results))
+        statuses.append(status)
+
+    return {
+        "data": sorted(merged.values(), key=lambda entry: (entry.get('name') or '').lower()),
+        "truncated": truncated,
+        "domains": statuses
+    }
@@ -0,0 +1,393 @@
+# ad_dump/src/group_index.py
+import os
+import threading
+import time
+from array import array
+from itertools import islice
+
+from .config_cache import config_cache
+from .ldap_pool import ldap_pool
+from .ldap_search import iter_search_ldap
+from .metrics import timed
+from .shared_index import SharedIndex, INDEX_POLL_INTERVAL
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+GROUP_INDEX_ENABLED = os.getenv('GROUP_INDEX_ENABLED', 'false').lower() == 'true'
+GROUP_INDEX_REFRESH_INTERVAL = float(os.getenv('GROUP_INDEX_REFRESH_INTERVAL', '900'))
+GROUP_INDEX_RETRY_INTERVAL = 60
+GROUP_QUERY_MAX_LIMIT = 1000
+# Deepest nesting of set operators in one query
+GROUP_QUERY_MAX_DEPTH = 32
+# Attribute filters computed per index build; each is one bitmap
+FILTER_CACHE_SIZE = 256
+
+GROUP_INDEX_FILTER = '(|(objectClass=user)(objectClass=group))'
+# Attributes a query can filter on, by the field names /search uses
+FILTER_FIELDS = {
+    'department': 'department',
+    'title': 'title',
+    'company': 'company',
+    'city': 'l',
+    'country': 'co',
+    'employeeType': 'employeeType',
+}
+GROUP_INDEX_ATTRIBUTES = ['name', 'sAMAccountName', 'mail', 'objectClass', 'memberOf', 'userAccountControl'] + \
+    list(FILTER_FIELDS.values())
+
+USER, GROUP = 0, 1
+KINDS = {'users': USER, 'groups': GROUP}
+
+
+# Sets of entry ids. pyroaring's compressed bitmaps when installed; otherwise
+# Python ints used as plain bitsets, which cost one bit per entry per group.
+
+def _bitmap(ids):
+    if BitMap is not None:
+        return BitMap(ids)
+    bits = bytearray()
+    for i in ids:
+        byte = i >> 3
+        if byte >= len(bits):
+            bits.extend(bytes(byte - len(bits) + 1))
+        bits[byte] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _count(bitmap):
+    return len(bitmap) if BitMap is not None else bitmap.bit_count()
+
+
+def _minus(a, b):
+    return a - b if BitMap is not None else a & ~b
+
+
+def _ids(bitmap):
+    """Entry ids in ascending order"""
+    if BitMap is not None:
+        yield from bitmap
+        return
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield byte_index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class QueryError(ValueError):
+    def __init__(self, message, unknown=()):
+        super().__init__(message)
+        self.unknown = list(unknown)
+
+
+def _text(values):
+    return values[0].decode('utf-8', 'replace') if values else None
+
+
+class MembershipIndex:
+    """One domain's users and groups, interned to integer ids, with each
+    group's direct members as a bitmap.
+
+    Built from a single paged pull of ``memberOf``, so a group's size costs
+    nothing extra (no ``member;range=`` walks). Nested membership is the
+    union of a group's bitmap with its member groups', worked out on first
+    use. The primary group (usually Domain Users) is not in ``memberOf`` and
+    so is not indexed.
+    """
+
+    def __init__(self, entries):
+        # entries: (kind, dn, name, sAMAccountName, mail, enabled, {field: value}, [group DNs])
+        self.dns = [entry[1] for entry in entries]
+        self.names = [entry[2] for entry in entries]
+        self.accounts = [entry[3] for entry in entries]
+        self.mails = [entry[4] for entry in entries]
+        self.kinds = bytearray(entry[0] for entry in entries)
+        self.ids_by_dn = {dn.lower(): entry_id for entry_id, dn in enumerate(self.dns)}
+
+        # Filterable attributes are kept as interned value ids per entry (0 = not set)
+        self.values = {}
+        self.columns = {}
+        for field in FILTER_FIELDS:
+            interned = {}
+            column = array('I', bytes(4 * len(entries)))
+            for entry_id, entry in enumerate(entries):
+                value = entry[6].get(field)
+                if value:
+                    column[entry_id] = interned.setdefault(value.lower(), len(interned) + 1)
+            self.values[field] = interned
+            self.columns[field] = column
+
+        members = {}
+        for entry_id, entry in enumerate(entries):
+            for group_dn in entry[7]:
+                group_id = self.ids_by_dn.get(group_dn.lower())
+                # Groups outside this base DN (e.g. another domain's) are not indexed
+                if group_id is not None and self.kinds[group_id] == GROUP:
+                    members.setdefault(group_id, []).append(entry_id)
+        self.direct = {group_id: _bitmap(ids) for group_id, ids in members.items()}
+        self.empty = _bitmap([])
+        self.kind_sets = {kind: _bitmap(i for i, k in enumerate(self.kinds) if k == kind) for kind in (USER, GROUP)}
+        self.enabled = _bitmap(entry_id for entry_id, entry in enumerate(entries) if entry[5])
+        self.memberships = sum(len(ids) for ids in members.values())
+
+        self._nested = {}
+        self._filters = {}
+        self._lock = threading.Lock()
+        self.built_at = time.time()
+
+    def __getstate__(self):
+        # Nested unions and filter bitmaps are worked out again on use
+        state = self.__dict__.copy()
+        for name in ('_nested', '_filters', '_lock'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._nested = {}
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.dns)
+
+    def group_id(self, dn):
+        group_id = self.ids_by_dn.get(dn.lower()) if isinstance(dn, str) else None
+        if group_id is None or self.kinds[group_id] != GROUP:
+            return None
+        return group_id
+
+    def members(self, group_id, transitive=False):
+        if not transitive:
+            return self.direct.get(group_id, self.empty)
+        with self._lock:
+            return self._transitive(group_id, set())[0]
+
+    def _transitive(self, group_id, visiting):
+        cached = self._nested.get(group_id)
+        if cached is not None:
+            return cached, True
+        visiting.add(group_id)
+        result = self.direct.get(group_id, self.empty)
+        complete = True
+        for child in _ids(result & self.kind_sets[GROUP]):
+            if child not in self.direct:
+                continue
+            if child in visiting:
+                complete = False
+                continue
+            nested, child_complete = self._transitive(child, visiting)
+            result = result | nested
+            complete = complete and child_complete
+        visiting.discard(group_id)
+        # Inside a cycle the result depends on where the walk started; only the walk's start is exact
+        if complete or not visiting:
+            self._nested[group_id] = result
+        return result, complete
+
+    def _filter(self, field, value):
+        if field == 'enabled':
+            if not isinstance(value, bool):
+                raise QueryError("enabled must be true or false")
+            return self.enabled if value else _minus(self.kind_sets[USER], self.enabled)
+        if field not in FILTER_FIELDS:
+            raise QueryError(f"Cannot filter on {field}")
+        if not isinstance(value, str):
+            raise QueryError(f"{field} must be a string")
+        key = (field, value.lower())
+        with self._lock:
+            cached = self._filters.get(key)
+        if cached is not None:
+            return cached
+        value_id = self.values[field].get(value.lower())
+        column = self.columns[field]
+        result = self.empty if value_id is None else _bitmap(i for i, v in enumerate(column) if v == value_id)
+        with self._lock:
+            if len(self._filters) >= FILTER_CACHE_SIZE:
+                self._filters.pop(next(iter(self._filters)))
+            self._filters[key] = result
+        return result
+
+    def evaluate(self, expression, transitive=False, where=None, kind=None):
+        """Entry ids matched by a set expression over groups; raises QueryError.
+
+        An expression is a group DN, ``{"and": [...]}``, ``{"or": [...]}`` or
+        ``{"not": expression}``. ``not`` is taken against every indexed entry.
+        ``where`` keeps only entries whose attributes equal the given values
+        (case-insensitively), and ``kind`` only users or only groups.
+        """
+        unknown = []
+        result = self._evaluate(expression, transitive, unknown, 0)
+        if unknown:
+            raise QueryError("Unknown groups", unknown)
+        for field, value in (where or {}).items():
+            result = result & self._filter(field, value)
+        if kind is not None:
+            result = result & self.kind_sets[kind]
+        return result
+
+    def _evaluate(self, expression, transitive, unknown, depth):
+        if depth > GROUP_QUERY_MAX_DEPTH:
+            raise QueryError("Query is nested too deeply")
+        if isinstance(expression, str):
+            group_id = self.group_id(expression)
+            if group_id is None:
+                unknown.append(expression)
+                return self.empty
+            return self.members(group_id, transitive)
+        if not isinstance(expression, dict) or len(expression) != 1:
+            raise QueryError("Each term must be a group DN or one of {\"and\": [...]}, {\"or\": [...]}, {\"not\": ...}")
+        operator, operand = next(iter(expression.items()))
+        if operator == 'not':
+            return _minus(self.kind_sets[USER] | self.kind_sets[GROUP],
+                          self._evaluate(operand, transitive, unknown, depth + 1))
+        if operator not in ('and', 'or') or not isinstance(operand, list) or not operand:
+            raise QueryError(f"{operator} needs a non-empty list of terms")
+        terms = [self._evaluate(term, transitive, unknown, depth + 1) for term in operand]
+        result = terms[0]
+        for term in terms[1:]:
+            result = result & term if operator == 'and' else result | term
+        return result
+
+    def overlap(self, group_dns, transitive=False, kind=None):
+        """Size of each group and of every pair's intersection, counting only ``kind`` if given"""
+        ids = {}
+        unknown = []
+        for dn in group_dns:
+            group_id = self.group_id(dn)
+            if group_id is None:
+                unknown.append(dn)
+            else:
+                members = self.members(group_id, transitive)
+                ids[dn] = members & self.kind_sets[kind] if kind is not None else members
+        if unknown:
+            raise QueryError("Unknown groups", unknown)
+        dns = list(ids)
+        pairs = []
+        for i, a in enumerate(dns):
+            for b in dns[i + 1:]:
+                shared = _count(ids[a] & ids[b])
+                if shared:
+                    pairs.append({"a": a, "b": b, "count": shared})
+        pairs.sort(key=lambda pair: -pair["count"])
+        return {"sizes": {dn: _count(members) for dn, members in ids.items()}, "overlaps": pairs}
+
+    def count(self, bitmap):
+        return _count(bitmap)
+
+    def page(self, bitmap, offset, limit):
+        return [self._format(entry_id) for entry_id in islice(_ids(bitmap), offset, offset + limit)]
+
+    def _format(self, entry_id):
+        return {
+            "id": self.dns[entry_id],
+            "name": self.names[entry_id],
+            "type": 'group' if self.kinds[entry_id] == GROUP else 'user',
+            "samAccountName": self.accounts[entry_id],
+            "email": self.mails[entry_id],
+        }
+
+
+class GroupIndex:
+    """Per-domain membership indexes, rebuilt in the background.
+
+    Like the suggestion index, each build is a full paged pull swapped in
+    whole, made by one worker process and loaded by the others through a
+    SharedIndex.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._shared = SharedIndex('group_index')
+
+    def get(self, domain_id):
+        return self._indexes.get(domain_id)
+
+    def _entries(self, domain):
+        entries = []
+        ldap_conn = ldap_pool.acquire(domain)
+        broken = True
+        try:
+            for dn, attrs in iter_search_ldap(ldap_conn, GROUP_INDEX_FILTER, GROUP_INDEX_ATTRIBUTES, domain['base_dn']):
+                if not dn:
+                    continue
+                kind = GROUP if b'group' in [c.lower() for c in attrs.get('objectClass', [])] else USER
+                control = attrs.get('userAccountControl')
+                enabled = kind == USER and not (int(control[0]) & 2 if control else 0)
+                values = {field: _text(attrs.get(attribute)) for field, attribute in FILTER_FIELDS.items()}
+                entries.append((kind, dn, _text(attrs.get('name')) or dn, _text(attrs.get('sAMAccountName')),
+                                _text(attrs.get('mail')), enabled, values,
+                                [value.decode('utf-8') for value in attrs.get('memberOf', [])]))
+            broken = False
+        finally:
+            ldap_pool.release(ldap_conn, broken)
+        return entries
+
+    def build(self, domain):
+        with timed('group_index_build', domain['id']):
+            index = MembershipIndex(self._entries(domain))
+        self._indexes[domain['id']] = index
+        self._shared.publish(domain['id'], index)
+        print(f"Group index for domain {domain['id']}: {len(index)} entries, "
+              f"{len(index.direct)} groups, {index.memberships} memberships")
+
+    def refresh_all(self):
+        domains = config_cache.list_domains()
+        active = {domain['id'] for domain in domains}
+        for domain_id in list(self._indexes):
+            if domain_id not in active:
+                self._indexes.pop(domain_id, None)
+                self._shared.withdraw(domain_id)
+        ok = True
+        for domain in domains:
+            try:
+                self.build(domain)
+            except Exception as e:
+                print(f"Group index build for domain {domain['id']} failed: {e}")
+                ok = False
+        return ok
+
+    def _load_shared(self):
+        active = {domain['id'] for domain in config_cache.list_domains()}
+        for domain_id in list(self._indexes):
+            if domain_id not in active:
+                self._indexes.pop(domain_id, None)
+        self._indexes.update(self._shared.load_changed(active))
+
+    def request_refresh(self):
+        self._shared.request()
+        self._wake.set()
+
+    def _run(self):
+        next_build = 0
+        while True:
+            self._wake.clear()
+            if not self._shared.is_builder():
+                self._load_shared()
+            elif self._shared.take_request() is not None or time.monotonic() >= next_build:
+                ok = self.refresh_all()
+                next_build = time.monotonic() + (GROUP_INDEX_REFRESH_INTERVAL if ok else
+                                                 min(GROUP_INDEX_RETRY_INTERVAL, GROUP_INDEX_REFRESH_INTERVAL))
+            self._wake.wait(INDEX_POLL_INTERVAL)
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='group-index', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # The builder thread stays behind in the parent
+        self._thread = None
+        self._wake = threading.Event()
+        self._shared._after_fork()
+
+
+group_index = GroupIndex()
+os.register_at_fork(after_in_child=group_index._after_fork)
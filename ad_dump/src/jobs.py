@@ -0,0 +1,285 @@
+# ad_dump/src/jobs.py
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from .ldap_mux import ldap_mux, LDAP_MUX_ENABLED
+from .ldap_pool import ldap_pool
+from .ldap_search import build_search, select_fields, membership_filter, search_ldap_page, format_entries
+
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'ad_jobs.db')
+# Threads per worker process; each holds one pooled LDAP connection while it runs,
+# unless LDAP_MUX_ENABLED has them share a few
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+# Queued plus running jobs per worker process before new ones are turned away
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '32'))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '3600'))
+JOB_PAGE_SIZE = int(os.getenv('JOB_PAGE_SIZE', '1000'))
+JOB_MAX_RESULTS_PAGE = 5000
+# Live jobs are touched this often; one silent for JOB_STALE_SECONDS lost its process
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_STALE_SECONDS = 60
+
+JOB_KINDS = ('search', 'group_members')
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _flag(value, default):
+    if value is None:
+        return default
+    return value if isinstance(value, bool) else str(value).lower() == 'true'
+
+
+def job_search(kind, params):
+    """(filter, attributes, formatter) for a job; ValueError if it can't run.
+
+    Parameters are the ones the matching GET route takes: ``query``,
+    ``type``, ``precise``, ``searchBy``, ``fields`` and ``match`` for
+    ``search``; ``group_id``, ``transitive`` and ``fields`` for
+    ``group_members``.
+    """
+    if kind == 'search':
+        query = build_search(params.get('query', ''), params.get('type', ''), _flag(params.get('precise'), True),
+                             params.get('searchBy', ''), params.get('fields'), params.get('match', 'auto'))
+        if query is None:
+            raise ValueError("Invalid search type")
+        plan, attributes, formatter = query
+        return plan.filter, attributes, formatter
+    if kind == 'group_members':
+        if not params.get('group_id'):
+            raise ValueError("group_id is required")
+        attributes, formatter = select_fields('group_members', params.get('fields'))
+        search_filter = membership_filter('user', 'memberOf', params['group_id'],
+                                          _flag(params.get('transitive'), False))
+        return search_filter, attributes, formatter
+    raise ValueError(f"Unknown job kind: {kind}")
+
+
+def _pooled_pages(domain, search_filter, attributes):
+    """Each page's raw entries, on a pooled connection held until the last one"""
+    ldap_conn = ldap_pool.acquire(domain)
+    cookie = None
+    try:
+        while cookie != b'':
+            rdata, cookie = search_ldap_page(ldap_conn, search_filter, attributes, domain['base_dn'],
+                                             JOB_PAGE_SIZE, cookie or b'')
+            yield rdata
+    finally:
+        # Dropping the connection also drops the server's paged result set
+        ldap_pool.release(ldap_conn, cookie != b'')
+
+
+class JobStore:
+    """Heavy queries run off the request path, with results kept in SQLite.
+
+    A job is one paged search, run on this process's small job pool. Each
+    page's entries are appended to the results table as they arrive, so
+    progress and partial results can be read from any worker process.
+    Finished jobs are dropped JOB_RESULT_TTL seconds after they end. A job
+    whose process died stops heartbeating and is reported as failed.
+    """
+
+    COLUMNS = ['id', 'kind', 'params', 'domain_id', 'status', 'pages', 'entries', 'error',
+               'created', 'started', 'finished', 'expires']
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._active = set()
+        self._janitor = None
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._init_schema(db)
+            self._local.db = db
+        return db
+
+    def _init_schema(self, db):
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            domain_id INTEGER,
+            status TEXT NOT NULL,
+            pages INTEGER DEFAULT 0,
+            entries INTEGER DEFAULT 0,
+            error TEXT,
+            created REAL,
+            started REAL,
+            finished REAL,
+            expires REAL,
+            heartbeat REAL
+        )
+        ''')
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (job_id, seq)
+        ) WITHOUT ROWID
+        ''')
+        db.commit()
+
+    # -- reading -----------------------------------------------------------
+
+    def get(self, job_id):
+        row = self._db().execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def results(self, job_id, offset=0, limit=JOB_PAGE_SIZE):
+        """Stored entries from ``offset``; available while the job is still running"""
+        rows = self._db().execute('''
+            SELECT data FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?
+        ''', (job_id, offset, limit))
+        return [json.loads(data) for data, in rows]
+
+    # -- running -----------------------------------------------------------
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+            return self._executor
+
+    def submit(self, kind, params, domain):
+        """Queue a job and return its id; raises ValueError or JobQueueFull"""
+        search_filter, attributes, formatter = job_search(kind, params)
+        job_id = secrets.token_urlsafe(16)
+        with self._lock:
+            if len(self._active) >= JOB_MAX_PENDING:
+                raise JobQueueFull(f"{JOB_MAX_PENDING} jobs already queued or running")
+            self._active.add(job_id)
+        now = time.time()
+        db = self._db()
+        db.execute('''
+            INSERT INTO jobs (id, kind, params, domain_id, status, created, heartbeat)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?)
+        ''', (job_id, kind, json.dumps(params), domain['id'], now, now))
+        db.commit()
+        self.start()
+        self._pool().submit(self._run, job_id, domain, search_filter, attributes, formatter)
+        return job_id
+
+    def _finish(self, db, job_id, status, error=None):
+        now = time.time()
+        db.execute('''
+            UPDATE jobs SET status = ?, error = ?, finished = ?, expires = ?
+            WHERE id = ? AND status NOT IN ('done', 'failed', 'cancelled')
+        ''', (status, error, now, now + JOB_RESULT_TTL, job_id))
+        db.commit()
+
+    def _cancelled(self, db, job_id):
+        row = db.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return not row or row[0] == 'cancelled'
+
+    def _run(self, job_id, domain, search_filter, attributes, formatter):
+        db = self._db()
+        try:
+            updated = db.execute('''
+                UPDATE jobs SET status = 'running', started = ?, heartbeat = ? WHERE id = ? AND status = 'queued'
+            ''', (time.time(), time.time(), job_id)).rowcount
+            db.commit()
+            if not updated:
+                return
+            if LDAP_MUX_ENABLED:
+                pages = ldap_mux.iter_pages(domain, search_filter, attributes, domain['base_dn'], JOB_PAGE_SIZE)
+            else:
+                pages = _pooled_pages(domain, search_filter, attributes)
+            entries = 0
+            with closing(pages):
+                for page, rdata in enumerate(pages, 1):
+                    if self._cancelled(db, job_id):
+                        return
+                    rows = format_entries(rdata, formatter)
+                    db.executemany('INSERT INTO job_results (job_id, seq, data) VALUES (?, ?, ?)',
+                                   [(job_id, entries + i, json.dumps(row)) for i, row in enumerate(rows)])
+                    entries += len(rows)
+                    db.execute('UPDATE jobs SET pages = ?, entries = ?, heartbeat = ? WHERE id = ?',
+                               (page, entries, time.time(), job_id))
+                    db.commit()
+            self._finish(db, job_id, 'done')
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            db.rollback()
+            self._finish(db, job_id, 'failed', str(e))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def cancel(self, job_id):
+        """Stop a job (a running one stops after its current page) and drop its results"""
+        db = self._db()
+        now = time.time()
+        updated = db.execute('''
+            UPDATE jobs SET status = 'cancelled', finished = COALESCE(finished, ?), expires = ? WHERE id = ?
+        ''', (now, now, job_id)).rowcount
+        db.execute('DELETE FROM job_results WHERE job_id = ?', (job_id,))
+        db.commit()
+        return bool(updated)
+
+    # -- housekeeping ------------------------------------------------------
+
+    def sweep(self):
+        db = self._db()
+        now = time.time()
+        with self._lock:
+            active = list(self._active)
+        db.executemany('UPDATE jobs SET heartbeat = ? WHERE id = ?', [(now, job_id) for job_id in active])
+        db.execute('''
+            UPDATE jobs SET status = 'failed', error = 'The worker running this job stopped',
+                finished = ?, expires = ?
+            WHERE status IN ('queued', 'running') AND heartbeat < ?
+        ''', (now, now + JOB_RESULT_TTL, now - JOB_STALE_SECONDS))
+        expired = [job_id for job_id, in db.execute('SELECT id FROM jobs WHERE expires < ?', (now,))]
+        for job_id in expired:
+            db.execute('DELETE FROM job_results WHERE job_id = ?', (job_id,))
+            db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        db.commit()
+
+    def _run_janitor(self):
+        while True:
+            try:
+                self.sweep()
+            except sqlite3.Error as e:
+                print(f"Job cleanup failed: {e}")
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+
+    def start(self):
+        with self._lock:
+            if self._janitor:
+                return
+            self._janitor = threading.Thread(target=self._run_janitor, name='job-janitor', daemon=True)
+        self._janitor.start()
+
+    def _after_fork(self):
+        # Job threads and SQLite handles stay behind in the parent
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._active = set()
+        self._janitor = None
+
+
+job_store = JobStore()
+os.register_at_fork(after_in_child=job_store._after_fork)
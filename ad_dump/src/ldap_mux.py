@@ -0,0 +1,387 @@
+# ad_dump/src/ldap_mux.py
+import os
+import selectors
+import threading
+import time
+from concurrent.futures import Future
+
+import ldap
+
+from .ldap_pool import ldap_pool, PoolExhausted, POOL_ACQUIRE_TIMEOUT, OPERATION_TIMEOUT
+from .metrics import count_page, note_filter
+
+LDAP_MUX_ENABLED = os.getenv('LDAP_MUX_ENABLED', 'false').lower() == 'true'
+# Pooled connections per domain that searches share
+LDAP_MUX_CONNECTIONS = int(os.getenv('LDAP_MUX_CONNECTIONS', '2'))
+# Searches in progress at once on one shared connection
+LDAP_MUX_MAX_OUTSTANDING = int(os.getenv('LDAP_MUX_MAX_OUTSTANDING', '64'))
+# Longest the poller sleeps without a deadline to check
+POLL_INTERVAL = 1.0
+
+
+def _paging_cookie(serverctrls):
+    pctrls = [c for c in serverctrls or []
+              if c.controlType == ldap.controls.SimplePagedResultsControl.controlType]
+    return pctrls[0].cookie if pctrls else b''
+
+
+class _Request:
+    __slots__ = ('callback', 'deadline', 'operation_timeout')
+
+    def __init__(self, callback, deadline, operation_timeout=False):
+        self.callback = callback
+        self.deadline = deadline
+        # Whether the deadline is LDAP_OPERATION_TIMEOUT rather than the caller's
+        self.operation_timeout = operation_timeout
+
+
+class SharedConnection:
+    """A pooled connection with many searches in flight, keyed by message id"""
+
+    def __init__(self, domain_id, conn):
+        self.domain_id = domain_id
+        self.conn = conn
+        self.fd = conn.get_option(ldap.OPT_DESC)
+        self.leases = 0
+        self.pending = {}
+        self.broken = False
+        # Held across search_ext + registering the message id, and across
+        # result3 + looking it up, so a result never arrives for an id
+        # that isn't registered yet
+        self.lock = threading.Lock()
+
+
+class LDAPMultiplexer:
+    """Many concurrent searches over a few shared connections per domain.
+
+    A search sends its request and registers a callback under the message
+    id; it does not wait on the socket. One poller thread per process
+    selects over every shared connection and collects whatever results
+    are complete with ``result3(RES_ANY, timeout=0)``. A paged search asks
+    for its next page as soon as one arrives, so the directory works on
+    page N+1 while the caller formats page N.
+
+    Connections are leased from the pool while any search uses them and
+    go back when the last one finishes, so DC failover, rebalancing and
+    credential changes work as they do for the pool.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = {}  # domain id -> [SharedConnection]
+        self._opening = {}
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self._changes = []
+        self._thread = None
+
+    # -- connections -------------------------------------------------------
+
+    def _lease(self, domain, timeout=POOL_ACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                shared = self._shared.setdefault(domain['id'], [])
+                usable = [s for s in shared if not s.broken and s.leases < LDAP_MUX_MAX_OUTSTANDING]
+                if usable:
+                    chosen = min(usable, key=lambda s: s.leases)
+                    chosen.leases += 1
+                    return chosen
+                if len(shared) + self._opening.get(domain['id'], 0) < LDAP_MUX_CONNECTIONS:
+                    self._opening[domain['id']] = self._opening.get(domain['id'], 0) + 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"No shared LDAP connection free for domain {domain['id']}")
+                self._cond.wait(remaining)
+
+        try:
+            conn = ldap_pool.acquire(domain, max(0, deadline - time.monotonic()))
+            try:
+                chosen = SharedConnection(domain['id'], conn)
+            except Exception:
+                ldap_pool.release(conn, True)
+                raise
+        finally:
+            with self._cond:
+                self._opening[domain['id']] -= 1
+                self._cond.notify_all()
+        chosen.leases = 1
+        with self._cond:
+            self._shared[domain['id']].append(chosen)
+        self._start()
+        self._change(('register', chosen))
+        return chosen
+
+    def _unlease(self, shared):
+        with self._cond:
+            shared.leases -= 1
+            done = shared.leases == 0
+            if done:
+                peers = self._shared.get(shared.domain_id, [])
+                if shared in peers:
+                    peers.remove(shared)
+            self._cond.notify_all()
+        if done:
+            self._change(('unregister', shared))
+
+    def _break(self, shared, error):
+        """Fail every search on a connection that stopped working"""
+        with shared.lock:
+            shared.broken = True
+            pending, shared.pending = shared.pending, {}
+        print(f"Shared LDAP connection for domain {shared.domain_id} failed: {error}")
+        ldap_pool.record_error(shared.conn, error)
+        for request in pending.values():
+            request.callback(error, None, None)
+
+    # -- poller ------------------------------------------------------------
+
+    def _start(self):
+        with self._cond:
+            if self._thread:
+                return
+            self._selector = selectors.DefaultSelector()
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+            self._thread = threading.Thread(target=self._run, name='ldap-mux', daemon=True)
+        self._thread.start()
+
+    def _change(self, change):
+        with self._cond:
+            self._changes.append(change)
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'x')
+        except (OSError, TypeError):
+            pass
+
+    def _apply_changes(self):
+        with self._cond:
+            changes, self._changes = self._changes, []
+        for action, shared in changes:
+            if action == 'register':
+                self._selector.register(shared.fd, selectors.EVENT_READ, shared)
+                continue
+            try:
+                self._selector.unregister(shared.fd)
+            except (KeyError, ValueError):
+                pass
+            ldap_pool.release(shared.conn, shared.broken)
+
+    def _drain(self, shared):
+        while True:
+            failed = None
+            with shared.lock:
+                if not shared.pending:
+                    return
+                try:
+                    rtype, rdata, msgid, serverctrls = shared.conn.result3(ldap.RES_ANY, 1, 0)
+                except ldap.LDAPError as e:
+                    # python-ldap names the message an error result belongs to
+                    info = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+                    request = shared.pending.pop(info.get('msgid'), None)
+                    failed = e
+                    rdata = serverctrls = None
+                else:
+                    if rtype is None:
+                        return
+                    request = shared.pending.pop(msgid, None)
+            if request is None and failed is not None:
+                # Not tied to one search: the connection itself is gone
+                self._break(shared, failed)
+                return
+            if request is not None:
+                request.callback(failed, rdata, serverctrls)
+
+    def _expire(self, now):
+        nearest = None
+        with self._cond:
+            shared_all = [s for peers in self._shared.values() for s in peers]
+        for shared in shared_all:
+            expired = []
+            with shared.lock:
+                for msgid, request in list(shared.pending.items()):
+                    if request.deadline <= now:
+                        expired.append(shared.pending.pop(msgid))
+                        try:
+                            # Don't leave the DC working on a search nobody will read
+                            shared.conn.abandon(msgid)
+                        except ldap.LDAPError:
+                            pass
+                    elif nearest is None or request.deadline < nearest:
+                        nearest = request.deadline
+            for request in expired:
+                error = ldap.TIMEOUT({'desc': 'Search deadline exceeded'})
+                if request.operation_timeout:
+                    ldap_pool.record_error(shared.conn, error)
+                request.callback(error, None, None)
+        return nearest
+
+    def _run(self):
+        while True:
+            nearest = self._expire(time.monotonic())
+            timeout = POLL_INTERVAL if nearest is None else min(POLL_INTERVAL, max(0, nearest - time.monotonic()))
+            try:
+                events = self._selector.select(timeout)
+            except OSError as e:
+                # A descriptor closed under us; the change queue will unregister it
+                print(f"LDAP poller select failed: {e}")
+                events = []
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+            self._apply_changes()
+            for key, _ in events:
+                if key.data is not None:
+                    try:
+                        self._drain(key.data)
+                    except Exception as e:
+                        self._break(key.data, e)
+
+    # -- searches ----------------------------------------------------------
+
+    def _send(self, shared, search_filter, attributes, base_dn, page_size, cookie, deadline, callback):
+        """Ask for one page; ``callback(error, entries, serverctrls)`` runs on the poller.
+
+        Results are polled with a zero timeout, so LDAP_OPERATION_TIMEOUT is
+        applied here: each page fails with TIMEOUT once it has waited that
+        long, or at ``deadline`` if that comes first.
+        """
+        limit = time.monotonic() + OPERATION_TIMEOUT
+        deadline = limit if deadline is None or deadline >= limit else deadline
+        lc = ldap.controls.SimplePagedResultsControl(True, size=page_size, cookie=cookie)
+        with shared.lock:
+            if shared.broken:
+                raise ldap.SERVER_DOWN({'desc': 'Shared connection failed'})
+            msgid = shared.conn.search_ext(base_dn, ldap.SCOPE_SUBTREE, search_filter, attributes,
+                                           serverctrls=[lc])
+            shared.pending[msgid] = _Request(callback, deadline, deadline == limit)
+        if deadline - time.monotonic() < POLL_INTERVAL:
+            # The poller may be asleep past this deadline
+            self._wake()
+        return msgid
+
+    def _cancel(self, shared, msgid):
+        with shared.lock:
+            if shared.pending.pop(msgid, None) is not None:
+                try:
+                    shared.conn.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+
+    def _drop_paging(self, shared, search_filter, base_dn, cookie):
+        # A zero-size page request tells the server to drop the result set.
+        # It holds its own lease so the connection isn't handed back to the
+        # pool with the reply still outstanding.
+        with self._cond:
+            shared.leases += 1
+        try:
+            self._send(shared, search_filter, ['1.1'], base_dn, 0, cookie, None,
+                       lambda *result: self._unlease(shared))
+        except ldap.LDAPError:
+            self._unlease(shared)
+
+    def search(self, domain, search_filter, attributes, base_dn=None, page_size=1000, max_results=0,
+               deadline=None):
+        """Future of (entries, truncated) for a whole paged search.
+
+        Each page is requested from the poller the moment the previous
+        one arrives, so no thread waits between pages. The future fails
+        with TIMEOUT at ``deadline``, or once any one page has waited
+        LDAP_OPERATION_TIMEOUT, so it always settles.
+        """
+        base_dn = base_dn or domain['base_dn']
+        shared = self._lease(domain, POOL_ACQUIRE_TIMEOUT if deadline is None
+                             else max(0, deadline - time.monotonic()))
+        future = Future()
+        entries = []
+        note_filter(search_filter)
+
+        def finish(error=None, truncated=False, cookie=b''):
+            if cookie:
+                self._drop_paging(shared, search_filter, base_dn, cookie)
+            self._unlease(shared)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result((entries, truncated))
+
+        def on_page(error, rdata, serverctrls):
+            if error is not None:
+                return finish(error)
+            count_page(domain['id'], rdata)
+            cookie = _paging_cookie(serverctrls)
+            entries.extend(rdata)
+            if max_results and (len(entries) > max_results or len(entries) == max_results and cookie):
+                del entries[max_results:]
+                return finish(truncated=True, cookie=cookie)
+            if not cookie:
+                return finish()
+            try:
+                self._send(shared, search_filter, attributes, base_dn, page_size, cookie, deadline, on_page)
+            except ldap.LDAPError as e:
+                finish(e)
+
+        try:
+            self._send(shared, search_filter, attributes, base_dn, page_size, b'', deadline, on_page)
+        except Exception:
+            self._unlease(shared)
+            raise
+        return future
+
+    def iter_pages(self, domain, search_filter, attributes, base_dn=None, page_size=1000, deadline=None):
+        """Yield each page's raw entries, with the next page already requested.
+
+        Closing the generator early abandons the page in flight and drops
+        the server's paged result set.
+        """
+        base_dn = base_dn or domain['base_dn']
+        shared = self._lease(domain)
+        note_filter(search_filter)
+
+        def request(cookie):
+            future = Future()
+
+            def on_page(error, rdata, serverctrls):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result((rdata, _paging_cookie(serverctrls)))
+            future.msgid = self._send(shared, search_filter, attributes, base_dn, page_size, cookie, deadline,
+                                      on_page)
+            return future
+
+        in_flight = None
+        cookie = b''
+        try:
+            in_flight = request(b'')
+            while in_flight is not None:
+                rdata, cookie = in_flight.result()
+                in_flight = None
+                count_page(domain['id'], rdata)
+                if cookie:
+                    in_flight = request(cookie)
+                yield rdata
+            cookie = b''
+        finally:
+            if in_flight is not None and not in_flight.done():
+                self._cancel(shared, in_flight.msgid)
+            if cookie:
+                self._drop_paging(shared, search_filter, base_dn, cookie)
+            self._unlease(shared)
+
+    def _after_fork(self):
+        # The poller and the shared connections stay behind in the parent
+        self.__init__()
+
+
+ldap_mux = LDAPMultiplexer()
+os.register_at_fork(after_in_child=ldap_mux._after_fork)
@@ -0,0 +1,312 @@
+# ad_dump/src/ldap_pool.py
+import os
+import threading
+import time
+from collections import deque
+
+import ldap
+from ldap.ldapobject import ReconnectLDAPObject
+
+from .database import decrypt_password
+from .dc_health import ServerSelector
+from .metrics import timed
+
+POOL_SIZE = int(os.getenv('LDAP_POOL_SIZE', '8'))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv('LDAP_POOL_ACQUIRE_TIMEOUT', '10'))
+POOL_IDLE_TIMEOUT = float(os.getenv('LDAP_POOL_IDLE_TIMEOUT', '300'))
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('LDAP_POOL_HEALTH_CHECK_INTERVAL', '30'))
+RECONNECT_RETRIES = int(os.getenv('LDAP_RECONNECT_RETRIES', '2'))
+RECONNECT_DELAY = float(os.getenv('LDAP_RECONNECT_DELAY', '0.5'))
+# Without these a DC that stops answering holds a request (and a pool slot) indefinitely
+NETWORK_TIMEOUT = float(os.getenv('LDAP_NETWORK_TIMEOUT', '5'))
+OPERATION_TIMEOUT = float(os.getenv('LDAP_OPERATION_TIMEOUT', '30'))
+# Connections to a slower DC are retired after this long, so traffic fails back to the fastest one
+DC_REBALANCE_INTERVAL = float(os.getenv('DC_REBALANCE_INTERVAL', '120'))
+# Errors that say the DC or the network to it failed, as opposed to the request
+DC_ERRORS = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ServersUnavailable(Exception):
+    pass
+
+
+def _fingerprint(domain):
+    # A Fernet token changes every time the password is re-saved, so the
+    # encrypted value also catches a password edit.
+    return (domain['server'], domain['username'], domain['password'])
+
+
+class DomainPool:
+    """Bounded set of bound connections for a single domain.
+
+    Idle connections are reused newest-first so a quiet pool naturally lets
+    its oldest connections age past the idle timeout and get evicted. The
+    password is kept encrypted and only decrypted to bind a new connection.
+    New connections go to the best server the selector knows of, falling
+    through to the next one when a bind fails.
+    """
+
+    def __init__(self, domain, max_size=POOL_SIZE):
+        self.domain_id = domain['id']
+        self.server = domain['server']
+        self.selector = ServerSelector(domain['server'])
+        self.username = domain['username']
+        self._encrypted_password = domain['password']
+        self.fingerprint = _fingerprint(domain)
+        self.closed = False
+        self._idle = deque()  # (conn, last_used) pairs, oldest on the left
+        self._origins = {}  # conn -> (server uri, opened at)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _open(self, uri):
+        conn = ReconnectLDAPObject(uri, retry_max=RECONNECT_RETRIES, retry_delay=RECONNECT_DELAY)
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, NETWORK_TIMEOUT)
+        conn.set_option(ldap.OPT_TIMEOUT, OPERATION_TIMEOUT)
+        with timed('decrypt', self.domain_id):
+            password = decrypt_password(self._encrypted_password)
+        started = time.monotonic()
+        with timed('bind', self.domain_id):
+            conn.simple_bind_s(self.username, password)
+        return conn, time.monotonic() - started
+
+    def _connect(self):
+        servers = self.selector.ranked()
+        if not servers:
+            raise ServersUnavailable(f"No domain controller available for domain {self.domain_id}")
+        for uri in servers:
+            try:
+                conn, elapsed = self._open(uri)
+            except ldap.INVALID_CREDENTIALS:
+                # Every DC would say the same; don't count it against this one
+                raise
+            except ldap.LDAPError as e:
+                self.selector.record_failure(uri, e)
+                print(f"Could not bind to {uri} for domain {self.domain_id}: {e}")
+                continue
+            self.selector.record_success(uri, elapsed)
+            self.set_origin(conn, uri)
+            return conn
+        raise ServersUnavailable(f"All domain controllers failed for domain {self.domain_id}")
+
+    def _probe(self, uri):
+        conn = None
+        try:
+            conn, _ = self._open(uri)
+            started = time.monotonic()
+            conn.whoami_s()
+            self.selector.record_success(uri, time.monotonic() - started)
+        except ldap.LDAPError as e:
+            self.selector.record_failure(uri, e)
+        finally:
+            # Also after an error that isn't the DC's (e.g. a password that won't decrypt);
+            # a server left marked as probing is never probed again
+            self.selector.end_probe(uri)
+            if conn is not None:
+                self._discard(conn)
+
+    def _start_probes(self):
+        # Off the request path: a dead DC costs a probe its network timeout, not a user
+        for uri in self.selector.due_probes():
+            threading.Thread(target=self._probe, args=(uri,), name='dc-probe', daemon=True).start()
+
+    def set_origin(self, conn, uri):
+        with self._lock:
+            self._origins[conn] = (uri, time.monotonic())
+
+    def origin(self, conn):
+        with self._lock:
+            origin = self._origins.get(conn)
+        return origin[0] if origin else None
+
+    def _should_retire(self, conn):
+        with self._lock:
+            origin = self._origins.get(conn)
+        if origin is None:
+            return False
+        uri, opened = origin
+        if not self.selector.is_healthy(uri):
+            return True
+        return time.monotonic() - opened > DC_REBALANCE_INTERVAL and self.selector.best() != uri
+
+    def _is_healthy(self, conn):
+        try:
+            conn.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._origins.pop(conn, None)
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - POOL_IDLE_TIMEOUT
+        expired = []
+        with self._lock:
+            while self._idle and self._idle[0][1] < cutoff:
+                expired.append(self._idle.popleft()[0])
+        for conn in expired:
+            self._discard(conn)
+
+    def acquire(self, timeout=POOL_ACQUIRE_TIMEOUT):
+        with timed('pool_wait', self.domain_id):
+            acquired = self._slots.acquire(timeout=timeout)
+        if not acquired:
+            raise PoolExhausted(f"No free LDAP connection for domain {self.domain_id}")
+        try:
+            self._evict_idle()
+            self._start_probes()
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._connect()
+
+                conn, last_used = item
+                if self._should_retire(conn):
+                    self._discard(conn)
+                    continue
+                if time.monotonic() - last_used > POOL_HEALTH_CHECK_INTERVAL and not self._is_healthy(conn):
+                    uri = self.origin(conn)
+                    if uri:
+                        self.selector.record_failure(uri, 'health check failed')
+                    self._discard(conn)
+                    continue
+                return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        """Return ``conn`` for reuse, or close it when ``broken``.
+
+        Closing it says nothing about its server: a bad filter or an
+        abandoned paged search is no fault of the DC. Server failures are
+        counted where they are seen, through LDAPConnectionPool.record_error.
+        """
+        try:
+            if broken:
+                self._discard(conn)
+            elif self.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self.closed = True
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+class LDAPConnectionPool:
+    """Per-domain pools keyed by domain id.
+
+    A pool is rebuilt whenever the fingerprint of the domain's settings
+    changes, so edited credentials take effect on the next checkout and
+    connections bound with the old ones are dropped as they come back.
+    """
+
+    def __init__(self):
+        self._pools = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, domain, timeout=POOL_ACQUIRE_TIMEOUT):
+        with self._lock:
+            pool = self._pools.get(domain['id'])
+            if pool is None or pool.fingerprint != _fingerprint(domain):
+                if pool is not None:
+                    pool.close()
+                pool = DomainPool(domain)
+                self._pools[domain['id']] = pool
+
+        conn = pool.acquire(timeout)
+        with self._lock:
+            self._owners[conn] = pool
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            pool = self._owners.pop(conn, None)
+        if pool is None:
+            return False
+        pool.release(conn, broken)
+        return True
+
+    def record_error(self, conn, error):
+        """Count ``error`` against the server ``conn`` is bound to, if it is the server's"""
+        if not isinstance(error, DC_ERRORS):
+            return
+        with self._lock:
+            pool = self._owners.get(conn)
+        uri = pool.origin(conn) if pool else None
+        if uri:
+            pool.selector.record_failure(uri, error)
+
+    def domain_of(self, conn):
+        with self._lock:
+            pool = self._owners.get(conn)
+        return pool.domain_id if pool else None
+
+    def reconnect(self, conn):
+        """Re-open and rebind a pooled connection after SERVER_DOWN."""
+        with self._lock:
+            pool = self._owners.get(conn)
+        if pool is None:
+            return False
+        uri = pool.origin(conn)
+        if uri:
+            pool.selector.record_failure(uri, 'server down')
+        # Move to the best server still standing rather than the one that just dropped us
+        for target in pool.selector.ranked() or ([uri] if uri else []):
+            try:
+                conn.reconnect(target, retry_max=RECONNECT_RETRIES, retry_delay=RECONNECT_DELAY, force=True)
+            except ldap.LDAPError as e:
+                pool.selector.record_failure(target, e)
+                print(f"LDAP reconnect to {target} failed for domain {pool.domain_id}: {e}")
+                continue
+            pool.set_origin(conn, target)
+            return True
+        return False
+
+    def server_status(self, domain_id):
+        """Health of each domain controller of a domain with an open pool"""
+        with self._lock:
+            pool = self._pools.get(domain_id)
+        return pool.selector.status() if pool else []
+
+    def _after_fork(self):
+        # Connections opened before a fork share their socket with the
+        # parent; drop them without unbinding the parent's session.
+        self._pools = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, domain_id=None):
+        with self._lock:
+            if domain_id is None:
+                pools, self._pools = list(self._pools.values()), {}
+            else:
+                pool = self._pools.pop(domain_id, None)
+                pools = [pool] if pool else []
+        for pool in pools:
+            pool.close()
+
+
+ldap_pool = LDAPConnectionPool()
+os.register_at_fork(after_in_child=ldap_pool._after_fork)
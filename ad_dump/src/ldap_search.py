@@ -0,0 +1,510 @@
+# ad_dump/src/ldap_search.py
+import os
+import re
+import time
+
+import ldap
+
+from .ldap_mux import ldap_mux, LDAP_MUX_ENABLED
+from .ldap_pool import ldap_pool
+from .metrics import timed, count_page, note_filter, COALESCED_SEARCHES
+from .singleflight import search_flights, SINGLEFLIGHT_TIMEOUT
+
+# Hard cap on entries collected for a single non-paged, non-streamed response (0 = no cap)
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '0'))
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+def _single(values):
+    return _decode(values[0]) if values and values[0] else None
+
+def _multi(values):
+    return [_decode(v) for v in values] if values else []
+
+def _enabled(values):
+    # ACCOUNTDISABLE is bit 0x2 of userAccountControl
+    return not int(values[0]) & 2 if values else None
+
+def _group_type(values):
+    group_type = values[0] if values else b'0'
+    if not group_type:
+        return 'unknown'
+    return 'security' if int(group_type) == -2147483643 else 'distribution'
+
+
+class EntrySchema:
+    """Maps output fields to the LDAP attribute they come from and its decoder.
+
+    The same table drives the attribute list sent to the DC and the
+    formatting of each entry, so a sparse ``fields`` selection trims both.
+    ``id`` (the DN) and ``name`` are always returned; entries without a
+    name are skipped.
+    """
+
+    def __init__(self, kind, fields, ranged=()):
+        self.kind = kind
+        self.fields = fields
+        # Multi-valued attributes AD may return as ``attr;range=0-1499``
+        self.ranged = set(ranged)
+        self._lookup = {}
+        for field in fields:
+            self._lookup[field[0].lower()] = field
+            self._lookup[field[1].lower()] = field
+        self.attributes = [attribute for _, attribute, _ in fields]
+        self.format = self.formatter()
+
+    def select(self, requested=None):
+        """Resolve a comma-separated ``fields`` value (output keys or LDAP names).
+
+        Returns the selected (key, attribute, decoder) tuples, or raises
+        ValueError naming the first unknown field.
+        """
+        if not requested:
+            return self.fields
+        wanted = {'name'}
+        for part in requested.split(','):
+            part = part.strip().lower()
+            if not part or part in ('id', 'dn'):
+                continue
+            if part not in self._lookup:
+                raise ValueError(f"Unknown field: {part}")
+            wanted.add(self._lookup[part][0])
+        return [field for field in self.fields if field[0] in wanted]
+
+    def formatter(self, fields=None):
+        fields = self.fields if fields is None else fields
+        kind = self.kind
+        ranged = self.ranged
+
+        def format_entry(entry):
+            dn, attrs = entry
+            if isinstance(attrs, list):
+                attrs = {attr[0]: attr[1] for attr in attrs if len(attr) >= 2}
+            if not _single(attrs.get('name')):
+                return None
+            formatted = {"id": dn}
+            try:
+                for key, attribute, decode in fields:
+                    values = attrs.get(attribute)
+                    if values is None and attribute in ranged:
+                        values = ranged_values(attrs, attribute)[0]
+                    formatted[key] = decode(values)
+            except (ValueError, UnicodeDecodeError) as e:
+                print(f"Error formatting {kind}: {e}")
+                return None
+            return formatted
+        return format_entry
+
+    def project(self, formatted, fields):
+        """Trim an already formatted entry (e.g. from the mirror) to ``fields``"""
+        return dict({"id": formatted["id"]}, **{key: formatted.get(key) for key, _, _ in fields})
+
+
+USER_SCHEMA = EntrySchema('user', [
+    ("name", 'name', _single),
+    ("email", 'mail', _single),
+    ("department", 'department', _single),
+    ("title", 'title', _single),
+    ("phone", 'telephoneNumber', _single),
+    ("manager", 'manager', _single),
+    ("street", 'streetAddress', _single),
+    ("city", 'l', _single),
+    ("state", 'st', _single),
+    ("postalCode", 'postalCode', _single),
+    ("country", 'co', _single),
+    ("memberOf", 'memberOf', _multi),
+    ("created", 'whenCreated', _single),
+    ("lastModified", 'whenChanged', _single),
+    ("samAccountName", 'sAMAccountName', _single),
+    ("userPrincipalName", 'userPrincipalName', _single),
+    ("enabled", 'userAccountControl', _enabled),
+    ("lastLogon", 'lastLogon', _single),
+    ("pwdLastSet", 'pwdLastSet', _single),
+    ("company", 'company', _single),
+    ("employeeID", 'employeeID', _single),
+    ("employeeType", 'employeeType', _single),
+])
+
+GROUP_SCHEMA = EntrySchema('group', [
+    ("name", 'name', _single),
+    ("description", 'description', _single),
+    ("type", 'groupType', _group_type),
+    ("members", 'member', _multi),
+    ("owner", 'managedBy', _single),
+    ("created", 'whenCreated', _single),
+    ("lastModified", 'whenChanged', _single),
+], ranged=('member',))
+
+SCHEMAS = {
+    'users': USER_SCHEMA,
+    'groups': GROUP_SCHEMA,
+    'group_members': USER_SCHEMA,
+}
+
+USER_ATTRIBUTES = USER_SCHEMA.attributes
+GROUP_ATTRIBUTES = GROUP_SCHEMA.attributes
+format_user = USER_SCHEMA.format
+format_group = GROUP_SCHEMA.format
+
+def ranged_values(attrs, attribute):
+    """Values of ``attribute`` and where its next range starts (None once complete)
+
+    Past MaxValRange (1500 by default) AD leaves out the plain attribute
+    and returns ``attribute;range=<first>-<last>`` instead, with ``*`` as
+    the last bound on the final chunk.
+    """
+    values = attrs.get(attribute)
+    if values is not None:
+        return values, None
+    prefix = attribute.lower() + ';range='
+    for key in attrs:
+        if key.lower().startswith(prefix):
+            end = key.rsplit('-', 1)[1]
+            return attrs[key], (None if end == '*' else int(end) + 1)
+    return [], None
+
+def _result(ldap_conn, msgid, timeout):
+    try:
+        return ldap_conn.result3(msgid, timeout=timeout)
+    except ldap.TIMEOUT as e:
+        # Don't leave the DC working on a search nobody will read
+        ldap_conn.abandon(msgid)
+        if timeout < 0:
+            # It sat on the search for all of LDAP_OPERATION_TIMEOUT, not just past a caller's deadline
+            ldap_pool.record_error(ldap_conn, e)
+        raise
+
+def search_ldap_page(ldap_conn, search_filter, attributes, base_dn=None, page_size=1000, cookie=b'',
+                     extra_controls=None, timeout=-1):
+    """Fetch one page of entries plus the cookie for the next (empty when done)"""
+    lc = ldap.controls.SimplePagedResultsControl(True, size=page_size, cookie=cookie)
+    request_ctrls = [lc] + list(extra_controls or [])
+    domain_id = ldap_pool.domain_of(ldap_conn)
+    if not cookie:
+        note_filter(search_filter)
+    try:
+        with timed('ldap_page', domain_id):
+            msgid = ldap_conn.search_ext(base_dn, ldap.SCOPE_SUBTREE, search_filter, attributes,
+                                         serverctrls=request_ctrls)
+            rtype, rdata, rmsgid, serverctrls = _result(ldap_conn, msgid, timeout)
+    except ldap.SERVER_DOWN as e:
+        # Pooled connections can go stale when a DC restarts or an idle
+        # TCP session is dropped; rebind once, but only on the first page
+        # since a paging cookie does not survive a reconnect.
+        if cookie:
+            ldap_pool.record_error(ldap_conn, e)
+            raise
+        if not ldap_pool.reconnect(ldap_conn):
+            raise
+        msgid = ldap_conn.search_ext(base_dn, ldap.SCOPE_SUBTREE, search_filter, attributes, serverctrls=request_ctrls)
+        rtype, rdata, rmsgid, serverctrls = _result(ldap_conn, msgid, timeout)
+    count_page(domain_id, rdata)
+    
+    # Get cookie from page control
+    pctrls = [c for c in serverctrls if c.controlType == ldap.controls.SimplePagedResultsControl.controlType]
+    return rdata, (pctrls[0].cookie if pctrls else b'')
+
+def replay_search(ldap_conn, search_filter, attributes, base_dn, offset, last_dn=None, page_size=1000):
+    """Open a paged search again up to where an earlier one stopped.
+
+    Paging cookies only work on the connection that got them, so another
+    connection has to read the first ``offset`` entries again. The last of
+    them was ``last_dn``; entries added or deleted ahead of it since then
+    move it, so reading goes on until it turns up. Returns (entries read
+    past it, cookie for the rest or None when there is no rest, entries
+    read in all). Raises LookupError if ``last_dn`` has gone.
+    """
+    target = last_dn.lower() if last_dn else None
+    found = target is None
+    carry = []
+    read = 0
+    cookie = b''
+    while True:
+        size = offset - read if read < offset else page_size
+        rdata, cookie = search_ldap_page(ldap_conn, search_filter, attributes, base_dn, min(size, page_size),
+                                         cookie)
+        for entry in rdata:
+            if entry[0] is None:
+                continue
+            read += 1
+            if entry[0].lower() == target:
+                found = True
+                carry = []
+            elif found and target is not None:
+                carry.append(entry)
+        if found and read >= offset:
+            return carry, cookie or None, read
+        if not cookie:
+            if found:
+                return carry, None, read
+            raise LookupError(f"{last_dn} is no longer in the results")
+
+def fetch_range(ldap_conn, dn, attribute, start, limit=None, timeout=-1):
+    """Read one range of a multi-valued attribute; returns (values, next_start)
+
+    Without ``limit`` the DC picks the chunk size (MaxValRange).
+    """
+    end = start + limit - 1 if limit else '*'
+    domain_id = ldap_pool.domain_of(ldap_conn)
+    with timed('ldap_range', domain_id):
+        msgid = ldap_conn.search_ext(dn, ldap.SCOPE_BASE, '(objectClass=*)', [f"{attribute};range={start}-{end}"])
+        rtype, rdata, rmsgid, serverctrls = _result(ldap_conn, msgid, timeout)
+    count_page(domain_id, rdata)
+    if not rdata or rdata[0][0] is None:
+        return [], None
+    return ranged_values(rdata[0][1], attribute)
+
+def iter_ranged(ldap_conn, dn, attribute, values=(), next_start=0):
+    """Yield every value of ``attribute``, fetching further ranges as needed"""
+    yield from values
+    while next_start is not None:
+        values, next_start = fetch_range(ldap_conn, dn, attribute, next_start)
+        yield from values
+
+def iter_search_ldap(ldap_conn, search_filter, attributes, base_dn=None, page_size=1000, extra_controls=None,
+                     deadline=None):
+    """Yield raw entries page by page instead of collecting every page first
+
+    ``deadline`` is a time.monotonic() value; a page still outstanding when
+    it passes raises ldap.TIMEOUT.
+    """
+    cookie = b''
+    while True:
+        timeout = -1
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise ldap.TIMEOUT({'desc': 'Search deadline exceeded'})
+        rdata, cookie = search_ldap_page(ldap_conn, search_filter, attributes, base_dn, page_size, cookie,
+                                         extra_controls, timeout)
+        yield from rdata
+        if not cookie:
+            return
+
+def search_ldap(ldap_conn, search_filter, attributes, base_dn=None, page_size=1000, max_results=None,
+                deadline=None):
+    """Modified to handle pagination"""
+    try:
+        if not ldap_conn:
+            return {
+                "status": "error",
+                "results": None,
+                "error": "No LDAP connection",
+                "truncated": False
+            }
+            
+        if max_results is None:
+            max_results = SEARCH_MAX_RESULTS
+        
+        all_results = []
+        truncated = False
+        for entry in iter_search_ldap(ldap_conn, search_filter, attributes, base_dn, page_size, deadline=deadline):
+            if max_results and len(all_results) >= max_results:
+                truncated = True
+                break
+            all_results.append(entry)
+        
+        return {
+            "status": "success",
+            "results": all_results,
+            "total_count": len(all_results),
+            "truncated": truncated
+        }
+        
+    except ldap.LDAPError as e:
+        print(f"LDAP Search Error: {e}")
+        return {
+            "status": "error",
+            "results": None,
+            "error": str(e),
+            "truncated": False
+        }
+
+class _SearchFailed(Exception):
+    def __init__(self, result):
+        super().__init__(result["error"])
+        self.result = result
+
+def search_domain(domain, search_filter, attributes, max_results=None, deadline=None):
+    """search_ldap on a pooled connection, shared with identical concurrent searches
+
+    Callers asking for the same domain, base DN, filter and attributes
+    while one such search is running wait for its results rather than
+    sending their own, so a page opened by many people at once costs the
+    DC one query. Errors are not shared: each caller gets its own error
+    dict, and exceptions from ldap_pool.acquire go to the caller that
+    acquired.
+    """
+    key = (domain['id'], domain['base_dn'].lower(), search_filter, tuple(attributes), max_results)
+
+    def run():
+        if LDAP_MUX_ENABLED:
+            return run_shared()
+        timeout = {} if deadline is None else {"timeout": max(0, deadline - time.monotonic())}
+        ldap_conn = ldap_pool.acquire(domain, **timeout)
+        broken = True
+        try:
+            result = search_ldap(ldap_conn, search_filter, attributes, domain['base_dn'], max_results=max_results,
+                                 deadline=deadline)
+            broken = result["status"] == "error"
+        finally:
+            ldap_pool.release(ldap_conn, broken)
+        if broken:
+            raise _SearchFailed(result)
+        return result
+
+    def run_shared():
+        # The request thread only waits; the search runs on the poller
+        try:
+            with timed('ldap_mux', domain['id']):
+                entries, truncated = ldap_mux.search(
+                    domain, search_filter, attributes, domain['base_dn'],
+                    max_results=SEARCH_MAX_RESULTS if max_results is None else max_results,
+                    deadline=deadline).result()
+        except ldap.LDAPError as e:
+            print(f"LDAP Search Error: {e}")
+            raise _SearchFailed({"status": "error", "results": None, "error": str(e), "truncated": False})
+        return {"status": "success", "results": entries, "total_count": len(entries), "truncated": truncated}
+
+    wait = SINGLEFLIGHT_TIMEOUT if deadline is None else min(SINGLEFLIGHT_TIMEOUT, deadline - time.monotonic())
+    try:
+        result, shared = search_flights.do(key, run, wait)
+    except _SearchFailed as e:
+        return e.result
+    if shared:
+        COALESCED_SEARCHES.labels(str(domain['id'])).inc()
+        # Every caller gets its own list; the raw entries are only read
+        result = dict(result, results=list(result["results"]))
+    return result
+
+def escape_ldap_filter(search_query):
+    """Escape the characters RFC 4515 reserves in filter values"""
+    special_chars = {
+        '\\': r'\5c',
+        '*': r'\2a',
+        '(': r'\28',
+        ')': r'\29',
+        '\0': r'\00',
+    }
+    return ''.join(special_chars.get(char, char) for char in search_query)
+
+# LDAP_MATCHING_RULE_IN_CHAIN: the DC follows nested group membership
+# itself, so any depth resolves in a single search.
+IN_CHAIN_RULE = '1.2.840.113556.1.4.1941'
+
+def membership_filter(object_class, attribute, dn, transitive=False):
+    """Entries of ``object_class`` whose ``attribute`` links to ``dn``, directly or through nesting"""
+    rule = f":{IN_CHAIN_RULE}:" if transitive else ""
+    return f"(&(objectClass={object_class})({attribute}{rule}={escape_ldap_filter(dn)}))"
+
+SEARCH_MATCH_MODES = ('auto', 'prefix', 'contains')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+# Letters, spaces, hyphens and apostrophes: a person's or group's name, which
+# ANR matches against its indexed name attributes (including "first last")
+NAME_PATTERN = re.compile(r"^[^\W\d_]+(?:['\- ]+[^\W\d_]+)*$")
+
+class QueryPlan:
+    """The filter chosen for a search, and why"""
+
+    def __init__(self, strategy, search_filter, reason):
+        self.strategy = strategy
+        self.filter = search_filter
+        self.reason = reason
+
+    def explain(self):
+        return {"strategy": self.strategy, "filter": self.filter, "reason": self.reason}
+
+    def __str__(self):
+        return f"{self.strategy} {self.filter} ({self.reason})"
+
+def _contains_filter(object_class, value):
+    if object_class == 'user':
+        return f"(&(objectClass=user)(|(name=*{value}*)(mail=*{value}*)(sAMAccountName=*{value}*)(userPrincipalName=*{value}*)(employeeID=*{value}*)))"
+    return f"(&(objectClass=group)(|(name=*{value}*)(description=*{value}*)))"
+
+def _prefix_filter(object_class, value):
+    if object_class == 'user':
+        return f"(&(objectClass=user)(|(name={value}*)(mail={value}*)(sAMAccountName={value}*)(userPrincipalName={value}*)))"
+    return f"(&(objectClass=group)(|(name={value}*)(sAMAccountName={value}*)))"
+
+def plan_search(search_query, search_type, is_precise, search_by='', match='auto'):
+    """Pick a filter for a search from the shape of the query.
+
+    Fuzzy searches avoid medial wildcards (``*q*``), which no AD index can
+    serve: an email goes to exact ``mail``/``userPrincipalName``, digits to
+    ``employeeID``, a name to ANR and anything else to prefix terms.
+    ``match=prefix`` skips ANR and ``match=contains`` restores the medial
+    wildcards. Returns None for an unknown search type; an unknown
+    ``match`` raises ValueError.
+    """
+    if match not in SEARCH_MATCH_MODES:
+        raise ValueError(f"Unknown match mode: {match}")
+    escaped_query = escape_ldap_filter(search_query)
+
+    if search_type == 'group_members':
+        return QueryPlan('member_of', f"(&(objectClass=user)(memberOf={escaped_query}))", "direct members of a group")
+    if search_type not in ('users', 'groups'):
+        return None
+    object_class = 'user' if search_type == 'users' else 'group'
+
+    if search_type == 'users' and search_by == 'sAMAccountName':
+        return QueryPlan('sam_account_name', f"(&(objectClass=user)(sAMAccountName={escaped_query}))",
+                         "searchBy=sAMAccountName")
+    if is_precise:
+        if search_type == 'users':
+            return QueryPlan('exact', f"(&(objectClass=user)(|(sAMAccountName={escaped_query})(userPrincipalName={escaped_query})(employeeID={escaped_query})))",
+                             "precise search matches account identifiers exactly")
+        return QueryPlan('exact', f"(&(objectClass=group)(sAMAccountName={escaped_query}))",
+                         "precise search matches sAMAccountName exactly")
+    if match == 'contains':
+        return QueryPlan('contains', _contains_filter(object_class, escaped_query),
+                         "match=contains asked for medial wildcards, which cannot use an index")
+
+    term = search_query.strip()
+    escaped_term = escape_ldap_filter(term)
+    if search_type == 'users' and EMAIL_PATTERN.match(term):
+        return QueryPlan('email', f"(&(objectClass=user)(|(mail={escaped_term})(userPrincipalName={escaped_term})))",
+                         "query looks like an email address")
+    if search_type == 'users' and term.isdigit():
+        return QueryPlan('employee_id', f"(&(objectClass=user)(|(employeeID={escaped_term})(sAMAccountName={escaped_term})))",
+                         "query is numeric")
+    if match == 'auto' and NAME_PATTERN.match(term):
+        return QueryPlan('anr', f"(&(objectClass={object_class})(anr={escaped_term}))",
+                         "query looks like a name; ANR matches name attributes by prefix")
+    return QueryPlan('prefix', _prefix_filter(object_class, escaped_term),
+                     "match=prefix" if match == 'prefix' else "query is not a plain name; matching identifiers by prefix")
+
+def build_search(search_query, search_type, is_precise, search_by='', fields=None, match='auto'):
+    """Return (plan, attributes, formatter) for a search, or None if the type is unknown
+
+    ``fields`` is the raw ``fields`` query value; an unknown field or
+    ``match`` mode raises ValueError.
+    """
+    plan = plan_search(search_query, search_type, is_precise, search_by, match)
+    if plan is None:
+        return None
+    attributes, formatter = select_fields(search_type, fields)
+    return plan, attributes, formatter
+
+def select_fields(search_type, fields=None):
+    """(attributes, formatter) for a result type, trimmed to ``fields`` when given"""
+    schema = SCHEMAS[search_type]
+    if not fields:
+        return schema.attributes, schema.format
+    selected = schema.select(fields)
+    return [attribute for _, attribute, _ in selected], schema.formatter(selected)
+
+def format_entries(entries, formatter):
+    """Format raw entries in one pass, skipping referrals and unnamed entries"""
+    with timed('format'):
+        return [formatted for formatted in (formatter(entry) for entry in entries if entry[0] is not None)
+                if formatted]
+
+def project_entries(entries, search_type, fields=None):
+    """Apply a ``fields`` selection to entries that were formatted in full"""
+    if not fields:
+        return entries
+    schema = SCHEMAS[search_type]
+    selected = schema.select(fields)
+    return [schema.project(entry, selected) for entry in entries]
@@ -0,0 +1,86 @@
+# ad_dump/src/lookup.py
+import math
+import os
+
+import ldap
+
+from .ldap_search import search_ldap, escape_ldap_filter, SCHEMAS
+
+# OR terms per filter. AD rejects very large filters (MaxReceiveBuffer,
+# MaxQueryDuration), and a few hundred terms stay well inside both.
+LOOKUP_CHUNK_SIZE = int(os.getenv('LOOKUP_CHUNK_SIZE', '200'))
+LOOKUP_MAX_KEYS = int(os.getenv('LOOKUP_MAX_KEYS', '1000'))
+
+LOOKUP_BY = ('sAMAccountName', 'userPrincipalName', 'employeeID', 'distinguishedName')
+OBJECT_CLASSES = {'users': 'user', 'groups': 'group'}
+
+
+def _classify(key, by):
+    """The attributes a key should be matched against"""
+    if by != 'auto':
+        return [by]
+    if '=' in key and ',' in key:
+        return ['distinguishedName']
+    if '@' in key:
+        return ['userPrincipalName']
+    if key.isdigit():
+        # Numeric keys are usually employee IDs but may be account names
+        return ['employeeID', 'sAMAccountName']
+    return ['sAMAccountName']
+
+
+def _chunks(terms, size):
+    for i in range(0, len(terms), size):
+        yield terms[i:i + size]
+
+
+def search_count(keys, by='auto'):
+    """How many OR-filter searches lookup_entries makes for ``keys``"""
+    terms = {(attribute, key.lower()) for key in keys for attribute in _classify(key, by)}
+    return max(1, math.ceil(len(terms) / LOOKUP_CHUNK_SIZE))
+
+
+def _match_values(dn, attrs, attribute):
+    if attribute == 'distinguishedName':
+        return [dn]
+    return [v.decode('utf-8', 'replace') for v in attrs.get(attribute, [])]
+
+
+def lookup_entries(ldap_conn, base_dn, keys, lookup_type='users', by='auto', fields=None):
+    """Resolve many keys with a handful of OR-filter searches on one connection.
+
+    Returns a dict of key -> formatted entry (None when nothing matched).
+    Matching is case-insensitive, as it is in AD.
+    """
+    schema = SCHEMAS[lookup_type]
+    selected = schema.select(fields)
+    formatter = schema.formatter(selected)
+
+    wanted = {}  # (attribute, lowercased value) -> original keys
+    for key in keys:
+        for attribute in _classify(key, by):
+            wanted.setdefault((attribute, key.lower()), []).append(key)
+
+    match_attributes = {attribute for attribute, _ in wanted if attribute != 'distinguishedName'}
+    attributes = sorted({attribute for _, attribute, _ in selected} | match_attributes)
+    object_class = OBJECT_CLASSES[lookup_type]
+
+    terms = [f"({attribute}={escape_ldap_filter(value)})" for attribute, value in wanted]
+    results = dict.fromkeys(keys)
+    for chunk in _chunks(terms, LOOKUP_CHUNK_SIZE):
+        search_filter = f"(&(objectClass={object_class})(|{''.join(chunk)}))"
+        search_results = search_ldap(ldap_conn, search_filter, attributes, base_dn, max_results=0)
+        if search_results["status"] == "error":
+            raise ldap.LDAPError(search_results["error"])
+
+        for dn, attrs in search_results["results"]:
+            if dn is None:
+                continue
+            formatted = formatter((dn, attrs))
+            if not formatted:
+                continue
+            for attribute in match_attributes | {'distinguishedName'}:
+                for value in _match_values(dn, attrs, attribute):
+                    for key in wanted.get((attribute, value.lower()), ()):
+                        results[key] = formatted
+    return results
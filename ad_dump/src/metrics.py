@@ -0,0 +1,115 @@
+# ad_dump/src/metrics.py
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# Requests slower than this are logged with their phases (0 = off)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+# Filters and query strings hold what users searched for, so they are only logged when asked
+SLOW_QUERY_LOG_FILTERS = os.getenv('SLOW_QUERY_LOG_FILTERS', 'false').lower() == 'true'
+# Set by the process manager when several workers share one /metrics view
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+MAX_FILTERS_PER_REQUEST = 10
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+REQUEST_SECONDS = Histogram('friendly_ad_request_seconds', 'Request latency by route',
+                            ['route', 'method', 'status'], buckets=BUCKETS)
+PHASE_SECONDS = Histogram('friendly_ad_phase_seconds', 'Time spent in each phase of a request',
+                          ['phase', 'domain'], buckets=BUCKETS)
+LDAP_PAGES = Counter('friendly_ad_ldap_pages_total', 'LDAP result pages received', ['domain'])
+LDAP_ENTRIES = Counter('friendly_ad_ldap_entries_total', 'LDAP entries received', ['domain'])
+LDAP_BYTES = Counter('friendly_ad_ldap_bytes_total', 'Attribute value bytes received from LDAP', ['domain'])
+COALESCED_SEARCHES = Counter('friendly_ad_coalesced_searches_total',
+                             'Searches answered by an identical search already in flight', ['domain'])
+ADMISSION_REJECTED = Counter('friendly_ad_admission_rejected_total',
+                             'Requests turned away with 429 by admission control', ['scope', 'reason'])
+
+
+def record(phase, seconds, domain=''):
+    PHASE_SECONDS.labels(phase, str(domain or '')).observe(seconds)
+    if has_request_context():
+        phases = g.setdefault('phases', {})
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase, domain=''):
+    """Time a block as ``phase``; it also shows in the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start, domain)
+
+
+def count_page(domain, entries):
+    size = 0
+    count = 0
+    for dn, attrs in entries:
+        if dn is None:
+            continue
+        count += 1
+        for values in attrs.values():
+            size += sum(len(value) for value in values)
+    domain = str(domain or '')
+    LDAP_PAGES.labels(domain).inc()
+    LDAP_ENTRIES.labels(domain).inc(count)
+    LDAP_BYTES.labels(domain).inc(size)
+
+
+def note_filter(search_filter):
+    """Remember a filter this request sent, for the slow query log"""
+    if has_request_context():
+        filters = g.setdefault('ldap_filters', [])
+        if len(filters) < MAX_FILTERS_PER_REQUEST:
+            filters.append(search_filter)
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _finish_timer(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(elapsed)
+
+    phases = g.get('phases', {})
+    if phases:
+        response.headers['Server-Timing'] = ', '.join(
+            f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in phases.items()
+        )
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        timings = ' '.join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in phases.items())
+        if SLOW_QUERY_LOG_FILTERS:
+            print(f"Slow request: {request.method} {request.full_path} {elapsed * 1000:.1f}ms "
+                  f"status={response.status_code} {timings} filters={g.get('ldap_filters', [])}")
+        else:
+            print(f"Slow request: {request.method} {route} {elapsed * 1000:.1f}ms "
+                  f"status={response.status_code} {timings}")
+    return response
+
+
+def metrics_view():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    # /metrics itself is added by the app, behind its API key
+    app.before_request(_start_timer)
+    app.after_request(_finish_timer)
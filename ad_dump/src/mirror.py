@@ -0,0 +1,373 @@
+# ad_dump/src/mirror.py
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import ldap
+
+from .config_cache import config_cache
+from .ldap_pool import ldap_pool
+from .metrics import timed
+from .ldap_search import iter_search_ldap, format_user, format_group, USER_ATTRIBUTES, GROUP_ATTRIBUTES
+
+MIRROR_ENABLED = os.getenv('MIRROR_ENABLED', 'false').lower() == 'true'
+MIRROR_DB_PATH = os.getenv('MIRROR_DB_PATH', 'ad_mirror.db')
+MIRROR_SYNC_INTERVAL = float(os.getenv('MIRROR_SYNC_INTERVAL', '300'))
+MIRROR_FULL_SYNC_INTERVAL = float(os.getenv('MIRROR_FULL_SYNC_INTERVAL', '86400'))
+MIRROR_MAX_STALENESS = float(os.getenv('MIRROR_MAX_STALENESS', str(MIRROR_SYNC_INTERVAL * 3)))
+# How often the sync thread looks for syncs requested through any worker
+MIRROR_REQUEST_POLL = float(os.getenv('MIRROR_REQUEST_POLL', '5'))
+
+SHOW_DELETED_OID = '1.2.840.113556.1.4.417'
+SYNC_FILTER = '(|(objectClass=user)(objectClass=group))'
+SYNC_ATTRIBUTES = sorted(set(USER_ATTRIBUTES) | set(GROUP_ATTRIBUTES) | {'objectClass', 'objectGUID', 'uSNChanged'})
+
+# Same attributes the live fuzzy filters in perform_search look at
+SEARCH_COLUMNS = {
+    'users': ['name', 'mail', 'sam', 'upn', 'employee_id'],
+    'groups': ['name', 'description'],
+}
+
+
+def _first(attrs, name):
+    values = attrs.get(name)
+    return values[0] if values else None
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+
+class DirectoryMirror:
+    """Local copy of each domain's users and groups for fuzzy search.
+
+    The first pull of a domain pages through everything; after that only
+    objects whose uSNChanged moved past the last seen highestCommittedUSN
+    are fetched, plus tombstones from the Deleted Objects container.
+    USNs are per-DC, so a change of DC (dsServiceName) forces a full pull.
+    Medial-substring queries are answered from an FTS5 trigram index.
+    """
+
+    def __init__(self, path=MIRROR_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._init_schema(db)
+            self._local.db = db
+        return db
+
+    def _init_schema(self, db):
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            domain_id INTEGER NOT NULL,
+            dn TEXT NOT NULL COLLATE NOCASE,
+            guid BLOB,
+            kind TEXT NOT NULL,
+            usn INTEGER,
+            sort_name TEXT,
+            sync_gen INTEGER,
+            data TEXT NOT NULL,
+            UNIQUE (domain_id, dn)
+        )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS entries_guid ON entries (domain_id, guid)')
+        db.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+            name, mail, sam, upn, employee_id, description,
+            tokenize = 'trigram'
+        )
+        ''')
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            domain_id INTEGER PRIMARY KEY,
+            server_id TEXT,
+            highest_usn INTEGER,
+            sync_gen INTEGER DEFAULT 0,
+            last_full_sync REAL,
+            last_sync REAL,
+            last_error TEXT
+        )
+        ''')
+        # Written by whichever worker takes the admin call, drained by the one running the sync thread
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS sync_requests (
+            domain_id INTEGER,
+            full INTEGER NOT NULL,
+            requested_at REAL NOT NULL
+        )
+        ''')
+        db.commit()
+
+    # -- reading -----------------------------------------------------------
+
+    def _state(self, domain_id):
+        row = self._db().execute('''
+            SELECT server_id, highest_usn, sync_gen, last_full_sync, last_sync, last_error
+            FROM sync_state WHERE domain_id = ?
+        ''', (domain_id,)).fetchone()
+        if not row:
+            return None
+        return dict(zip(['server_id', 'highest_usn', 'sync_gen', 'last_full_sync', 'last_sync', 'last_error'], row))
+
+    def is_fresh(self, domain_id):
+        state = self._state(domain_id)
+        return bool(state and state['last_full_sync'] and state['last_sync']
+                    and time.time() - state['last_sync'] < MIRROR_MAX_STALENESS)
+
+    def search(self, domain_id, search_type, query, max_results=0):
+        """Substring match over the same attributes as the live fuzzy filter."""
+        columns = SEARCH_COLUMNS[search_type]
+        kind = 'group' if search_type == 'groups' else 'user'
+        limit = max_results if max_results else -1
+
+        if len(query) >= 3:
+            # Trigram MATCH needs at least three characters
+            match = '{%s} : "%s"' % (' '.join(columns), query.replace('"', '""'))
+            rows = self._db().execute('''
+                SELECT e.data FROM entries_fts f JOIN entries e ON e.id = f.rowid
+                WHERE entries_fts MATCH ? AND e.domain_id = ? AND e.kind = ?
+                ORDER BY e.sort_name LIMIT ?
+            ''', (match, domain_id, kind, limit))
+        else:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where = ' OR '.join(f"f.{c} LIKE ? ESCAPE '\\'" for c in columns)
+            rows = self._db().execute(f'''
+                SELECT e.data FROM entries_fts f JOIN entries e ON e.id = f.rowid
+                WHERE ({where}) AND e.domain_id = ? AND e.kind = ?
+                ORDER BY e.sort_name LIMIT ?
+            ''', [pattern] * len(columns) + [domain_id, kind, limit])
+        return [json.loads(row[0]) for row in rows]
+
+    def entries(self, domain_id):
+        """(kind, dn, formatted entry) for everything mirrored from a domain"""
+        rows = self._db().execute('SELECT kind, dn, data FROM entries WHERE domain_id = ?', (domain_id,))
+        for kind, dn, data in rows:
+            yield kind, dn, json.loads(data)
+
+    def search_capped(self, domain_id, search_type, query, max_results=0):
+        """Like search() but reports whether ``max_results`` cut the list short."""
+        with timed('mirror', domain_id):
+            results = self.search(domain_id, search_type, query, max_results + 1 if max_results else 0)
+        truncated = bool(max_results) and len(results) > max_results
+        return (results[:max_results] if truncated else results), truncated
+
+    def status(self):
+        db = self._db()
+        counts = dict(db.execute('SELECT domain_id, COUNT(*) FROM entries GROUP BY domain_id').fetchall())
+        result = []
+        for domain in config_cache.list_domains():
+            state = self._state(domain['id']) or {}
+            result.append({
+                'domain_id': domain['id'],
+                'entries': counts.get(domain['id'], 0),
+                'fresh': self.is_fresh(domain['id']),
+                'last_sync': state.get('last_sync'),
+                'last_full_sync': state.get('last_full_sync'),
+                'highest_usn': state.get('highest_usn'),
+                'last_error': state.get('last_error'),
+            })
+        return result
+
+    # -- writing -----------------------------------------------------------
+
+    def _delete_rows(self, db, ids):
+        for entry_id in ids:
+            db.execute('DELETE FROM entries_fts WHERE rowid = ?', (entry_id,))
+            db.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+
+    def _upsert(self, db, domain_id, sync_gen, dn, attrs):
+        guid = _first(attrs, 'objectGUID')
+        classes = [c.lower() for c in attrs.get('objectClass', [])]
+        kind = 'group' if b'group' in classes else 'user'
+        formatted = format_group((dn, attrs)) if kind == 'group' else format_user((dn, attrs))
+
+        if guid is not None:
+            row = db.execute('SELECT id FROM entries WHERE domain_id = ? AND guid = ?', (domain_id, guid)).fetchone()
+        else:
+            row = db.execute('SELECT id FROM entries WHERE domain_id = ? AND dn = ?', (domain_id, dn)).fetchone()
+
+        if not formatted:
+            if row:
+                self._delete_rows(db, [row[0]])
+            return
+
+        usn = _first(attrs, 'uSNChanged')
+        values = (dn, guid, kind, int(usn) if usn else None, formatted['name'].lower(), sync_gen,
+                  json.dumps(formatted))
+        if row:
+            entry_id = row[0]
+            db.execute('''
+                UPDATE entries SET dn = ?, guid = ?, kind = ?, usn = ?, sort_name = ?, sync_gen = ?, data = ?
+                WHERE id = ?
+            ''', values + (entry_id,))
+            db.execute('DELETE FROM entries_fts WHERE rowid = ?', (entry_id,))
+        else:
+            # A rename can leave a stale row under the new DN without a GUID match
+            db.execute('DELETE FROM entries WHERE domain_id = ? AND dn = ?', (domain_id, dn))
+            entry_id = db.execute('''
+                INSERT INTO entries (domain_id, dn, guid, kind, usn, sort_name, sync_gen, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (domain_id,) + values).lastrowid
+
+        db.execute('''
+            INSERT INTO entries_fts (rowid, name, mail, sam, upn, employee_id, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (entry_id, formatted.get('name'), formatted.get('email'), formatted.get('samAccountName'),
+              formatted.get('userPrincipalName'), formatted.get('employeeID'), formatted.get('description')))
+
+    def _pull(self, db, ldap_conn, domain, search_filter, sync_gen):
+        count = 0
+        for dn, attrs in iter_search_ldap(ldap_conn, search_filter, SYNC_ATTRIBUTES, domain['base_dn']):
+            if dn is None:
+                continue
+            self._upsert(db, domain['id'], sync_gen, dn, attrs)
+            count += 1
+            if count % 1000 == 0:
+                db.commit()
+        db.commit()
+        return count
+
+    def _apply_tombstones(self, db, ldap_conn, domain, since_usn):
+        deleted_filter = f'(&(isDeleted=TRUE)(uSNChanged>={since_usn}))'
+        show_deleted = ldap.controls.RequestControl(SHOW_DELETED_OID, True)
+        try:
+            for dn, attrs in iter_search_ldap(ldap_conn, deleted_filter, ['objectGUID'],
+                                              f"CN=Deleted Objects,{domain['base_dn']}",
+                                              extra_controls=[show_deleted]):
+                guid = _first(attrs or {}, 'objectGUID')
+                if guid is None:
+                    continue
+                ids = [r[0] for r in db.execute('SELECT id FROM entries WHERE domain_id = ? AND guid = ?',
+                                                (domain['id'], guid))]
+                self._delete_rows(db, ids)
+            db.commit()
+        except ldap.LDAPError as e:
+            # Reading tombstones needs extra rights on some forests; the
+            # periodic full pull still sweeps deleted objects out.
+            print(f"Mirror could not read deleted objects for domain {domain['id']}: {e}")
+
+    def sync_domain(self, domain, full=False):
+        db = self._db()
+        state = self._state(domain['id']) or {}
+        ldap_conn = ldap_pool.acquire(domain)
+        try:
+            root = ldap_conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)',
+                                      ['highestCommittedUSN', 'dsServiceName'])
+            root_attrs = root[0][1] if root else {}
+            highest_usn = int(_first(root_attrs, 'highestCommittedUSN') or 0)
+            server_id = _text(_first(root_attrs, 'dsServiceName'))
+
+            full = (full or not state.get('last_full_sync') or state.get('server_id') != server_id
+                    or time.time() - state['last_full_sync'] > MIRROR_FULL_SYNC_INTERVAL)
+            sync_gen = (state.get('sync_gen') or 0) + (1 if full else 0)
+            started = time.time()
+
+            if full:
+                count = self._pull(db, ldap_conn, domain, SYNC_FILTER, sync_gen)
+                # Anything not seen in a full pull no longer exists in scope
+                stale = [r[0] for r in db.execute('SELECT id FROM entries WHERE domain_id = ? AND sync_gen != ?',
+                                                  (domain['id'], sync_gen))]
+                self._delete_rows(db, stale)
+            else:
+                since_usn = (state.get('highest_usn') or 0) + 1
+                count = self._pull(db, ldap_conn, domain, f'(&{SYNC_FILTER}(uSNChanged>={since_usn}))', sync_gen)
+                self._apply_tombstones(db, ldap_conn, domain, since_usn)
+
+            db.execute('''
+                INSERT OR REPLACE INTO sync_state
+                    (domain_id, server_id, highest_usn, sync_gen, last_full_sync, last_sync, last_error)
+                VALUES (?, ?, ?, ?, ?, ?, NULL)
+            ''', (domain['id'], server_id, highest_usn, sync_gen,
+                  started if full else state.get('last_full_sync'), started))
+            db.commit()
+            print(f"Mirror {'full' if full else 'delta'} sync of domain {domain['id']}: {count} entries")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            ldap_pool.release(ldap_conn)
+
+    def _drop_domain(self, db, domain_id):
+        db.execute('DELETE FROM entries_fts WHERE rowid IN (SELECT id FROM entries WHERE domain_id = ?)',
+                   (domain_id,))
+        db.execute('DELETE FROM entries WHERE domain_id = ?', (domain_id,))
+        db.execute('DELETE FROM sync_state WHERE domain_id = ?', (domain_id,))
+        db.commit()
+
+    def sync_all(self, full_domains=()):
+        """Sync every domain; those in ``full_domains`` (None for all) get a full pull"""
+        db = self._db()
+        domains = config_cache.list_domains()
+        active = {d['id'] for d in domains}
+        for (domain_id,) in db.execute('SELECT domain_id FROM sync_state').fetchall():
+            if domain_id not in active:
+                self._drop_domain(db, domain_id)
+
+        for domain in domains:
+            try:
+                self.sync_domain(domain, full=domain['id'] in full_domains or None in full_domains)
+            except Exception as e:
+                print(f"Mirror sync of domain {domain['id']} failed: {e}")
+                db.execute('UPDATE sync_state SET last_error = ? WHERE domain_id = ?', (str(e), domain['id']))
+                db.commit()
+
+    # -- background worker -------------------------------------------------
+
+    def request_sync(self, domain_id=None, full=False):
+        """Ask the sync thread for a sync, from any worker.
+
+        Only one process runs the thread (see start), so the request goes
+        through the database; it is picked up within MIRROR_REQUEST_POLL.
+        """
+        db = self._db()
+        db.execute('INSERT INTO sync_requests (domain_id, full, requested_at) VALUES (?, ?, ?)',
+                   (domain_id, 1 if full else 0, time.time()))
+        db.commit()
+        self._wake.set()
+
+    def _take_requests(self):
+        db = self._db()
+        rows = db.execute('DELETE FROM sync_requests RETURNING domain_id, full').fetchall()
+        db.commit()
+        return rows
+
+    def _run(self):
+        next_sync = 0
+        while True:
+            self._wake.clear()
+            requests = self._take_requests()
+            if requests or time.monotonic() >= next_sync:
+                self.sync_all({domain_id for domain_id, full in requests if full})
+                next_sync = time.monotonic() + MIRROR_SYNC_INTERVAL
+            self._wake.wait(min(MIRROR_REQUEST_POLL, max(next_sync - time.monotonic(), 0)))
+
+    def start(self):
+        """Start the sync thread unless another process already runs it."""
+        if self._thread:
+            return True
+        lock_file = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self._thread = threading.Thread(target=self._run, name='directory-mirror', daemon=True)
+        self._thread.start()
+        return True
+
+
+directory_mirror = DirectoryMirror()
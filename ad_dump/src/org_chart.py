@@ -0,0 +1,279 @@
+# ad_dump/src/org_chart.py
+import os
+import threading
+import time
+
+import ldap
+
+from .config_cache import config_cache
+from .ldap_pool import ldap_pool
+from .ldap_search import iter_search_ldap
+from .metrics import timed
+from .shared_index import SharedIndex, INDEX_POLL_INTERVAL
+
+ORG_CHART_ENABLED = os.getenv('ORG_CHART_ENABLED', 'true').lower() == 'true'
+# Changed users (uSNChanged) are pulled this often; a full pull also drops deleted ones
+ORG_CHART_REFRESH_INTERVAL = float(os.getenv('ORG_CHART_REFRESH_INTERVAL', '300'))
+ORG_CHART_FULL_REFRESH_INTERVAL = float(os.getenv('ORG_CHART_FULL_REFRESH_INTERVAL', '86400'))
+ORG_CHART_RETRY_INTERVAL = 60
+# Deepest reporting chain or report tree walked; also stops manager loops
+ORG_MAX_DEPTH = 50
+# Most people returned by one /reports call
+ORG_MAX_NODES = int(os.getenv('ORG_MAX_NODES', '10000'))
+
+ORG_FILTER = '(&(objectClass=user)(!(objectClass=computer)))'
+ORG_ATTRIBUTES = ['name', 'title', 'department', 'mail', 'sAMAccountName', 'userAccountControl', 'manager']
+
+
+def _text(values):
+    return values[0].decode('utf-8', 'replace') if values else None
+
+
+def _person(dn, attrs):
+    control = attrs.get('userAccountControl')
+    return {
+        "id": dn,
+        "name": _text(attrs.get('name')),
+        "title": _text(attrs.get('title')),
+        "department": _text(attrs.get('department')),
+        "email": _text(attrs.get('mail')),
+        "samAccountName": _text(attrs.get('sAMAccountName')),
+        "enabled": not (int(control[0]) & 2) if control else True,
+    }, _text(attrs.get('manager'))
+
+
+class OrgTree:
+    """One domain's manager tree: each user's manager and, the other way,
+    each manager's direct reports, keyed by lowercased DN.
+
+    Only ``manager`` is pulled; ``directReports`` is its back-link, so the
+    reverse edges are filled in here rather than read a second time.
+    """
+
+    def __init__(self):
+        self.people = {}
+        self.managers = {}
+        self.reports = {}
+        self._lock = threading.RLock()
+        self.highest_usn = 0
+        self.server_id = None
+        self.full_at = 0.0
+        self.built_at = 0.0
+
+    def __len__(self):
+        return len(self.people)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def update(self, dn, attrs):
+        person, manager = _person(dn, attrs)
+        key = dn.lower()
+        manager_key = manager.lower() if manager else None
+        with self._lock:
+            self.people[key] = person
+            previous = self.managers.get(key)
+            if previous == manager_key:
+                return
+            if previous:
+                siblings = self.reports.get(previous)
+                if siblings:
+                    siblings.discard(key)
+                    if not siblings:
+                        del self.reports[previous]
+            if manager_key:
+                self.managers[key] = manager_key
+                self.reports.setdefault(manager_key, set()).add(key)
+            else:
+                self.managers.pop(key, None)
+
+    def _node(self, key):
+        person = self.people.get(key)
+        if person is None:
+            # A manager outside the indexed base DN, or not yet pulled
+            return None
+        return dict(person, reportCount=len(self.reports.get(key, ())))
+
+    def person(self, dn):
+        with self._lock:
+            return self._node(dn.lower())
+
+    def chain(self, dn):
+        """Managers of ``dn`` from the direct one upwards, or None if ``dn`` is unknown"""
+        key = dn.lower()
+        with self._lock:
+            if key not in self.people:
+                return None
+            chain = []
+            seen = {key}
+            manager = self.managers.get(key)
+            while manager and manager not in seen and len(chain) < ORG_MAX_DEPTH:
+                seen.add(manager)
+                node = self._node(manager)
+                if node is None:
+                    break
+                chain.append(node)
+                manager = self.managers.get(manager)
+            return chain
+
+    def subtree(self, dn, depth):
+        """``dn``'s reports ``depth`` levels down as a nested tree, plus how
+        many people it holds and whether ORG_MAX_NODES cut it short."""
+        key = dn.lower()
+        with self._lock:
+            root = self._node(key)
+            if root is None:
+                return None, 0, False
+            count = 0
+            truncated = False
+            seen = {key}
+            level = [(key, root)]
+            for _ in range(min(depth, ORG_MAX_DEPTH)):
+                next_level = []
+                for parent_key, parent in level:
+                    parent["reports"] = []
+                    for child_key in sorted(self.reports.get(parent_key, ()),
+                                            key=lambda k: (self.people.get(k) or {}).get("name") or k):
+                        if child_key in seen:
+                            continue
+                        if count >= ORG_MAX_NODES:
+                            truncated = True
+                            break
+                        child = self._node(child_key)
+                        if child is None:
+                            continue
+                        seen.add(child_key)
+                        parent["reports"].append(child)
+                        next_level.append((child_key, child))
+                        count += 1
+                level = next_level
+                if not level or truncated:
+                    break
+            return root, count, truncated
+
+
+class OrgChart:
+    """Per-domain manager trees, kept current in the background.
+
+    The first build of a domain is one paged pull of every user's
+    ``manager``. After that only users whose uSNChanged moved past the
+    last seen highestCommittedUSN are pulled and patched in place. A
+    full pull every ORG_CHART_FULL_REFRESH_INTERVAL, or when the pool
+    lands on another DC (USNs are per-DC), swaps in a fresh tree and so
+    drops deleted users. Only one worker process pulls; the others load
+    its trees through a SharedIndex.
+    """
+
+    def __init__(self):
+        self._trees = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._shared = SharedIndex('org_chart')
+
+    def get(self, domain_id):
+        return self._trees.get(domain_id)
+
+    def _pull(self, tree, ldap_conn, domain, search_filter):
+        count = 0
+        for dn, attrs in iter_search_ldap(ldap_conn, search_filter, ORG_ATTRIBUTES, domain['base_dn']):
+            if dn:
+                tree.update(dn, attrs)
+                count += 1
+        return count
+
+    def refresh(self, domain, full=False):
+        current = self._trees.get(domain['id'])
+        ldap_conn = ldap_pool.acquire(domain)
+        broken = True
+        try:
+            with timed('org_chart_build', domain['id']):
+                root = ldap_conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)',
+                                          ['highestCommittedUSN', 'dsServiceName'])
+                root_attrs = root[0][1] if root else {}
+                highest_usn = int(_text(root_attrs.get('highestCommittedUSN')) or 0)
+                server_id = _text(root_attrs.get('dsServiceName'))
+                full = (full or current is None or current.server_id != server_id
+                        or time.time() - current.full_at > ORG_CHART_FULL_REFRESH_INTERVAL)
+                if full:
+                    tree = OrgTree()
+                    count = self._pull(tree, ldap_conn, domain, ORG_FILTER)
+                    tree.full_at = time.time()
+                else:
+                    tree = current
+                    count = self._pull(tree, ldap_conn, domain,
+                                       f'(&{ORG_FILTER}(uSNChanged>={current.highest_usn + 1}))')
+            broken = False
+        finally:
+            ldap_pool.release(ldap_conn, broken)
+        tree.highest_usn = highest_usn
+        tree.server_id = server_id
+        tree.built_at = time.time()
+        self._trees[domain['id']] = tree
+        if full or count:
+            # An unchanged tree isn't rewritten, so the other workers keep the copy they have
+            self._shared.publish(domain['id'], tree)
+            print(f"Org chart {'full' if full else 'delta'} refresh of domain {domain['id']}: {count} users")
+
+    def refresh_all(self, full=False):
+        domains = config_cache.list_domains()
+        active = {domain['id'] for domain in domains}
+        for domain_id in list(self._trees):
+            if domain_id not in active:
+                self._trees.pop(domain_id, None)
+                self._shared.withdraw(domain_id)
+        ok = True
+        for domain in domains:
+            try:
+                self.refresh(domain, full)
+            except Exception as e:
+                print(f"Org chart refresh of domain {domain['id']} failed: {e}")
+                ok = False
+        return ok
+
+    def _load_shared(self):
+        active = {domain['id'] for domain in config_cache.list_domains()}
+        for domain_id in list(self._trees):
+            if domain_id not in active:
+                self._trees.pop(domain_id, None)
+        self._trees.update(self._shared.load_changed(active))
+
+    def request_refresh(self):
+        """Rebuild every domain from scratch, e.g. after its settings changed"""
+        self._shared.request(full=True)
+        self._wake.set()
+
+    def _run(self):
+        next_refresh = 0
+        while True:
+            self._wake.clear()
+            if not self._shared.is_builder():
+                self._load_shared()
+            else:
+                full = self._shared.take_request()
+                if full is not None or time.monotonic() >= next_refresh:
+                    ok = self.refresh_all(bool(full))
+                    next_refresh = time.monotonic() + (ORG_CHART_REFRESH_INTERVAL if ok else
+                                                       min(ORG_CHART_RETRY_INTERVAL, ORG_CHART_REFRESH_INTERVAL))
+            self._wake.wait(INDEX_POLL_INTERVAL)
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='org-chart', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # The refresh thread stays behind in the parent
+        self._thread = None
+        self._wake = threading.Event()
+        self._shared._after_fork()
+
+
+org_chart = OrgChart()
+os.register_at_fork(after_in_child=org_chart._after_fork)
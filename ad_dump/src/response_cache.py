@@ -0,0 +1,263 @@
+# ad_dump/src/response_cache.py
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import request, current_app, Response
+from flask_caching import Cache
+from flask_caching.backends import SimpleCache
+from flask_caching.backends.base import BaseCache
+
+from .config_cache import config_cache
+from .shared_index import INDEX_DIR
+
+RESPONSE_CACHE_TYPE = os.getenv('RESPONSE_CACHE_TYPE', f'{__name__}.LRUMemoryCache')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '60'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL')
+# Each DN keeps a list of the cached responses it appears in so it can be
+# purged on its own; the oldest references are dropped beyond this.
+MAX_KEYS_PER_DN = 256
+
+cache = Cache()
+
+
+class LRUMemoryCache(BaseCache):
+    """In-process cache bounded by the total size of its values.
+
+    Values are stored as-is; bytes are measured by length and anything
+    else by its pickled size. Least recently used entries are evicted
+    first once ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, default_timeout=300, max_bytes=RESPONSE_CACHE_MAX_BYTES, **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires, value, size)
+        self._size = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(max_bytes=config.get('CACHE_MAX_BYTES', RESPONSE_CACHE_MAX_BYTES))
+        return cls(*args, **kwargs)
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.monotonic() + timeout if timeout > 0 else 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry[2]
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] and entry[0] < time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        size = len(value) if isinstance(value, bytes) else len(pickle.dumps(value))
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (self._expires(timeout), value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self.get(key) is not None:
+                return False
+            return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        return True
+
+
+def init_response_cache(app):
+    config = {
+        'CACHE_TYPE': RESPONSE_CACHE_TYPE,
+        'CACHE_DEFAULT_TIMEOUT': RESPONSE_CACHE_TTL,
+        'CACHE_KEY_PREFIX': 'friendly_ad:',
+        'CACHE_MAX_BYTES': RESPONSE_CACHE_MAX_BYTES,
+    }
+    if RESPONSE_CACHE_REDIS_URL:
+        config['CACHE_REDIS_URL'] = RESPONSE_CACHE_REDIS_URL
+    cache.init_app(app, config=config)
+
+
+def _hash(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _process_local():
+    """Whether entries live in this worker's memory, out of reach of the others' purges"""
+    return isinstance(cache.cache, (LRUMemoryCache, SimpleCache))
+
+
+def _generation_path(domain_id):
+    return os.path.join(INDEX_DIR, f'response-cache-{domain_id}.generation')
+
+
+def _new_shared_generation(domain_id):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = _generation_path(domain_id)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(temp_path, path)
+
+
+def _shared_generation(domain_id):
+    # Each worker has its own in-process cache, so the generation lives in a
+    # file every worker reads; a purge in any of them retires it for all
+    try:
+        with open(_generation_path(domain_id)) as f:
+            return f.read()
+    except FileNotFoundError:
+        _new_shared_generation(domain_id)
+        with open(_generation_path(domain_id)) as f:
+            return f.read()
+
+
+def _generation(domain_id):
+    if _process_local():
+        return _shared_generation(domain_id)
+    # A random token rather than a counter: if the backend evicts it, a new
+    # token is minted and old entries stay unreachable instead of reviving.
+    key = f'gen:{domain_id}'
+    generation = cache.get(key)
+    if generation is None:
+        token = uuid.uuid4().hex
+        cache.add(key, token, timeout=0)
+        # A backend that stores nothing (NullCache) never returns it
+        generation = cache.get(key) or token
+    return generation
+
+
+def _dn_tag(domain_id, dn):
+    return f'dn:{domain_id}:{_hash(dn.lower())}'
+
+
+def _response_dns(payload, view_kwargs, domain_id):
+    """(domain_id, dn) pairs for the path DN and every entry in the payload"""
+    dns = [(domain_id, v) for v in view_kwargs.values() if isinstance(v, str)]
+    items = payload.get('data') if isinstance(payload, dict) and 'data' in payload else [payload]
+    for item in items or []:
+        if isinstance(item, dict) and item.get('id'):
+            # Fan-out results say which domain each entry came from
+            dns.append((item.get('domain_id', domain_id), item['id']))
+    return dns
+
+
+def _tag(key, dns):
+    tags = list({_dn_tag(domain_id, dn) for domain_id, dn in dns})
+    if not tags:
+        return
+    existing = cache.get_many(*tags)
+    cache.set_many({
+        tag: ([k for k in (keys or []) if k != key] + [key])[-MAX_KEYS_PER_DN:]
+        for tag, keys in zip(tags, existing)
+    })
+
+
+def _cacheable(payload):
+    if not isinstance(payload, dict):
+        return True
+    # Cursor tokens are single use; partial fan-out results would hide a
+    # recovering domain for the whole TTL.
+    if payload.get('next_cursor'):
+        return False
+    return all(d.get('status') == 'ok' for d in payload.get('domains', []))
+
+
+def cached_response(f):
+    """Serve successful JSON responses from the response cache.
+
+    The key covers the domain, the route path and every query argument,
+    so ``type``, ``query``, ``precise`` and ``searchBy`` (and anything
+    added later) each get their own entry. Sending ``Cache-Control:
+    no-cache`` skips the lookup and refreshes the entry.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        domains = config_cache.select(request.args.get('domain') or request.args.get('domain_id'))
+        # Cursor pages are single use and tied to a held connection
+        if not domains or 'cursor' in request.args:
+            return f(*args, **kwargs)
+
+        # Including every selected domain's generation means purging any
+        # one of them also retires multi-domain responses that include it.
+        domain_ids = [d['id'] for d in domains]
+        generations = '.'.join(_generation(domain_id) for domain_id in domain_ids)
+        # Encoded so a value holding '&' or '=' can't read as another argument
+        query = urlencode(sorted(request.args.items(multi=True)))
+        key = f'resp:{generations}:{_hash(request.path + "?" + query)}'
+
+        bypass = 'no-cache' in request.headers.get('Cache-Control', '')
+        if not bypass:
+            body = cache.get(key)
+            if body is not None:
+                response = Response(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code == 200 and response.is_json and not response.is_streamed:
+            payload = response.get_json()
+            if _cacheable(payload):
+                cache.set(key, response.get_data())
+                _tag(key, _response_dns(payload, kwargs, domain_ids[0]))
+        response.headers['X-Cache'] = 'BYPASS' if bypass else 'MISS'
+        return response
+    return decorated_function
+
+
+def purge_domain(domain_id):
+    """Drop every cached response for a domain, in every worker."""
+    if _process_local():
+        _new_shared_generation(domain_id)
+    else:
+        cache.delete(f'gen:{domain_id}')
+
+
+def purge_dn(domain_id, dn):
+    """Drop every cached response that contains or is about ``dn``.
+
+    An in-process cache only knows which of its own entries hold the DN,
+    so the other workers' entries can only be reached by retiring the
+    whole domain. Returns the number of entries found holding the DN.
+    """
+    tag = _dn_tag(domain_id, dn)
+    keys = cache.get(tag) or []
+    cache.delete_many(tag, *keys)
+    if _process_local():
+        _new_shared_generation(domain_id)
+    return len(keys)
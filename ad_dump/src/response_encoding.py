@@ -0,0 +1,122 @@
+# ad_dump/src/response_encoding.py
+import gzip
+import json
+import os
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import generate_etag
+
+from .metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ETAGS_ENABLED = os.getenv('ETAGS_ENABLED', 'true').lower() == 'true'
+# Bodies smaller than this go out uncompressed; the framing costs more than it saves
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESS_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain'}
+# Timings that differ on every call (e.g. each domain's in a fan-out search); left out of the ETag
+VOLATILE_FIELDS = ('latency_ms',)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timed as ``serialize`` and using orjson when installed.
+
+    Keys keep their insertion order instead of being sorted, which is
+    cheaper and still deterministic for the ETag.
+    """
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        with timed('serialize'):
+            return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            with timed('serialize'):
+                body = orjson.dumps(obj, default=self.default,
+                                    option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers wider than 64 bits; the stdlib encoder copes
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def _encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def _compress(data, encoding):
+    with timed('compress'):
+        if encoding == 'br':
+            return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def _without_volatile(value):
+    if isinstance(value, dict):
+        return {key: _without_volatile(item) for key, item in value.items() if key not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_without_volatile(item) for item in value]
+    return value
+
+
+def _etag(response, data):
+    if response.mimetype == 'application/json' and any(f'"{field}"'.encode() in data for field in VOLATILE_FIELDS):
+        data = json.dumps(_without_volatile(json.loads(data)), ensure_ascii=False).encode('utf-8')
+    return generate_etag(data)
+
+
+def encode_response(response):
+    """Add a strong ETag, answer If-None-Match with 304 and compress the body.
+
+    The ETag is a digest of the uncompressed body less VOLATILE_FIELDS, so
+    it changes exactly when the entries do, including memberOf (a back-link
+    whose changes leave the user's whenChanged/uSNChanged alone). Being
+    taken from the body, it is only known once the query has run: a 304
+    saves sending the body, not the LDAP work. Compressed variants get a
+    suffixed tag, as each encoding is a different representation.
+    """
+    if (request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.is_streamed
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    data = response.get_data()
+    encoding = _encoding() if len(data) >= COMPRESS_MIN_BYTES else None
+    response.vary.add('Accept-Encoding')
+
+    if ETAGS_ENABLED:
+        tag = _etag(response, data)
+        response.set_etag(f"{tag}-{encoding}" if encoding else tag)
+        # Let browsers keep the body but revalidate it on every use
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    if encoding:
+        response.set_data(_compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_response_encoding(app):
+    app.json = JSONProvider(app)
+    # Registered after init_metrics so Server-Timing includes compression
+    app.after_request(encode_response)
@@ -0,0 +1,92 @@
+# ad_dump/src/server.py
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+SERVER_BIND = os.getenv('SERVER_BIND', f"0.0.0.0:{os.getenv('BACKEND_PORT', '4501')}")
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(multiprocessing.cpu_count())))
+# LDAP calls block, so each worker serves requests from a thread pool
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))
+SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', '60'))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))
+SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', '75'))
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '2048'))
+SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', '0'))
+
+
+def post_worker_init(worker):
+    from .admission import admission
+    from .app import start_background_tasks
+    # Admission limits are set for the whole server; each worker enforces its share
+    admission.set_workers(worker.cfg.workers)
+    start_background_tasks()
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the shared metrics files
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class ProductionServer(BaseApplication):
+    """Gunicorn prefork server with the app imported once in the master.
+
+    Workers are forked from the preloaded master, so imports and the
+    config cache are shared copy-on-write. LDAP pools, open cursors and
+    the fan-out executor are reset in each child (see os.register_at_fork
+    in those modules) because sockets and threads cannot cross a fork.
+
+    The proxy spreads requests over the workers with no affinity, so a
+    follow-up request must not depend on memory of the worker that served
+    the first one. Paging cursors are sealed tokens that carry their
+    search and position; the worker that issued one keeps its connection
+    parked for a fast resume, and any other worker replays the search up
+    to that position. Per-process state that can't be carried like this
+    has to live in shared storage or be kept to a single worker.
+
+    ``kill -HUP`` replaces the workers gracefully; since the code is
+    preloaded, deploy new code with ``USR2`` followed by ``QUIT`` on the
+    old master.
+    """
+
+    def __init__(self, app, options=None):
+        self.application = app
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def run_server():
+    from .app import app
+    from .config_cache import config_cache
+
+    # Load domains once so every worker starts with a warm copy
+    config_cache.list_domains()
+
+    options = {
+        'bind': SERVER_BIND,
+        'workers': SERVER_WORKERS,
+        'threads': SERVER_THREADS,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': SERVER_TIMEOUT,
+        'graceful_timeout': SERVER_GRACEFUL_TIMEOUT,
+        # Longer than the proxy's upstream keep-alive so it closes first
+        'keepalive': SERVER_KEEPALIVE,
+        'backlog': SERVER_BACKLOG,
+        'max_requests': SERVER_MAX_REQUESTS,
+        'max_requests_jitter': SERVER_MAX_REQUESTS // 10,
+        'post_worker_init': post_worker_init,
+        'child_exit': child_exit,
+        'accesslog': '-',
+    }
+    print(f"Starting {SERVER_WORKERS} worker(s) x {SERVER_THREADS} thread(s) on {SERVER_BIND}")
+    ProductionServer(app, options).run()
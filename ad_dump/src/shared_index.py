@@ -0,0 +1,104 @@
+# ad_dump/src/shared_index.py
+import fcntl
+import os
+import pickle
+
+INDEX_DIR = os.getenv('INDEX_DIR', 'indexes')
+# How often the other workers look for a newer build, and for a builder that went away
+INDEX_POLL_INTERVAL = float(os.getenv('INDEX_POLL_INTERVAL', '5'))
+
+
+class SharedIndex:
+    """Lets one worker process build an in-memory index and the rest load it.
+
+    The first process to take ``<name>.lock`` in INDEX_DIR is the builder
+    and keeps the lock until it exits; the others keep trying it, so one
+    of them takes over. The builder pickles each domain's index to its own
+    file, replaced atomically, and the others load a file again whenever
+    it changes. Refresh requests are appended to ``<name>.refresh`` so
+    they reach the builder from whichever worker took the admin call.
+    """
+
+    def __init__(self, name, directory=INDEX_DIR):
+        self.name = name
+        self.directory = directory
+        self._lock_file = None
+        self._loaded = {}
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, self.name + suffix)
+
+    def is_builder(self):
+        if self._lock_file:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(self._path('.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def publish(self, domain_id, index):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(f'-{domain_id}.pickle')
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        stat = os.stat(path)
+        self._loaded[domain_id] = (stat.st_ino, stat.st_mtime_ns)
+
+    def withdraw(self, domain_id):
+        self._loaded.pop(domain_id, None)
+        try:
+            os.remove(self._path(f'-{domain_id}.pickle'))
+        except FileNotFoundError:
+            pass
+
+    def load_changed(self, domain_ids):
+        """Indexes published since this process last loaded them, by domain id"""
+        changed = {}
+        for domain_id in domain_ids:
+            path = self._path(f'-{domain_id}.pickle')
+            try:
+                with open(path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    version = (stat.st_ino, stat.st_mtime_ns)
+                    if self._loaded.get(domain_id) == version:
+                        continue
+                    changed[domain_id] = pickle.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                print(f"Could not load the shared {self.name} for domain {domain_id}: {e}")
+                continue
+            self._loaded[domain_id] = version
+        return changed
+
+    def request(self, full=False):
+        """Ask the builder, in whatever process it runs, to rebuild soon"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path('.refresh'), 'a') as f:
+            f.write('full\n' if full else 'refresh\n')
+
+    def take_request(self):
+        """None if nothing was asked for since the last call, else whether a full rebuild was"""
+        path = self._path('.refresh')
+        taken = f'{path}.{os.getpid()}'
+        try:
+            os.rename(path, taken)
+        except FileNotFoundError:
+            return None
+        with open(taken) as f:
+            requests = f.read().split()
+        os.remove(taken)
+        return 'full' in requests
+
+    def _after_fork(self):
+        # The lock belongs to the process that took it; a child starts over
+        if self._lock_file:
+            self._lock_file.close()
+        self._lock_file = None
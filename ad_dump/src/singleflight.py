@@ -0,0 +1,65 @@
+# ad_dump/src/singleflight.py
+import os
+import threading
+
+SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+# How long a caller waits on someone else's identical search before running its own
+SINGLEFLIGHT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_TIMEOUT', '30'))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    """Run a function once for concurrent callers that ask for the same key.
+
+    The first caller (the leader) runs it; callers arriving while it is in
+    flight wait for its result instead of repeating the work. Only a
+    successful result is shared. If the leader raises, or does not finish
+    within a follower's timeout, that follower runs the function itself,
+    so one caller's error or slow request never becomes another's.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=SINGLEFLIGHT_TIMEOUT):
+        """Return (result, shared); ``shared`` is True when another caller ran fn"""
+        if not SINGLEFLIGHT_ENABLED:
+            return fn(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result, False
+            except BaseException:
+                call.failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+
+        if call.done.wait(max(0, timeout)) and not call.failed:
+            return call.result, True
+        return fn(), False
+
+    def _after_fork(self):
+        # Leaders in the parent never finish in the child
+        self._calls = {}
+        self._lock = threading.Lock()
+
+
+search_flights = SingleFlight()
+os.register_at_fork(after_in_child=search_flights._after_fork)
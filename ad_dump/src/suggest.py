@@ -0,0 +1,202 @@
+# ad_dump/src/suggest.py
+import bisect
+import heapq
+import os
+import threading
+import time
+from array import array
+
+from .config_cache import config_cache
+from .ldap_pool import ldap_pool
+from .ldap_search import iter_search_ldap
+from .metrics import timed
+from .mirror import directory_mirror, MIRROR_ENABLED
+from .shared_index import SharedIndex, INDEX_POLL_INTERVAL
+
+SUGGEST_ENABLED = os.getenv('SUGGEST_ENABLED', 'true').lower() == 'true'
+SUGGEST_REFRESH_INTERVAL = float(os.getenv('SUGGEST_REFRESH_INTERVAL', '900'))
+# Sooner retry after a failed build, so one bad pull does not leave a domain without suggestions
+SUGGEST_RETRY_INTERVAL = 60
+SUGGEST_MAX_LIMIT = 50
+# Keys examined per query. Short prefixes match huge ranges, and the keys
+# nearest the prefix (exact and shortest matches) sort first anyway.
+SUGGEST_SCAN_LIMIT = int(os.getenv('SUGGEST_SCAN_LIMIT', '2000'))
+
+SUGGEST_FILTER = '(|(objectClass=user)(objectClass=group))'
+SUGGEST_ATTRIBUTES = ['name', 'sAMAccountName', 'mail', 'objectClass']
+
+USER, GROUP = 0, 1
+KINDS = {'users': USER, 'groups': GROUP}
+# How a key relates to its entry; lower ranks first
+NAME_KEY, ACCOUNT_KEY, WORD_KEY, MAIL_KEY = 0, 1, 2, 3
+
+
+class PrefixIndex:
+    """Sorted, lowercased keys pointing at a flat list of entries.
+
+    A prefix lookup is a bisect into the key list followed by a short
+    forward scan, so a query costs the same whatever the directory size.
+    Each entry is indexed under its name, every later word of its name
+    (so "smi" finds "John Smith"), its sAMAccountName and its mail.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries  # (kind, dn, name, sAMAccountName, mail)
+        pairs = []
+        for entry_id, (kind, dn, name, sam, mail) in enumerate(entries):
+            name_key = name.lower()
+            pairs.append((name_key, entry_id, NAME_KEY))
+            for word in name_key.split()[1:]:
+                pairs.append((word, entry_id, WORD_KEY))
+            if sam:
+                pairs.append((sam.lower(), entry_id, ACCOUNT_KEY))
+            if mail:
+                pairs.append((mail.lower(), entry_id, MAIL_KEY))
+        pairs.sort()
+        self.keys = [key for key, _, _ in pairs]
+        self.ids = array('I', (entry_id for _, entry_id, _ in pairs))
+        self.key_types = array('B', (key_type for _, _, key_type in pairs))
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def suggest(self, query, limit=10, kind=None):
+        query = query.strip().lower()
+        if not query:
+            return []
+        best = {}
+        start = bisect.bisect_left(self.keys, query)
+        for i in range(start, min(start + SUGGEST_SCAN_LIMIT, len(self.keys))):
+            key = self.keys[i]
+            if not key.startswith(query):
+                break
+            entry_id = self.ids[i]
+            if kind is not None and self.entries[entry_id][0] != kind:
+                continue
+            rank = (key != query, self.key_types[i], len(key))
+            if entry_id not in best or rank < best[entry_id]:
+                best[entry_id] = rank
+
+        top = heapq.nsmallest(limit, best.items(),
+                              key=lambda item: (item[1], self.entries[item[0]][2].lower()))
+        return [self._format(self.entries[entry_id]) for entry_id, _ in top]
+
+    def _format(self, entry):
+        kind, dn, name, sam, mail = entry
+        return {
+            "id": dn,
+            "name": name,
+            "type": 'group' if kind == GROUP else 'user',
+            "samAccountName": sam,
+            "email": mail,
+        }
+
+
+def _text(values):
+    return values[0].decode('utf-8', 'replace') if values else None
+
+
+class SuggestIndex:
+    """Per-domain prefix indexes for /suggest, rebuilt in the background.
+
+    Each build is a full paged pull of names and account names (or a read
+    of the local mirror when it is current), swapped in whole, so queries
+    never see a half-built index. Only one worker process builds; the
+    others load its builds through a SharedIndex.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._shared = SharedIndex('suggest')
+
+    def get(self, domain_id):
+        return self._indexes.get(domain_id)
+
+    def _entries_from_ldap(self, domain):
+        entries = []
+        ldap_conn = ldap_pool.acquire(domain)
+        broken = True
+        try:
+            for dn, attrs in iter_search_ldap(ldap_conn, SUGGEST_FILTER, SUGGEST_ATTRIBUTES, domain['base_dn']):
+                name = _text(attrs.get('name')) if dn else None
+                if not name:
+                    continue
+                kind = GROUP if b'group' in [c.lower() for c in attrs.get('objectClass', [])] else USER
+                entries.append((kind, dn, name, _text(attrs.get('sAMAccountName')), _text(attrs.get('mail'))))
+            broken = False
+        finally:
+            ldap_pool.release(ldap_conn, broken)
+        return entries
+
+    def _entries_from_mirror(self, domain_id):
+        return [(GROUP if kind == 'group' else USER, dn, data['name'], data.get('samAccountName'), data.get('email'))
+                for kind, dn, data in directory_mirror.entries(domain_id)]
+
+    def build(self, domain):
+        with timed('suggest_build', domain['id']):
+            if MIRROR_ENABLED and directory_mirror.is_fresh(domain['id']):
+                entries = self._entries_from_mirror(domain['id'])
+            else:
+                entries = self._entries_from_ldap(domain)
+            index = PrefixIndex(entries)
+        self._indexes[domain['id']] = index
+        self._shared.publish(domain['id'], index)
+        print(f"Suggest index for domain {domain['id']}: {len(index)} entries")
+
+    def refresh_all(self):
+        domains = config_cache.list_domains()
+        active = {domain['id'] for domain in domains}
+        for domain_id in list(self._indexes):
+            if domain_id not in active:
+                self._indexes.pop(domain_id, None)
+                self._shared.withdraw(domain_id)
+        ok = True
+        for domain in domains:
+            try:
+                self.build(domain)
+            except Exception as e:
+                print(f"Suggest index build for domain {domain['id']} failed: {e}")
+                ok = False
+        return ok
+
+    def _load_shared(self):
+        active = {domain['id'] for domain in config_cache.list_domains()}
+        for domain_id in list(self._indexes):
+            if domain_id not in active:
+                self._indexes.pop(domain_id, None)
+        self._indexes.update(self._shared.load_changed(active))
+
+    def request_refresh(self):
+        self._shared.request()
+        self._wake.set()
+
+    def _run(self):
+        next_build = 0
+        while True:
+            self._wake.clear()
+            if not self._shared.is_builder():
+                self._load_shared()
+            elif self._shared.take_request() is not None or time.monotonic() >= next_build:
+                ok = self.refresh_all()
+                next_build = time.monotonic() + (SUGGEST_REFRESH_INTERVAL if ok else
+                                                 min(SUGGEST_RETRY_INTERVAL, SUGGEST_REFRESH_INTERVAL))
+            self._wake.wait(INDEX_POLL_INTERVAL)
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='suggest-index', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # The builder thread stays behind in the parent
+        self._thread = None
+        self._wake = threading.Event()
+        self._shared._after_fork()
+
+
+suggest_index = SuggestIndex()
+os.register_at_fork(after_in_child=suggest_index._after_fork)
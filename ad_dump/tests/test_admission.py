@@ -0,0 +1,67 @@
+"""Admission limits in one worker.
+
+Run from ad_dump/: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'bench', 'fakeldap'))
+sys.path.insert(1, os.path.join(HERE, '..'))
+os.environ.setdefault('ENCRYPTION_KEY', 'S2ycmE5DJQEHhVJ8IMHzN9VQnhlf3KBwc4EMkeVvOTg=')
+
+from src import admission  # noqa: E402
+from src.admission import AdmissionController, Rejected, CHEAP  # noqa: E402
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Turn every limit off and no waiting; tests switch on what they need"""
+    for name in ('ADMISSION_KEY_CONCURRENCY', 'ADMISSION_DOMAIN_CONCURRENCY', 'ADMISSION_KEY_RATE',
+                 'ADMISSION_DOMAIN_RATE', 'ADMISSION_MAX_WAIT'):
+        monkeypatch.setattr(admission, name, 0)
+
+    def set_limits(**values):
+        for name, value in values.items():
+            monkeypatch.setattr(admission, name, value)
+    return set_limits
+
+
+def test_concurrency_rejection_gives_tokens_back(limits):
+    limits(ADMISSION_KEY_CONCURRENCY=1, ADMISSION_KEY_RATE=0.001, ADMISSION_KEY_BURST=2)
+    controller = AdmissionController()
+    release = controller.admit('key', ['1'], CHEAP)
+    with pytest.raises(Rejected) as rejected:
+        controller.admit('key', ['1'], CHEAP)
+    assert rejected.value.reason == 'concurrency'
+    release()
+    # The rejected request's token is back, so this one isn't rate limited
+    controller.admit('key', ['1'], CHEAP)()
+    with pytest.raises(Rejected) as rejected:
+        controller.admit('key', ['1'], CHEAP)
+    assert rejected.value.reason == 'rate'
+
+
+def test_a_later_bucket_rejection_refunds_the_earlier_ones(limits):
+    limits(ADMISSION_KEY_RATE=0.001, ADMISSION_KEY_BURST=2, ADMISSION_DOMAIN_RATE=0.001, ADMISSION_DOMAIN_BURST=1)
+    controller = AdmissionController()
+    controller.admit('key', ['1'], CHEAP)()
+    with pytest.raises(Rejected) as rejected:
+        controller.admit('key', ['1'], CHEAP)
+    assert rejected.value.scope == 'domain'
+    controller.admit('key', ['2'], CHEAP)()
+    with pytest.raises(Rejected) as rejected:
+        controller.admit('key', ['3'], CHEAP)
+    assert rejected.value.scope == 'key'
+
+
+def test_weight_is_charged_to_each_domain(limits):
+    limits(ADMISSION_DOMAIN_RATE=0.001, ADMISSION_DOMAIN_BURST=5)
+    controller = AdmissionController()
+    controller.admit('key', ['1', '2'], CHEAP, weight=3)()
+    controller.admit('key', ['2'], CHEAP, weight=2)()
+    with pytest.raises(Rejected) as rejected:
+        controller.admit('key', ['1', '2'], CHEAP)
+    assert (rejected.value.scope, rejected.value.reason) == ('domain', 'rate')
@@ -0,0 +1,92 @@
+"""Paging cursors against the bench's fake directory.
+
+Run from ad_dump/: python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'bench', 'fakeldap'))
+sys.path.insert(1, os.path.join(HERE, '..'))
+os.environ.setdefault('ENCRYPTION_KEY', 'S2ycmE5DJQEHhVJ8IMHzN9VQnhlf3KBwc4EMkeVvOTg=')
+os.environ.setdefault('API_KEY', 'test')
+os.environ.setdefault('RESPONSE_CACHE_TYPE', 'NullCache')
+
+from src import cursors  # noqa: E402
+from src.cursors import CursorStore, SearchCursor  # noqa: E402
+
+URL = '/search?query=a&type=users&precise=false&match=contains'
+HEADERS = {'X-API-Key': os.environ['API_KEY']}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import ldap
+    from bench.dataset import BASE_DN, generate
+    from src import admission
+    from src.config_cache import config_cache
+    from src.database import init_db, get_db, encrypt_password
+
+    generate(ldap.directory, 300, seed=1)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(admission, 'ADMISSION_ENABLED', False)
+    monkeypatch.setattr(config_cache, '_version', None)
+    init_db()
+    with get_db() as db:
+        db.execute('INSERT INTO domains (name, server, base_dn, username, password) VALUES (?, ?, ?, ?, ?)',
+                   ('bench', 'ldap://bench.invalid', BASE_DN, 'bench', encrypt_password('bench')))
+        db.commit()
+        config_cache.bump(db)
+
+    from src.app import app
+    return app.test_client()
+
+
+def walk(client, elsewhere):
+    """Every entry's DN, page by page; ``elsewhere`` makes each resume replay as another worker would"""
+    page = client.get(URL + '&limit=40', headers=HEADERS).get_json()
+    dns = []
+    while True:
+        dns += [entry['id'] for entry in page['data']]
+        if not page['next_cursor']:
+            return dns
+        if elsewhere:
+            for cursor in list(cursors.cursor_store._cursors.values()):
+                cursor.expires = 0
+        response = client.get(URL + '&cursor=' + page['next_cursor'], headers=HEADERS)
+        assert response.status_code == 200
+        page = response.get_json()
+
+
+def test_replayed_cursor_resumes_where_the_page_ended(client, monkeypatch):
+    from src import app
+
+    replays = []
+    replay_search = app.replay_search
+    monkeypatch.setattr(app, 'replay_search', lambda *args: replays.append(args) or replay_search(*args))
+    everything = [entry['id'] for entry in client.get(URL, headers=HEADERS).get_json()['data']]
+    assert len(everything) > 80
+    assert walk(client, elsewhere=False) == everything
+    assert not replays
+    assert walk(client, elsewhere=True) == everything
+    assert len(replays) == (len(everything) - 1) // 40
+
+
+def test_sweeper_closes_expired_cursors(monkeypatch):
+    closed = []
+    store = CursorStore()
+    monkeypatch.setattr(cursors, 'CURSOR_SWEEP_INTERVAL', 0.01)
+    monkeypatch.setattr(store, '_close', closed.append)
+    cursor = SearchCursor(None, 1, 'users', '(objectClass=user)', [], None, '', 10, b'cookie')
+    store.open(cursor)
+    cursor.expires = 0
+    store.start()
+    for _ in range(100):
+        if closed:
+            break
+        time.sleep(0.01)
+    assert closed == [cursor]
+    assert store._cursors == {}
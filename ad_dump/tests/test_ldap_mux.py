@@ -0,0 +1,76 @@
+"""Shared-connection searches against the bench's fake directory.
+
+Run from ad_dump/: python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'bench', 'fakeldap'))
+sys.path.insert(1, os.path.join(HERE, '..'))
+os.environ.setdefault('ENCRYPTION_KEY', 'S2ycmE5DJQEHhVJ8IMHzN9VQnhlf3KBwc4EMkeVvOTg=')
+
+import ldap  # noqa: E402
+
+from bench.dataset import BASE_DN, generate  # noqa: E402
+from src import ldap_mux as ldap_mux_module, ldap_search  # noqa: E402
+from src.database import encrypt_password  # noqa: E402
+from src.ldap_mux import ldap_mux  # noqa: E402
+from src.ldap_pool import ldap_pool  # noqa: E402
+
+USER_FILTER = '(objectClass=user)'
+
+
+@pytest.fixture(scope='module')
+def domain():
+    generate(ldap.directory, 200, seed=1)
+    domain = {'id': 1, 'name': 'bench', 'server': 'ldap://bench.invalid', 'base_dn': BASE_DN,
+              'username': 'bench', 'password': encrypt_password('bench')}
+    # Bind once while the directory still answers, so the tests below get a pooled connection
+    ldap_pool.release(ldap_pool.acquire(domain))
+    return domain
+
+
+@pytest.fixture
+def silent_dc(monkeypatch):
+    """A DC that takes every search and never sends a result"""
+    monkeypatch.setattr(ldap_mux_module, 'OPERATION_TIMEOUT', 0.5)
+    monkeypatch.setattr(ldap, 'LATENCY', 3600)
+
+
+def leased():
+    time.sleep(0.2)  # the poller hands connections back to the pool
+    return sum(shared.leases for peers in ldap_mux._shared.values() for shared in peers)
+
+
+def test_search_returns_every_page(domain):
+    entries, truncated = ldap_mux.search(domain, USER_FILTER, ['cn'], page_size=30).result(timeout=10)
+    assert len(entries) == len(ldap.directory.search(BASE_DN, ldap.SCOPE_SUBTREE, USER_FILTER))
+    assert not truncated
+    assert leased() == 0
+
+
+def test_search_times_out_when_the_dc_never_answers(domain, silent_dc):
+    started = time.monotonic()
+    future = ldap_mux.search(domain, USER_FILTER, ['cn'])
+    with pytest.raises(ldap.TIMEOUT):
+        future.result(timeout=10)
+    assert time.monotonic() - started < 5
+    assert leased() == 0
+
+
+def test_iter_pages_times_out_when_the_dc_never_answers(domain, silent_dc):
+    with pytest.raises(ldap.TIMEOUT):
+        for _ in ldap_mux.iter_pages(domain, USER_FILTER, ['cn']):
+            pass
+    assert leased() == 0
+
+
+def test_search_domain_reports_the_timeout(domain, silent_dc, monkeypatch):
+    monkeypatch.setattr(ldap_search, 'LDAP_MUX_ENABLED', True)
+    result = ldap_search.search_domain(domain, USER_FILTER, ['cn'])
+    assert result["status"] == "error"
+    assert leased() == 0
@@ -0,0 +1,45 @@
+"""Connection pool behaviour against the bench's fake directory.
+
+Run from ad_dump/: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'bench', 'fakeldap'))
+sys.path.insert(1, os.path.join(HERE, '..'))
+os.environ.setdefault('ENCRYPTION_KEY', 'S2ycmE5DJQEHhVJ8IMHzN9VQnhlf3KBwc4EMkeVvOTg=')
+
+from src.ldap_pool import DomainPool  # noqa: E402
+
+SERVER = 'ldap://bench.invalid'
+
+
+def test_probe_ends_when_the_password_will_not_decrypt():
+    pool = DomainPool({'id': 1, 'server': SERVER, 'username': 'bench', 'password': 'not a token'})
+    assert pool.selector.due_probes() == [SERVER]
+    with pytest.raises(Exception):
+        pool._probe(SERVER)
+    assert not pool.selector._servers[SERVER].probing
+
+
+def test_request_errors_do_not_count_against_the_dc():
+    import ldap
+    from bench.dataset import BASE_DN, generate
+    from src.database import encrypt_password
+    from src.ldap_pool import ldap_pool
+    from src.ldap_search import search_domain
+
+    generate(ldap.directory, 50, seed=1)
+    domain = {'id': 7, 'name': 'bench', 'server': SERVER, 'base_dn': BASE_DN,
+              'username': 'bench', 'password': encrypt_password('bench')}
+    for _ in range(5):
+        assert search_domain(domain, 'objectClass=user', ['cn'])["status"] == "error"
+    assert ldap_pool.server_status(7)[0]["failures"] == 0
+
+    conn = ldap_pool.acquire(domain)
+    ldap_pool.record_error(conn, ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"}))
+    ldap_pool.release(conn, broken=True)
+    assert ldap_pool.server_status(7)[0]["failures"] == 1
@@ -0,0 +1,52 @@
+"""Search filters chosen by the query planner.
+
+Run from ad_dump/: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'bench', 'fakeldap'))
+sys.path.insert(1, os.path.join(HERE, '..'))
+os.environ.setdefault('ENCRYPTION_KEY', 'S2ycmE5DJQEHhVJ8IMHzN9VQnhlf3KBwc4EMkeVvOTg=')
+
+from src.ldap_search import plan_search  # noqa: E402
+
+
+@pytest.mark.parametrize('query, search_type, strategy, search_filter', [
+    ('Lisa Kowalski', 'users', 'anr', '(&(objectClass=user)(anr=Lisa Kowalski))'),
+    (" O'Brien ", 'users', 'anr', "(&(objectClass=user)(anr=O'Brien))"),
+    ('lisa.kowalski@bench.example.com', 'users', 'email',
+     '(&(objectClass=user)(|(mail=lisa.kowalski@bench.example.com)'
+     '(userPrincipalName=lisa.kowalski@bench.example.com)))'),
+    ('004217', 'users', 'employee_id', '(&(objectClass=user)(|(employeeID=004217)(sAMAccountName=004217)))'),
+    ('lkowalski5', 'users', 'prefix',
+     '(&(objectClass=user)(|(name=lkowalski5*)(mail=lkowalski5*)(sAMAccountName=lkowalski5*)'
+     '(userPrincipalName=lkowalski5*)))'),
+    ('Finance', 'groups', 'anr', '(&(objectClass=group)(anr=Finance))'),
+    ('app-*(x)', 'groups', 'prefix', r'(&(objectClass=group)(|(name=app-\2a\28x\29*)(sAMAccountName=app-\2a\28x\29*)))'),
+])
+def test_fuzzy_searches_avoid_medial_wildcards(query, search_type, strategy, search_filter):
+    plan = plan_search(query, search_type, is_precise=False)
+    assert (plan.strategy, plan.filter) == (strategy, search_filter)
+    assert '=*' not in plan.filter
+
+
+def test_match_mode_overrides_the_query_shape():
+    assert plan_search('Lisa', 'users', False, match='prefix').filter == (
+        '(&(objectClass=user)(|(name=Lisa*)(mail=Lisa*)(sAMAccountName=Lisa*)(userPrincipalName=Lisa*)))')
+    assert plan_search('Lisa', 'groups', False, match='contains').filter == (
+        '(&(objectClass=group)(|(name=*Lisa*)(description=*Lisa*)))')
+    with pytest.raises(ValueError):
+        plan_search('Lisa', 'users', False, match='regex')
+
+
+def test_precise_searches_match_identifiers_exactly():
+    assert plan_search('john.smith', 'users', True).filter == (
+        '(&(objectClass=user)(|(sAMAccountName=john.smith)(userPrincipalName=john.smith)(employeeID=john.smith)))')
+    assert plan_search('jsmith', 'users', True, search_by='sAMAccountName').filter == (
+        '(&(objectClass=user)(sAMAccountName=jsmith))')
+    assert plan_search('Finance', 'groups', True).filter == '(&(objectClass=group)(sAMAccountName=Finance))'
+    assert plan_search('Finance', 'computers', True) is None
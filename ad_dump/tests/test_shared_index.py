@@ -0,0 +1,48 @@
+"""One worker builds an index, the others load it.
+
+Run from ad_dump/: python -m pytest tests
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from src.shared_index import SharedIndex  # noqa: E402
+
+
+def test_only_one_builder(tmp_path):
+    builder, other = SharedIndex('test', str(tmp_path)), SharedIndex('test', str(tmp_path))
+    assert builder.is_builder()
+    assert not other.is_builder()
+    builder._lock_file.close()  # the builder's worker exits
+    assert other.is_builder()
+
+
+def test_others_load_each_build_once(tmp_path):
+    builder, other = SharedIndex('test', str(tmp_path)), SharedIndex('test', str(tmp_path))
+    assert other.load_changed([1]) == {}
+    builder.publish(1, {'built': 1})
+    assert other.load_changed([1, 2]) == {1: {'built': 1}}
+    assert other.load_changed([1, 2]) == {}
+    builder.publish(1, {'built': 2})
+    assert other.load_changed([1]) == {1: {'built': 2}}
+    builder.withdraw(1)
+    assert other.load_changed([1]) == {}
+
+
+def test_refresh_requests_reach_the_builder(tmp_path):
+    builder, other = SharedIndex('test', str(tmp_path)), SharedIndex('test', str(tmp_path))
+    assert builder.take_request() is None
+    other.request()
+    assert builder.take_request() is False
+    other.request()
+    other.request(full=True)
+    assert builder.take_request() is True
+    assert builder.take_request() is None
+
+
+def test_publish_creates_the_directory(tmp_path):
+    directory = str(tmp_path / 'fresh')
+    SharedIndex('test', directory).publish(1, {'built': 1})
+    assert SharedIndex('test', directory).load_changed([1]) == {1: {'built': 1}}
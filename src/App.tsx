@@ -9,11 +9,11 @@ import { UserDetails } from '@/components/user-details';
 import { GroupGrid } from '@/components/groups/group-grid';
 import { GroupDetails } from '@/components/groups/group-details';
 import { Button } from "@/components/ui/button";
-import { searchUsers, searchGroups, getDomains, checkSetupStatus } from '@/lib/api';
+import { searchUsers, searchGroups, getDomains, checkSetupStatus, Suggestion } from '@/lib/api';
 import { useToast } from "@/hooks/use-toast"
 import { ToastProvider } from "@/components/ui/toast"
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select"
-import { Domain } from '@/lib/api';
+import { Domain, DomainSelection } from '@/lib/api';
 import { DomainManager } from '@/components/admin/domainManager';
 import { AdminAuth } from '@/components/admin/AdminAuth';
 import { FirstTimeSetup } from '@/components/admin/FirstTimeSetup';
@@ -44,7 +44,7 @@ function App() {
   const [hasSearched, setHasSearched] = useState(false);
   const { toast } = useToast()
   const [domains, setDomains] = useState<Domain[]>([]);
-  const [selectedDomainId, setSelectedDomainId] = useState<number | null>(null);
+  const [selectedDomainId, setSelectedDomainId] = useState<DomainSelection | null>(null);
   const [adminKey, setAdminKey] = useState<string | null>(null);
   const [isSetup, setIsSetup] = useState<boolean | null>(null);
   const [filteredUsers, setFilteredUsers] = useState<User[]>([]);
@@ -154,8 +154,8 @@ function App() {
     }
   }, []); // Run once on component mount
 
-  const handleSearch = async () => {
-    if (!searchQuery) {
+  const handleSearch = async (query = searchQuery, precise = isPrecise) => {
+    if (!query) {
       setUsers([]);
       setGroups([]);
       return;
@@ -167,10 +167,10 @@ function App() {
     
     try {
       if (activeTab === 'users') {
-        const data = await searchUsers(searchQuery, isPrecise, selectedDomainId || undefined);
+        const data = await searchUsers(query, precise, selectedDomainId || undefined);
         setUsers(data.data);
       } else {
-        const data = await searchGroups(searchQuery, isPrecise, selectedDomainId || undefined);
+        const data = await searchGroups(query, precise, selectedDomainId || undefined);
         setGroups(data.data);
       }
     } catch (err: unknown) {
@@ -257,6 +257,13 @@ function App() {
     }
   };
 
+  // Picking a suggestion runs an exact search for it
+  const handleSuggestionSelect = (suggestion: Suggestion) => {
+    const query = suggestion.samAccountName || suggestion.name;
+    setSearchQuery(query);
+    handleSearch(query, Boolean(suggestion.samAccountName));
+  };
+
   const handleReset = () => {
     setSearchQuery('');
     setUsers([]);
@@ -304,12 +311,15 @@ function App() {
                 <div className="flex gap-4 items-center">
                   <Select
                     value={selectedDomainId?.toString()}
-                    onValueChange={(value) => setSelectedDomainId(Number(value))}
+                    onValueChange={(value) => setSelectedDomainId(value === 'all' ? 'all' : Number(value))}
                   >
                     <SelectTrigger className="w-[200px]">
                       <SelectValue placeholder={domains.length === 0 ? "No domains configured" : "Select Domain"} />
                     </SelectTrigger>
                     <SelectContent>
+                      {domains.length > 1 && (
+                        <SelectItem value="all">All domains</SelectItem>
+                      )}
                       {domains.map((domain) => (
                         <SelectItem key={domain.id} value={domain.id.toString()}>
                           {domain.name}
@@ -326,6 +336,9 @@ function App() {
                       placeholder={`Search ${activeTab}...`}
                       isPrecise={isPrecise}
                       onPreciseChange={setIsPrecise}
+                      suggestionType={activeTab === 'groups' ? 'groups' : 'users'}
+                      domainId={typeof selectedDomainId === 'number' ? selectedDomainId : undefined}
+                      onSuggestionSelect={selectedDomainId === 'all' ? undefined : handleSuggestionSelect}
                     />
                   </div>
 
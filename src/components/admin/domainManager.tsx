@@ -246,6 +246,7 @@ export function DomainManager({ adminKey, onDomainChange }: DomainManagerProps)
                     <TooltipContent>
                       <p>LDAP server address with protocol and port</p>
                       <p>Example: "ldap://10.3.10.11:389"</p>
+                      <p>Separate several domain controllers with commas, or use "srv:_ldap._tcp.example.com"</p>
                     </TooltipContent>
                   </Tooltip>
                 </TooltipProvider>
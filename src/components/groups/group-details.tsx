@@ -38,6 +38,9 @@ import {
   TableRow,
 } from "@/components/ui/table";
 
+// Members are fetched a page at a time; more are loaded on demand
+const MEMBERS_PAGE_SIZE = 200;
+
 interface GroupDetailsProps {
   group: Group | null;
   open: boolean;
@@ -141,21 +144,26 @@ export function GroupDetails({
   const [viewMode, setViewMode] = useState<'grid' | 'table'>('grid');
   const [isLoadingMembers, setIsLoadingMembers] = useState(false);
   const [loadingProgress, setLoadingProgress] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const [includeNested, setIncludeNested] = useState(false);
 
   useEffect(() => {
     setGroup(initialGroup);
     setShowMembers(false);
+    setNextCursor(null);
+    setIncludeNested(false);
   }, [initialGroup]);
 
   useEffect(() => {
     if (open && initialGroup?.id) {
-      getGroupDetails(initialGroup.id)
+      getGroupDetails(initialGroup.id, initialGroup.domain_id)
         .then(data => {
           setGroup(data);
           if (data.id) {
             setIsLoadingMembers(true);
             setLoadingProgress("Fetching group members...");
-            return searchGroupMembers(data.id);
+            return searchGroupMembers(data.id, { limit: MEMBERS_PAGE_SIZE }, false, data.domain_id);
           }
         })
         .then(response => {
@@ -164,6 +172,7 @@ export function GroupDetails({
               member => member.name && member.name !== 'N/A'
             );
             setMembers(validMembers);
+            setNextCursor(response.next_cursor ?? null);
             setIsLoadingMembers(false);
             setLoadingProgress(null);
           }
@@ -174,7 +183,57 @@ export function GroupDetails({
           setLoadingProgress(null);
         });
     }
-  }, [open, initialGroup?.id]);
+  }, [open, initialGroup?.id, initialGroup?.domain_id]);
+
+  const loadMoreMembers = async () => {
+    if (!group?.id || !nextCursor) return;
+
+    setIsLoadingMore(true);
+    try {
+      const response = await searchGroupMembers(group.id, { cursor: nextCursor }, includeNested, group.domain_id);
+      const validMembers = (response.data || []).filter(
+        member => member.name && member.name !== 'N/A'
+      );
+      setMembers(prev => [...prev, ...validMembers]);
+      setNextCursor(response.next_cursor ?? null);
+    } catch (error) {
+      console.error('Failed to fetch more members:', error);
+      // Cursors expire after a short idle period; fall back to a fresh first page
+      setNextCursor(null);
+      toast({
+        variant: "destructive",
+        title: "Could not load more members",
+        description: "Please reopen the group to try again",
+      });
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  const toggleNestedMembers = async () => {
+    if (!group?.id) return;
+
+    const transitive = !includeNested;
+    setIncludeNested(transitive);
+    setIsLoadingMembers(true);
+    try {
+      // Cursors remember the filter, so "Load more" keeps the same mode
+      const response = await searchGroupMembers(group.id, { limit: MEMBERS_PAGE_SIZE }, transitive, group.domain_id);
+      setMembers((response.data || []).filter(
+        member => member.name && member.name !== 'N/A'
+      ));
+      setNextCursor(response.next_cursor ?? null);
+    } catch (error) {
+      console.error('Failed to fetch group members:', error);
+      toast({
+        variant: "destructive",
+        title: "Could not load members",
+        description: "Please try again",
+      });
+    } finally {
+      setIsLoadingMembers(false);
+    }
+  };
 
   const handleUserSelect = (user: User) => {
     if (onUserSelect) {
@@ -297,9 +356,19 @@ export function GroupDetails({
               <ChevronRight className="h-4 w-4 text-muted-foreground" />
               <span className="font-medium">{group?.name} Members</span>
             </div>
-            <p className="text-sm text-muted-foreground">
-              Showing {members.length} members
-            </p>
+            <div className="flex items-center justify-between">
+              <p className="text-sm text-muted-foreground">
+                Showing {members.length}{nextCursor ? '+' : ''}{includeNested ? ' direct and nested' : ''} members
+              </p>
+              <Button
+                variant="ghost"
+                size="sm"
+                onClick={toggleNestedMembers}
+                disabled={isLoadingMembers}
+              >
+                {includeNested ? 'Direct only' : 'Include nested'}
+              </Button>
+            </div>
           </DialogHeader>
 
           <div className="mt-6 grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
@@ -328,6 +397,18 @@ export function GroupDetails({
               </div>
             ))}
           </div>
+
+          {nextCursor && (
+            <div className="mt-6 flex justify-center">
+              <Button
+                variant="outline"
+                onClick={loadMoreMembers}
+                disabled={isLoadingMore}
+              >
+                {isLoadingMore ? "Loading..." : "Load more members"}
+              </Button>
+            </div>
+          )}
         </DialogContent>
       </Dialog>
     );
@@ -448,7 +529,9 @@ export function GroupDetails({
                   </>
                 )}
                 <Badge variant="secondary">
-                  {isLoadingMembers ? "Loading..." : `${members.filter(m => m.name).length} total`}
+                  {isLoadingMembers ? "Loading..." : nextCursor && group.memberCount != null && !includeNested
+                    ? `${members.filter(m => m.name).length} of ${group.memberCount}`
+                    : `${members.filter(m => m.name).length}${nextCursor ? '+' : ''} total`}
                 </Badge>
               </div>
             </div>
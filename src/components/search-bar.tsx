@@ -1,5 +1,6 @@
+import { useEffect, useState } from 'react';
 import { Input } from '@/components/ui/input';
-import { Search, Target } from 'lucide-react';
+import { Search, Target, User, UsersRound } from 'lucide-react';
 import { Toggle } from '@/components/ui/toggle';
 import { cn } from '@/lib/utils';
 import { Button } from '@/components/ui/button';
@@ -9,6 +10,10 @@ import {
   TooltipProvider,
   TooltipTrigger,
 } from "@/components/ui/tooltip";
+import { getSuggestions, Suggestion } from '@/lib/api';
+
+// Wait for a pause in typing before asking for suggestions
+const SUGGEST_DELAY_MS = 120;
 
 interface SearchBarProps {
   value: string;
@@ -18,6 +23,9 @@ interface SearchBarProps {
   className?: string;
   isPrecise: boolean;
   onPreciseChange: (precise: boolean) => void;
+  suggestionType?: 'users' | 'groups';
+  domainId?: number;
+  onSuggestionSelect?: (suggestion: Suggestion) => void;
 }
 
 export function SearchBar({ 
@@ -27,8 +35,38 @@ export function SearchBar({
   placeholder = "Search...", 
   className,
   isPrecise,
-  onPreciseChange 
+  onPreciseChange,
+  suggestionType,
+  domainId,
+  onSuggestionSelect
 }: SearchBarProps) {
+  const [suggestions, setSuggestions] = useState<Suggestion[]>([]);
+  const [showSuggestions, setShowSuggestions] = useState(false);
+
+  const suggestionsEnabled = Boolean(suggestionType && onSuggestionSelect);
+
+  useEffect(() => {
+    if (!suggestionsEnabled || !suggestionType || !value.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    const timer = setTimeout(() => {
+      getSuggestions(value, suggestionType, domainId, controller.signal)
+        .then(setSuggestions)
+        .catch(() => setSuggestions([]));
+    }, SUGGEST_DELAY_MS);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [value, suggestionType, domainId, suggestionsEnabled]);
+
+  const selectSuggestion = (suggestion: Suggestion) => {
+    setShowSuggestions(false);
+    onSuggestionSelect?.(suggestion);
+  };
+
   return (
     <div className="relative w-full flex gap-3 items-center">
       <div className="relative flex-1">
@@ -38,8 +76,19 @@ export function SearchBar({
         <Input
           placeholder={placeholder}
           value={value}
-          onChange={(e) => onChange(e.target.value)}
-          onKeyDown={(e) => e.key === 'Enter' && onSearch()}
+          onChange={(e) => {
+            onChange(e.target.value);
+            setShowSuggestions(true);
+          }}
+          onKeyDown={(e) => {
+            if (e.key === 'Enter') {
+              setShowSuggestions(false);
+              onSearch();
+            } else if (e.key === 'Escape') {
+              setShowSuggestions(false);
+            }
+          }}
+          onBlur={() => setShowSuggestions(false)}
           className="w-full pl-10 h-12 text-base bg-background/50 backdrop-blur-sm pr-24"
         />
         <div className="absolute right-2 top-1/2 -translate-y-1/2">
@@ -69,10 +118,37 @@ export function SearchBar({
             </Tooltip>
           </TooltipProvider>
         </div>
+        {showSuggestions && suggestions.length > 0 && (
+          <ul className="absolute left-0 top-full z-50 mt-1 w-full overflow-hidden rounded-md border bg-popover text-popover-foreground shadow-md">
+            {suggestions.map((suggestion) => (
+              <li key={suggestion.id}>
+                <button
+                  type="button"
+                  // Fire before the input's blur hides the list
+                  onMouseDown={(e) => {
+                    e.preventDefault();
+                    selectSuggestion(suggestion);
+                  }}
+                  className="flex w-full items-center gap-2 px-3 py-2 text-left text-sm hover:bg-accent hover:text-accent-foreground"
+                >
+                  {suggestion.type === 'group' ? (
+                    <UsersRound className="h-4 w-4 text-muted-foreground" />
+                  ) : (
+                    <User className="h-4 w-4 text-muted-foreground" />
+                  )}
+                  <span className="font-medium">{suggestion.name}</span>
+                  <span className="truncate text-muted-foreground">
+                    {suggestion.email || suggestion.samAccountName}
+                  </span>
+                </button>
+              </li>
+            ))}
+          </ul>
+        )}
       </div>
       
       <Button 
-        onClick={onSearch}
+        onClick={() => onSearch()}
         size="lg"
         className="h-12 px-6"
       >
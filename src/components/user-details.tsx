@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import {
   Dialog,
   DialogContent,
@@ -25,7 +25,7 @@ import {
   ChevronRight,
   Share2
 } from 'lucide-react';
-import { searchGroupMembers } from '@/lib/api';
+import { getReportingChain, getReports, getUserGroups, lookupEntries, searchGroupMembers, OrgPerson } from '@/lib/api';
 import { User } from '@/types/user';
 import { useToast } from "@/hooks/use-toast"
 import { Button } from "@/components/ui/button";
@@ -128,10 +128,84 @@ export function UserDetails({
   onReturnToGroup 
 }: UserDetailsProps) {
   const [groupView, setGroupView] = useState<{ name: string; users: User[] } | null>(null);
+  const [effectiveGroups, setEffectiveGroups] = useState<string[] | null>(null);
+  const [isLoadingGroups, setIsLoadingGroups] = useState(false);
+  const [managerChain, setManagerChain] = useState<OrgPerson[] | null>(null);
+  const [directReports, setDirectReports] = useState<OrgPerson[] | null>(null);
   const { toast } = useToast();
+
+  useEffect(() => {
+    setEffectiveGroups(null);
+  }, [user?.id]);
+
+  useEffect(() => {
+    setManagerChain(null);
+    setDirectReports(null);
+    if (!user) return;
+    let cancelled = false;
+    Promise.all([getReportingChain(user.id, user.domain_id), getReports(user.id, 1, user.domain_id)])
+      .then(([chain, reports]) => {
+        if (cancelled) return;
+        setManagerChain(chain);
+        setDirectReports(reports);
+      })
+      .catch((error) => console.error('Failed to load org chart:', error));
+    return () => {
+      cancelled = true;
+    };
+  }, [user?.id, user?.domain_id]);
+  
+  const toggleEffectiveGroups = async () => {
+    if (!user) return;
+    if (effectiveGroups) {
+      setEffectiveGroups(null);
+      return;
+    }
+
+    setIsLoadingGroups(true);
+    try {
+      const response = await getUserGroups(user.id, true, user.domain_id);
+      setEffectiveGroups(response.data.map(group => group.id));
+    } catch (error) {
+      console.error('Failed to fetch effective groups:', error);
+      toast({
+        variant: "destructive",
+        title: "Could not load nested groups",
+        description: "Please try again",
+      });
+    } finally {
+      setIsLoadingGroups(false);
+    }
+  };
   
   if (!user) return null;
 
+  const openPerson = async (dn: string) => {
+    try {
+      const response = await lookupEntries([dn], 'users', undefined, user.domain_id);
+      const person = response.data[dn];
+      if (person) {
+        setSelectedUser(person);
+      } else {
+        toast({
+          title: "User not found",
+          description: cleanManagerName(dn),
+        });
+      }
+    } catch (error) {
+      console.error('Failed to look up user:', error);
+      toast({
+        variant: "destructive",
+        title: "Could not load user",
+        description: "Please try again",
+      });
+    }
+  };
+
+  const openManager = () => {
+    if (user.manager) openPerson(user.manager);
+  };
+
   const handleShare = async () => {
     if (!user) return;
     
@@ -280,12 +354,24 @@ export function UserDetails({
                 )}
                 {user.memberOf && user.memberOf.length > 0 && (
                   <div className="space-y-2">
-                    <div className="flex items-center space-x-2">
-                      <Users className="h-4 w-4 text-muted-foreground" />
-                      <span className="text-sm font-medium">Group Memberships</span>
+                    <div className="flex items-center justify-between">
+                      <div className="flex items-center space-x-2">
+                        <Users className="h-4 w-4 text-muted-foreground" />
+                        <span className="text-sm font-medium">
+                          {effectiveGroups ? 'Effective Group Memberships' : 'Group Memberships'}
+                        </span>
+                      </div>
+                      <Button
+                        variant="ghost"
+                        size="sm"
+                        onClick={toggleEffectiveGroups}
+                        disabled={isLoadingGroups}
+                      >
+                        {isLoadingGroups ? 'Loading...' : effectiveGroups ? 'Direct only' : 'Include nested'}
+                      </Button>
                     </div>
                     <div className="flex flex-wrap gap-2">
-                      {user.memberOf.map((group) => (
+                      {(effectiveGroups ?? user.memberOf).map((group) => (
                         <Badge 
                           key={group} 
                           variant="outline"
@@ -301,6 +387,7 @@ export function UserDetails({
                               lastModified: '',
                               members: [],
                               owner: '',
+                              domain_id: user.domain_id,
                             };
                             
                             if (onReturnToGroup) {
@@ -327,7 +414,49 @@ export function UserDetails({
               {user.manager && (
                 <div className="flex items-center space-x-2">
                   <UserCircle className="h-4 w-4 text-muted-foreground" />
-                  <span className="text-sm">Manager: {cleanManagerName(user.manager)}</span>
+                  <span className="text-sm">
+                    Manager:{' '}
+                    <button type="button" className="underline-offset-4 hover:underline" onClick={openManager}>
+                      {cleanManagerName(user.manager)}
+                    </button>
+                  </span>
+                </div>
+              )}
+              {managerChain && managerChain.length > 1 && (
+                <div className="flex items-center space-x-2 md:col-span-2">
+                  <Users className="h-4 w-4 text-muted-foreground" />
+                  <span className="text-sm flex flex-wrap items-center gap-1">
+                    Reporting line:
+                    {[...managerChain].reverse().map((person, index) => (
+                      <span key={person.id} className="flex items-center gap-1">
+                        {index > 0 && <ChevronRight className="h-3 w-3 text-muted-foreground" />}
+                        <button type="button" className="underline-offset-4 hover:underline" onClick={() => openPerson(person.id)}>
+                          {person.name || cleanManagerName(person.id)}
+                        </button>
+                      </span>
+                    ))}
+                  </span>
+                </div>
+              )}
+              {directReports && directReports.length > 0 && (
+                <div className="space-y-2 md:col-span-2">
+                  <div className="flex items-center space-x-2">
+                    <UserCircle className="h-4 w-4 text-muted-foreground" />
+                    <span className="text-sm font-medium">Direct Reports ({directReports.length})</span>
+                  </div>
+                  <div className="flex flex-wrap gap-2">
+                    {directReports.map((person) => (
+                      <Badge
+                        key={person.id}
+                        variant="outline"
+                        className="cursor-pointer hover:bg-secondary/80 transition-colors"
+                        onClick={() => openPerson(person.id)}
+                        title={person.title || undefined}
+                      >
+                        {person.name || cleanManagerName(person.id)}
+                      </Badge>
+                    ))}
+                  </div>
                 </div>
               )}
               <div className="flex items-center space-x-2">
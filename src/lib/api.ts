@@ -18,6 +18,23 @@ class ApiError extends Error {
   }
 }
 
+function setDomainParam(params: URLSearchParams, domainId?: DomainSelection) {
+  if (domainId === 'all') {
+    params.set('domain', 'all');
+  } else if (domainId) {
+    params.set('domain_id', domainId.toString());
+  }
+}
+
+// Entries from a single-domain request don't name their domain; tag them with
+// the one asked for so follow-up calls (members, groups, org chart) stay on it
+function tagDomain<T extends { domain_id?: number }>(entries: T[], domainId?: DomainSelection): T[] {
+  if (typeof domainId !== 'number') {
+    return entries;
+  }
+  return entries.map(entry => entry.domain_id ? entry : { ...entry, domain_id: domainId });
+}
+
 // Add a helper to detect sAMAccountName format
 function isSAMAccountName(query: string): boolean {
   // SAMAccountName typically follows domain\username or just username pattern
@@ -29,8 +46,17 @@ interface SearchResponse<T> {
   data: T[];
   total_count?: number;
   truncated: boolean;
+  next_cursor?: string | null;
 }
 
+export interface PageOptions {
+  limit?: number;
+  cursor?: string;
+}
+
+// A single domain id, or every configured domain searched at once
+export type DomainSelection = number | 'all';
+
 export interface Domain {
   id: number;
   name: string;
@@ -96,7 +122,7 @@ export async function addDomain(domain: NewDomain, adminKey: string): Promise<vo
 export async function searchUsers(
   query: string, 
   precise: boolean, 
-  domainId?: number
+  domainId?: DomainSelection
 ): Promise<SearchResponse<User>> {
   try {
     const params = new URLSearchParams({
@@ -109,9 +135,7 @@ export async function searchUsers(
       params.set('searchBy', 'sAMAccountName');
     }
     
-    if (domainId) {
-      params.set('domain_id', domainId.toString());
-    }
+    setDomainParam(params, domainId);
 
     const response = await fetch(`${API_BASE_URL}/search?${params.toString()}`, {
       headers: {
@@ -122,7 +146,9 @@ export async function searchUsers(
     if (!response.ok) {
       throw new ApiError(response.status, 'Failed to fetch users');
     }
-    return response.json();
+    const data = await response.json();
+    data.data = tagDomain(data.data || [], domainId);
+    return data;
   } catch (err) {
     if (err instanceof TypeError && err.message === 'Failed to fetch') {
       throw new ApiError(undefined, 'Connection failed');
@@ -134,7 +160,7 @@ export async function searchUsers(
 export async function searchGroups(
   query: string, 
   precise: boolean,
-  domainId?: number
+  domainId?: DomainSelection
 ): Promise<SearchResponse<Group>> {
   const params = new URLSearchParams({
     query: query,
@@ -142,9 +168,7 @@ export async function searchGroups(
     precise: precise.toString()
   });
 
-  if (domainId) {
-    params.set('domain_id', domainId.toString());
-  }
+  setDomainParam(params, domainId);
 
   const response = await fetch(`${API_BASE_URL}/search?${params}`, {
     headers: {
@@ -158,7 +182,7 @@ export async function searchGroups(
   
   // Filter out invalid members before returning
   if (data.data) {
-    data.data = data.data.map((group: Group) => ({
+    data.data = tagDomain(data.data, domainId).map((group: Group) => ({
       ...group,
       members: (group.members || []).filter(member => {
         // Only count entries that look like user accounts
@@ -176,9 +200,27 @@ export async function searchGroups(
   return data;
 }
 
-export async function searchGroupMembers(groupDN: string): Promise<SearchResponse<User>> {
+export async function searchGroupMembers(
+  groupDN: string,
+  page: PageOptions = {},
+  transitive = false,
+  domainId?: number
+): Promise<SearchResponse<User>> {
   try {
-    const response = await fetch(`${API_BASE_URL}/groups/${encodeURIComponent(groupDN)}/members`, {
+    const params = new URLSearchParams();
+    setDomainParam(params, domainId);
+    if (transitive) {
+      params.set('transitive', 'true');
+    }
+    if (page.limit) {
+      params.set('limit', page.limit.toString());
+    }
+    if (page.cursor) {
+      params.set('cursor', page.cursor);
+    }
+    const query = params.toString() ? `?${params}` : '';
+
+    const response = await fetch(`${API_BASE_URL}/groups/${encodeURIComponent(groupDN)}/members${query}`, {
       headers: {
         'X-API-Key': API_KEY
       }
@@ -188,9 +230,10 @@ export async function searchGroupMembers(groupDN: string): Promise<SearchRespons
     }
     const data = await response.json();
     return {
-      data: data.data,
+      data: tagDomain(data.data || [], domainId),
       total_count: data.total_count,
-      truncated: false // We're now handling pagination server-side
+      truncated: Boolean(data.truncated),
+      next_cursor: data.next_cursor ?? null
     };
   } catch (err) {
     if (err instanceof TypeError && err.message === 'Failed to fetch') {
@@ -200,17 +243,107 @@ export async function searchGroupMembers(groupDN: string): Promise<SearchRespons
   }
 }
 
-export async function getGroupDetails(groupId: string): Promise<Group> {
+// Groups a user is in; with transitive, also those reached through nested groups
+export async function getUserGroups(
+  userDN: string,
+  transitive = false,
+  domainId?: number
+): Promise<SearchResponse<Group>> {
   try {
-    const response = await fetch(`${API_BASE_URL}/groups/${encodeURIComponent(groupId)}`, {
+    const params = new URLSearchParams();
+    setDomainParam(params, domainId);
+    if (transitive) {
+      params.set('transitive', 'true');
+    }
+    const query = params.toString() ? `?${params}` : '';
+    const response = await fetch(`${API_BASE_URL}/users/${encodeURIComponent(userDN)}/groups${query}`, {
       headers: {
         'X-API-Key': API_KEY
       }
     });
     if (!response.ok) {
-      throw new ApiError(response.status, 'Failed to fetch group details');
+      throw new ApiError(response.status, 'Failed to fetch user groups');
     }
     const data = await response.json();
+    return {
+      data: tagDomain(data.data || [], domainId),
+      total_count: data.total_count,
+      truncated: Boolean(data.truncated)
+    };
+  } catch (err) {
+    if (err instanceof TypeError && err.message === 'Failed to fetch') {
+      throw new ApiError(undefined, 'Connection failed');
+    }
+    throw err;
+  }
+}
+
+export interface Suggestion {
+  id: string;
+  name: string;
+  type: 'user' | 'group';
+  samAccountName: string | null;
+  email: string | null;
+}
+
+// Type-ahead matches from the backend's in-memory index; an empty list
+// while the index is still loading so typing never shows an error
+export async function getSuggestions(
+  query: string,
+  type: 'users' | 'groups',
+  domainId?: number,
+  signal?: AbortSignal
+): Promise<Suggestion[]> {
+  const params = new URLSearchParams({ q: query, type, limit: '8' });
+  if (domainId) {
+    params.set('domain_id', domainId.toString());
+  }
+  const response = await fetch(`${API_BASE_URL}/suggest?${params.toString()}`, {
+    headers: {
+      'X-API-Key': API_KEY
+    },
+    signal
+  });
+  if (response.status === 503 || response.status === 404) {
+    return [];
+  }
+  if (!response.ok) {
+    throw new ApiError(response.status, 'Failed to fetch suggestions');
+  }
+  const data = await response.json();
+  return data.data;
+}
+
+export interface LookupResponse<T> {
+  data: Record<string, T | null>;
+  missing: string[];
+}
+
+// Resolve many sAMAccountNames, UPNs, employee IDs or DNs in one request
+export async function lookupEntries<T = User>(
+  keys: string[],
+  type: 'users' | 'groups' = 'users',
+  fields?: string[],
+  domainId?: number
+): Promise<LookupResponse<T>> {
+  try {
+    const response = await fetch(`${API_BASE_URL}/lookup`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-API-Key': API_KEY
+      },
+      body: JSON.stringify({ keys, type, fields, domain_id: domainId })
+    });
+    if (!response.ok) {
+      throw new ApiError(response.status, 'Failed to look up entries');
+    }
+    const data: LookupResponse<T> = await response.json();
+    if (domainId) {
+      for (const [key, entry] of Object.entries(data.data)) {
+        data.data[key] = entry && ({ domain_id: domainId, ...entry } as T);
+      }
+    }
     return data;
   } catch (err) {
     if (err instanceof TypeError && err.message === 'Failed to fetch') {
@@ -220,6 +353,81 @@ export async function getGroupDetails(groupId: string): Promise<Group> {
   }
 }
 
+export interface OrgPerson {
+  id: string;
+  name: string | null;
+  title: string | null;
+  department: string | null;
+  email: string | null;
+  samAccountName: string | null;
+  enabled: boolean;
+  reportCount: number;
+  reports?: OrgPerson[];
+}
+
+interface OrgChartResponse {
+  user: OrgPerson;
+  chain?: OrgPerson[];
+}
+
+async function getOrgChart<T>(
+  path: string,
+  params: URLSearchParams,
+  domainId: number | undefined,
+  pick: (data: OrgChartResponse) => T
+): Promise<T | null> {
+  setDomainParam(params, domainId);
+  const query = params.toString() ? `?${params}` : '';
+  const response = await fetch(`${API_BASE_URL}${path}${query}`, {
+    headers: {
+      'X-API-Key': API_KEY
+    }
+  });
+  // Disabled or still loading: leave the org chart out rather than show an error
+  if (response.status === 503 || response.status === 404) {
+    return null;
+  }
+  if (!response.ok) {
+    throw new ApiError(response.status, 'Failed to fetch org chart');
+  }
+  return pick(await response.json());
+}
+
+// A user's managers, from the direct manager up to the top of the tree
+export async function getReportingChain(userDN: string, domainId?: number): Promise<OrgPerson[] | null> {
+  return getOrgChart(`/users/${encodeURIComponent(userDN)}/chain`, new URLSearchParams(), domainId,
+    data => data.chain ?? []);
+}
+
+// A user's reports, depth levels down, as a tree
+export async function getReports(userDN: string, depth = 1, domainId?: number): Promise<OrgPerson[] | null> {
+  return getOrgChart(`/users/${encodeURIComponent(userDN)}/reports`, new URLSearchParams({ depth: depth.toString() }),
+    domainId, data => data.user.reports ?? []);
+}
+
+export async function getGroupDetails(groupId: string, domainId?: number): Promise<Group> {
+  try {
+    const params = new URLSearchParams();
+    setDomainParam(params, domainId);
+    const query = params.toString() ? `?${params}` : '';
+    const response = await fetch(`${API_BASE_URL}/groups/${encodeURIComponent(groupId)}${query}`, {
+      headers: {
+        'X-API-Key': API_KEY
+      }
+    });
+    if (!response.ok) {
+      throw new ApiError(response.status, 'Failed to fetch group details');
+    }
+    const data = await response.json();
+    return tagDomain([data], domainId)[0];
+  } catch (err) {
+    if (err instanceof TypeError && err.message === 'Failed to fetch') {
+      throw new ApiError(undefined, 'Connection failed');
+    }
+    throw err;
+  }
+}
+
 export async function checkSetupStatus(): Promise<boolean> {
   const response = await fetch(`${API_BASE_URL}/admin/setup-status`, {
     headers: {
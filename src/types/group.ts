@@ -8,4 +8,6 @@ export interface Group {
   created: string;
   lastModified: string;
   memberCount?: number;
+  domain_id?: number;
+  domain?: string;
 }
\ No newline at end of file
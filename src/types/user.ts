@@ -23,4 +23,6 @@ export interface User {
   employeeID: string | null;
   postalCode: string;
   location?: string;
+  domain_id?: number;
+  domain?: string;
 }
\ No newline at end of file